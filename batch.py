@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import argparse
+import concurrent.futures
+import glob
+import os
+import subprocess
+import sys
+
+import level as compiler
+import skills
+import store
+
+# the output of every sim.py run, one log file per level and powerup
+LOGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tmp', 'batch')
+
+SIM = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sim.py')
+
+def level_files(patterns):
+    """the plist files of directories, globs and plain file names, sorted and without repeats"""
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            files += sorted(glob.glob(os.path.join(pattern, '*.plist')))
+        elif glob.has_magic(pattern):
+            files += sorted(glob.glob(pattern))
+        else:
+            files.append(pattern)
+    return list(dict.fromkeys(files))
+
+def missing(db, levelfile, digest, powerup, powers, target):
+    """the powers of a level and powerup that have no stored results for this version of the level"""
+    course, level_id = store.name(levelfile)
+    done = set(s['power'] for s in store.lookup(db, course, level_id, powerup, target=target) if s['hash'] == digest)
+    return [p for p in powers if p not in done]
+
+def plan(db, files, powerups, spec, target, force=False):
+    """the jobs (levelfile, powerup, skill levels) to run, one per level and powerup"""
+    jobs = []
+    for levelfile in files:
+        try:
+            # compile every level once up front, the sim.py runs then share the compiled level
+            digest = compiler.load(levelfile)['hash']
+        except Exception as ex:
+            print("Skipping", levelfile, ex)
+            continue
+        for powerup in powerups:
+            try:
+                table = skills.SKILLS[powerup]
+                wanted = skills.powers(spec, powerup)
+            except (KeyError, ValueError) as ex:
+                print("Skipping", levelfile, powerup, ex)
+                continue
+            todo = wanted if force else missing(db, levelfile, digest, powerup, wanted, target)
+            if not todo:
+                continue
+            # sim.py takes skill levels, pick the first level of every power
+            levels = sorted(set(table.index(p) + 1 for p in todo))
+            jobs.append((levelfile, powerup, levels))
+    return jobs
+
+def run(job, options):
+    """run sim.py headless for a job, logging its output. Returns the exit code."""
+    levelfile, powerup, levels = job
+    course, level_id = store.name(levelfile)
+    os.makedirs(LOGS, exist_ok=True)
+    log = os.path.join(LOGS, '{}_{}_{}.log'.format(course, level_id, powerup))
+    command = [sys.executable, SIM, levelfile, '-m', 'headless', '--no-show', '-u', powerup,
+            '--powers', ','.join(str(p) for p in levels)] + options
+    with open(log, 'w') as fd:
+        return subprocess.call(command, stdout=fd, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('./batch.py')
+    parser.add_argument('levels', type=str, help='level files, directories of level files or globs', nargs='+')
+    parser.add_argument('-p', '--powers', type=str, help='power skill levels to sweep, e.g. all, 1-13 or 5,9,13', nargs='?', default='13')
+    parser.add_argument('-u', '--powerups', type=str, help='comma separated powerups [regular, heavy, shield, sticky, tunnel, super]', nargs='?', default='regular')
+    parser.add_argument('-t', '--target', type=str, help='optimization target (distance, high, low, left, right)', nargs='?', default='distance')
+    parser.add_argument('-j', '--jobs', type=int, help='number of sim.py runs at the same time (0: one per core)', nargs='?', default=0)
+    parser.add_argument('-b', '--batch', type=int, help='number of balls to simulate together in one space, faster but approximate', nargs='?', default=1)
+    parser.add_argument('-d', '--delay', type=float, help='wait d seconds until taking your shot', nargs='?', default=3.05)
+    parser.add_argument('--search', type=str, help='headless search strategy [grid, adaptive]', nargs='?', default='grid')
+    parser.add_argument('--fast', help='skip through free flight analytically', action='store_true')
+    parser.add_argument('--db', type=str, help='results store', nargs='?', default=store.DATABASE)
+    parser.add_argument('--force', help='run every job, even if its results are stored and current', action='store_true')
+    args = parser.parse_args()
+
+    try:
+        db = store.connect(args.db)
+        jobs = plan(db, level_files(args.levels), args.powerups.split(','), args.powers, args.target, args.force)
+        db.close()
+    except Exception as ex:
+        print(ex)
+        sys.exit(1)
+
+    options = ['-t', args.target, '-b', str(args.batch), '-d', str(args.delay), '--search', args.search, '--db', args.db]
+    if args.fast:
+        options.append('--fast')
+
+    print("{} jobs to run".format(len(jobs)))
+    failed = 0
+    # every job saves its results when it is done, an interrupted batch picks up with the jobs that are missing
+    with concurrent.futures.ThreadPoolExecutor(args.jobs or os.cpu_count()) as pool:
+        futures = {pool.submit(run, job, options): job for job in jobs}
+        try:
+            for n, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                levelfile, powerup, levels = futures[future]
+                code = future.result()
+                if code:
+                    failed += 1
+                print("{}/{} {} {} P{} {}".format(n, len(jobs), levelfile, powerup, ','.join(str(p) for p in levels),
+                    "failed ({})".format(code) if code else "done"))
+        except KeyboardInterrupt:
+            # the running sim.py processes got the interrupt as well
+            for future in futures:
+                future.cancel()
+            print("Interrupted, run again to continue")
+            sys.exit(1)
+    if failed:
+        print("{} jobs failed, see {}".format(failed, LOGS))
+        sys.exit(1)
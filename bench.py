@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+import argparse
+import base64
+import contextlib
+import json
+import math
+import os
+import platform
+import struct
+import subprocess
+import sys
+import time
+import zlib
+
+import numpy
+
+import level as compiler
+from batch import level_files
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# synthetic levels, results and stats of the benchmark runs
+WORK = os.path.join(HERE, 'tmp', 'bench')
+
+# synthetic levels by name, each adds some of a kind of feature to a plain box
+SUITE = {
+        'plain': {},
+        'segments': {'segments': 2000},
+        'movers': {'movers': 8},
+        'masks': {'masks': 6},
+        'magnets': {'magnets': 4},
+        'portals': {'portals': 2},
+        'mixed': {'segments': 500, 'movers': 4, 'masks': 3, 'magnets': 2}
+        }
+
+# what the baseline comparison looks at, and whether more is better
+METRICS = {
+        'compile': False,
+        'load': False,
+        'setup': False,
+        'shots/s': True,
+        'steps/s': True,
+        'rss': False
+        }
+
+# changes smaller than this are noise, however large they are relative to the baseline
+NOISE = {
+        'compile': 0.01,
+        'load': 0.01,
+        'setup': 0.05,
+        'rss': 2.0
+        }
+
+def coord(*a):
+    """a coord in the serialized format of the level files, {1, 2}"""
+    return '{' + ', '.join(str(x) for x in a) + '}'
+
+def png(width, height, pixel):
+    """a minimal RGBA PNG, pixel(x, y) returns the colour of a pixel"""
+    raw = b''.join(b'\x00' + bytes(v for x in range(width) for v in pixel(x, y)) for y in range(height))
+    def chunk(type_, data):
+        return struct.pack('>I', len(data)) + type_ + data + struct.pack('>I', zlib.crc32(type_ + data) & 0xffffffff)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+def node(id_, type_, x, y, **fields):
+    """a level node of any type"""
+    n = {'id': id_, 'type': type_, 'position': coord(x, y), 'rotation-actions': [], 'position-actions': []}
+    n.update(fields)
+    return n
+
+def terrain(id_, x, y, points, rotation=0, **fields):
+    """a terrain node around a polygon given relative to its center, turned by rotation degrees"""
+    points = numpy.asarray(points, dtype=float)
+    width, height = points.max(axis=0) - points.min(axis=0)
+    # the vertices of a level file are relative to the corner of the node
+    corner = points + (width/2.0, height/2.0)
+    return node(id_, 'TerrainNode', x, y, width=str(width), height=str(height), collisionsEnabled='1',
+            **{'vertices-processed': [[coord(*p) for p in corner.tolist()]], 'node-rotation': str(rotation),
+               'terrain-offset': coord(0.5, 0.5)}, **fields)
+
+def box(w, h):
+    """the corners of a w x h rectangle around its center"""
+    return [(-w/2.0, -h/2.0), (w/2.0, -h/2.0), (w/2.0, h/2.0), (-w/2.0, h/2.0)]
+
+def synthetic(segments=0, movers=0, masks=0, magnets=0, portals=0):
+    """a level file as a dict: a 1500 x 2000 box with a tee and a flag on the ground, and the
+    given number of ground segments, movers, masked blocks, magnets and portal pairs"""
+    # the first node sets the top of the level, the second the right
+    nodes = [terrain('ceiling', 750, 2000, box(1500, 20)), terrain('right', 1500, 1000, box(20, 2000))]
+
+    # a bumpy ground between tee and flag, made of as many segments as asked for
+    # at least the two ends of a flat ground
+    xs = numpy.linspace(-750, 750, max(segments - 1, 2))
+    bumps = 10 * numpy.sin(xs / 40.0) * (numpy.abs(xs) < 500)
+    nodes.append(terrain('ground', 750, -50, [(-750, -100)] + list(zip(xs, 100 + bumps)) + [(750, -100)]))
+
+    # the features are where the shots of a default sweep (20-50 degrees at P13) fly, between
+    # 100 and 350 over the ground
+    for i in range(movers):
+        x, y = 350 + (i % 4) * 250, 160 + (i // 4) * 170
+        if i % 2:
+            rotation = [{'type': 'rotate', 'period': '2', 'rotation-rate': '90'}, {'type': 'delay-rotation', 'period': '1'}]
+            nodes.append(terrain('mover{}'.format(i), x, y, box(120, 20), **{'rotation-actions': rotation}))
+        else:
+            position = [{'type': 'position', 'period': '2', 'move-position': coord(0, 150)},
+                    {'type': 'delay-position', 'period': '0.5'},
+                    {'type': 'position', 'period': '2', 'move-position': coord(0, 0)}]
+            nodes.append(terrain('mover{}'.format(i), x, y, box(120, 20), **{'position-actions': position}))
+
+    for i in range(masks):
+        x, y = 475 + (i % 3) * 250, 240 - (i // 3) * 130
+        # acid on the left half, sticky everywhere else. The masks turn with the node, so on the
+        # last block, turned on its side, the acid is on the top or bottom half.
+        acid = png(20, 20, lambda px, py: (0, 255 if px < 10 else 0, 0, 255))
+        sticky = png(10, 10, lambda px, py: (0, 200, 0, 255))
+        nodes.append(terrain('masked{}'.format(i), x, y, box(100, 60), rotation=90 if i == masks - 1 else 0, **{
+            'texture-acid-mask': base64.b64encode(acid).decode(),
+            'texture-sticky-mask': base64.b64encode(sticky).decode()}))
+
+    for i in range(magnets):
+        nodes.append(node('magnet{}'.format(i), 'MagnetNode', 1200 - i * 300, 250, radius='150', strength='30'))
+
+    for i in range(portals):
+        # a pair of walls with a portal on their faces
+        ids = ('portal{}a'.format(i), 'portal{}b'.format(i))
+        for j, (id_, link) in enumerate((ids, ids[::-1])):
+            x, y = 450 + j * 500, 200 + i * 120
+            snap = {'type': 'PortalNode', 'id': id_, 'linked-portal-id': link, 'relative-position': coord(0, 12),
+                    'angle': str(math.pi/2 if j else -math.pi/2), 'radius': '3'}
+            nodes.append(terrain('wall' + id_, x, y, box(120, 20), **{'snapped-nodes': [snap]}))
+
+    nodes.append(node('start', 'StartPositionNode', 150, 60))
+    nodes.append(node('flag', 'FlagPositionNode', 1250, 60))
+    return {'gravity': '9.8', 'nodes': nodes}
+
+def write_suite(names):
+    """write the synthetic levels into the work directory, returns {name: file}"""
+    os.makedirs(WORK, exist_ok=True)
+    files = {}
+    for name in names:
+        files[name] = os.path.join(WORK, 'synthetic_{}.plist'.format(name))
+        with open(files[name], 'w') as fd:
+            json.dump(synthetic(**SUITE[name]), fd)
+    return files
+
+def load_times(levelfile):
+    """seconds to compile a level file from scratch, and to load it compiled"""
+    with open(levelfile, 'rb') as f:
+        data = json.loads(f.read())
+    t = time.perf_counter()
+    compiler.compile_level(data)
+    compiled = time.perf_counter() - t
+    compiler.load(levelfile)
+    t = time.perf_counter()
+    compiler.load(levelfile)
+    return compiled, time.perf_counter() - t
+
+def run(name, levelfile, options, timeout):
+    """sweep a level with sim.py, returns its metrics or None if the run failed"""
+    stats = os.path.join(WORK, name + '.stats.json')
+    log = os.path.join(WORK, name + '.log')
+    command = [sys.executable, os.path.join(HERE, 'sim.py'), levelfile, '-m', 'headless', '--no-show',
+            '--db', os.path.join(WORK, 'results.db'), '--stats', stats] + options
+    with open(log, 'w') as fd:
+        process = subprocess.Popen(command, stdout=fd, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+        deadline = time.time() + timeout
+        while True:
+            # wait4 returns the resource usage of this child alone, with its peak memory
+            pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                break
+            if time.time() > deadline:
+                process.kill()
+                pid, status, usage = os.wait4(process.pid, 0)
+                print(name, "timed out, see", log)
+                return None
+            time.sleep(0.05)
+    if status:
+        print(name, "failed, see", log)
+        return None
+
+    with open(stats) as fd:
+        s = json.load(fd)
+    compiled, loaded = load_times(levelfile)
+    sweep = max(s['timings']['sweep'], 1e-9)
+    return {
+            'level': levelfile,
+            'hash': s['hash'],
+            'compile': compiled,
+            'load': loaded,
+            'setup': s['timings']['load'],
+            'countdown': s['timings']['countdown'],
+            'sweep': s['timings']['sweep'],
+            'shots': s['shots'],
+            'steps': s['steps'],
+            'shots/s': s['shots'] / sweep,
+            'steps/s': s['steps'] / sweep,
+            'rss': usage.ru_maxrss / 1024.0 # MB
+            }
+
+def machine():
+    """what the benchmark ran on, to tell baselines of different machines apart"""
+    with contextlib.redirect_stdout(None):
+        import pymunk
+    return {
+            'python': platform.python_version(),
+            'pymunk': pymunk.version,
+            'numpy': numpy.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count()
+            }
+
+def compare(results, baseline, threshold):
+    """print how every metric changed against a baseline, returns the number of regressions"""
+    regressions = 0
+    for name, metrics in results.items():
+        old = baseline['levels'].get(name)
+        if old is None or metrics is None:
+            print("{:<20} no comparison".format(name))
+            continue
+        if old.get('hash') != metrics.get('hash'):
+            print("{:<20} the level changed since the baseline".format(name))
+        changes = []
+        for metric, more_is_better in METRICS.items():
+            if not old.get(metric):
+                continue
+            ratio = metrics[metric] / old[metric]
+            worse = ratio < 1 - threshold if more_is_better else ratio > 1 + threshold
+            worse = worse and abs(metrics[metric] - old[metric]) > NOISE.get(metric, 0)
+            regressions += worse
+            changes.append("{} {:+.0f}%{}".format(metric, (ratio - 1) * 100, " REGRESSION" if worse else ""))
+        print("{:<20} {}".format(name, ", ".join(changes)))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('./bench.py')
+    parser.add_argument('levels', type=str, help='real level files, directories of level files or globs to run besides the synthetic levels', nargs='*')
+    parser.add_argument('--synthetic', type=str, help='comma separated synthetic levels to run [{}], or none'.format(', '.join(SUITE)), nargs='?', default=','.join(SUITE))
+    parser.add_argument('--shots', type=int, help='number of angles to sweep per level', nargs='?', default=300)
+    parser.add_argument('-a', '--angle', type=float, help='first angle of the sweep', nargs='?', default=20.0)
+    parser.add_argument('-w', '--workers', type=int, help='number of worker processes of sim.py', nargs='?', default=1)
+    parser.add_argument('-b', '--batch', type=int, help='number of balls to simulate together in one space, faster but approximate', nargs='?', default=1)
+    parser.add_argument('--fast', help='skip through free flight analytically', action='store_true')
+    parser.add_argument('-r', '--repeat', type=int, help='run every level this many times and keep the fastest run', nargs='?', default=1)
+    parser.add_argument('--timeout', type=float, help='give up on a level after this many seconds', nargs='?', default=600)
+    parser.add_argument('--save', type=str, help='save the results as a baseline to this JSON file', nargs='?', default=None)
+    parser.add_argument('--compare', type=str, help='compare the results with a baseline saved before', nargs='?', default=None)
+    parser.add_argument('--threshold', type=float, help='relative change of a metric that counts as a regression', nargs='?', default=0.1)
+    args = parser.parse_args()
+
+    names = [n for n in args.synthetic.split(',') if n and n != 'none']
+    unknown = [n for n in names if n not in SUITE]
+    if unknown:
+        print("Unknown synthetic levels", unknown)
+        sys.exit(1)
+    levels = {'synthetic_' + n: f for n, f in write_suite(names).items()}
+    for f in level_files(args.levels):
+        levels[os.path.splitext(os.path.basename(f))[0]] = f
+
+    options = ['-a', str(args.angle), '--shots', str(args.shots), '-w', str(args.workers), '-b', str(args.batch)]
+    if args.fast:
+        options.append('--fast')
+
+    results = {}
+    print("{:<20} {:>8} {:>8} {:>8} {:>8} {:>10} {:>8}".format('level', 'compile', 'load', 'setup', 'shots/s', 'steps/s', 'rss MB'))
+    for name, levelfile in levels.items():
+        runs = [run(name, levelfile, options, args.timeout) for i in range(max(1, args.repeat))]
+        runs = [r for r in runs if r]
+        results[name] = max(runs, key=lambda r: r['shots/s']) if runs else None
+        r = results[name]
+        if r:
+            print("{:<20} {:>8.4f} {:>8.4f} {:>8.3f} {:>8.1f} {:>10.0f} {:>8.1f}".format(
+                name, r['compile'], r['load'], r['setup'], r['shots/s'], r['steps/s'], r['rss']))
+
+    report = {'machine': machine(), 'options': options, 'date': time.time(), 'levels': results}
+    if args.save:
+        with open(args.save, 'w') as fd:
+            json.dump(report, fd, indent=2)
+
+    failed = sum(r is None for r in results.values())
+    if args.compare:
+        with open(args.compare) as fd:
+            baseline = json.load(fd)
+        if baseline['machine'] != report['machine']:
+            print("The baseline was taken on another machine or with other libraries:", baseline['machine'])
+        if baseline['options'] != options:
+            print("The baseline was taken with other options:", baseline['options'])
+        failed += compare(results, baseline, args.threshold)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+import level as compiler
+import simulator as physics
+import store
+from spread import best_spreads
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SOCKET = os.path.join(HERE, 'tmp', 'swishulator.sock')
+
+SIM = os.path.join(HERE, 'sim.py')
+
+def order(count):
+    """the angles in tenths of a sweep from 0 to count tenths, coarse first, so a sweep that runs
+    out of time still covers the whole range and only misses the fine detail"""
+    return list(dict.fromkeys(a for step in (100, 50, 20, 10, 5, 2, 1) for a in range(0, count, step)))
+
+class Warm:
+    """a sim.py --serve process with a level in memory, for one powerup and target"""
+
+    def __init__(self, levelfile, powerup, target, options):
+        self.levelfile = levelfile
+        self.lock = threading.Lock()
+        self.used = time.time()
+        # the shots of the sweeps so far {power: {tenths: outcome}}, and the powers that are stored
+        self.shots = {}
+        self.saved = set()
+        # stopped to make room for other levels, sweeps still holding on to it go on in a new process
+        self.closed = False
+        self.process = subprocess.Popen([sys.executable, SIM, levelfile, '-m', 'headless', '--serve',
+            '-u', powerup, '-t', target] + options, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        # sim.py talks about its settings first, the first JSON line says it is ready
+        for line in self.process.stdout:
+            if line.startswith('{'):
+                ready = json.loads(line)
+                self.hash, self.flag = ready['hash'], ready['flag']
+                return
+        raise OSError("sim.py did not start for {}".format(levelfile))
+
+    def shoot(self, power, angles):
+        """outcomes [angle, dist, tdist, reason, x, y, cycle, ...] of shots at the given angles"""
+        self.process.stdin.write(json.dumps({'power': power, 'angles': angles}) + '\n')
+        line = self.process.stdout.readline()
+        if not line:
+            raise OSError("sim.py stopped for {}".format(self.levelfile))
+        return json.loads(line)['shots']
+
+    def close(self):
+        self.closed = True
+        self.process.stdin.close()
+        self.process.wait()
+
+class Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """the warm sim.py processes and the settings they are started with"""
+    daemon_threads = True
+
+    def __init__(self, path, args):
+        self.args = args
+        self.warm = {}
+        self.warm_lock = threading.Lock()
+        socketserver.UnixStreamServer.__init__(self, path, Handler)
+
+    def get_warm(self, levelfile, powerup, target):
+        """the warm process of a level, started if needed. The least recently used ones are stopped
+        when there are too many."""
+        k = (os.path.abspath(levelfile), powerup, target)
+        with self.warm_lock:
+            w = self.warm.get(k)
+            if w is not None and w.hash != compiler.load(levelfile)['hash']:
+                # the level file changed, the process simulates an old version
+                self.stop(self.warm.pop(k))
+                w = None
+            if w is None:
+                options = ['-b', str(self.args.batch), '-d', str(self.args.delay)] + (['--fast'] if self.args.fast else [])
+                w = self.warm[k] = Warm(levelfile, powerup, target, options)
+                for old in sorted(self.warm, key=lambda k: self.warm[k].used)[:-self.args.keep]:
+                    self.stop(self.warm.pop(old))
+            w.used = time.time()
+            return w
+
+    def stop(self, w):
+        """stop a warm process, once the volley a sweep may be shooting with it is done"""
+        with w.lock:
+            w.close()
+
+class Handler(socketserver.StreamRequestHandler):
+    """one client connection, one JSON request per line and one JSON answer per line"""
+
+    def handle(self):
+        db = store.connect(self.server.args.db)
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                answer = COMMANDS[request.get('cmd', 'sweep')](self.server, db, request, self.reply)
+            except Exception as ex:
+                answer = {'error': str(ex)}
+            if answer is not None:
+                self.reply(answer)
+        db.close()
+
+    def reply(self, answer):
+        self.wfile.write((json.dumps(answer) + '\n').encode())
+        self.wfile.flush()
+
+def resolve(server, request):
+    """(level file, course, level id) of a request with a 'file', a 'level' like dunes_3 or a
+    'course' and a 'level'. The level file is None if there is none in the levels directory."""
+    if request.get('file'):
+        course, level_id = store.name(request['file'])
+        return request['file'], course, level_id
+    name = str(request['level'])
+    if request.get('course') is not None:
+        name = '{}_{}'.format(request['course'], name)
+    levelfile = os.path.join(server.args.levels, name + '.plist')
+    course, level_id = store.name(levelfile)
+    return (levelfile if os.path.exists(levelfile) else None), course, level_id
+
+def settings(request):
+    """powerup, power and target of a request"""
+    return request.get('powerup', 'regular'), float(request.get('power', 41.1)), request.get('target', 'distance')
+
+def lookup(server, db, request, reply):
+    """the stored result of a level, and whether it was simulated with the current level file"""
+    levelfile, course, level_id = resolve(server, request)
+    powerup, power, target = settings(request)
+    found = store.lookup(db, course, level_id, powerup, power, target)
+    if not found:
+        return {'found': False, 'course': course, 'level': level_id}
+    s = found[0]
+    current = levelfile is not None and s['hash'] == compiler.load(levelfile)['hash']
+    return {'found': True, 'course': course, 'level': level_id, 'angle': s['best35'], 'best': s['best'], 'current': current}
+
+def warm(server, db, request, reply):
+    """start the sim.py process of a level ahead of the sweep, e.g. as soon as its id is seen"""
+    levelfile, course, level_id = resolve(server, request)
+    if levelfile is None:
+        return {'error': 'no level file for {}'.format(request)}
+    powerup, power, target = settings(request)
+    server.get_warm(levelfile, powerup, target)
+    return {'warm': True, 'course': course, 'level': level_id}
+
+def sweep(server, db, request, reply):
+    """the best angle of a level: from the store if it is current, else from a sweep that answers
+    after budget seconds with what it found so far, and then goes on to save the full sweep.
+    Requests for the same level share the sweep, each one picks up the angles still missing."""
+    found = lookup(server, db, request, reply)
+    if found.get('current'):
+        found['source'] = 'store'
+        return found
+    levelfile, course, level_id = resolve(server, request)
+    if levelfile is None:
+        return {'error': 'no level file for {}'.format(request)}
+    powerup, power, target = settings(request)
+    budget = float(request.get('budget', server.args.budget))
+    deadline = time.time() + budget
+
+    count = physics.sweep_count(powerup)
+    angles = order(count)
+
+    w = server.get_warm(levelfile, powerup, target)
+    shots = w.shots.setdefault(power, {})
+    answered = False
+    i = 0
+    while i < len(angles):
+        # one volley at a time, so a request that comes in meanwhile can answer in time
+        with w.lock:
+            closed = w.closed
+            if not closed:
+                todo = [a for a in angles[i:i+server.args.batch] if a not in shots]
+                if todo:
+                    for shot in w.shoot(power, [a / 10.0 for a in todo]):
+                        shots[round(shot[0] * 10)] = shot[1:]
+        if closed:
+            # the process was stopped for another level meanwhile, go on in a new one
+            old, w = w, server.get_warm(levelfile, powerup, target)
+            with w.lock:
+                if w.hash == old.hash:
+                    w.shots.setdefault(power, {}).update(shots)
+                else:
+                    # the level file changed, the shots so far are of the old version
+                    i = 0
+                shots = w.shots.setdefault(power, {})
+            continue
+        i += server.args.batch
+        if not answered and time.time() > deadline:
+            reply(answer(course, level_id, dict(shots), count, False))
+            answered = True
+
+    result = answer(course, level_id, dict(shots), count, True)
+    with w.lock:
+        if power not in w.saved:
+            store.save(db, course, level_id, powerup, power, target, shots, hash=w.hash, search='daemon',
+                    init=0, count=count, best=result['best'], best35=result['angle'], flagx=w.flag[0], flagy=w.flag[1])
+            w.saved.add(power)
+    return None if answered else result
+
+def answer(course, level_id, shots, count, complete):
+    """the best single shot and the best 3.5 degree spread of the shots so far, of a sweep of count
+    tenths. Angles that were not simulated yet are interpolated between their neighbours."""
+    results = {a: shot[0] for a, shot in shots.items()}
+    scored = [a for a, shot in shots.items() if shot[2] != "Dead" and shot[0] < 1e10]
+    best = min(scored, key=lambda a: (shots[a][0], a)) / 10.0 if scored else None
+    angle = best_spreads(results, 0, count, [35], missing='interpolate')[35]
+    return {'source': 'sweep', 'course': course, 'level': level_id, 'angle': angle, 'best': best,
+            'complete': complete, 'shots': len(shots)}
+
+COMMANDS = {
+        'lookup': lookup,
+        'warm': warm,
+        'sweep': sweep
+        }
+
+def ask(request, path=SOCKET, timeout=None):
+    """send a request to the daemon and return the first answer"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(path)
+        s.sendall((json.dumps(request) + '\n').encode())
+        return json.loads(s.makefile().readline())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('./daemon.py')
+    parser.add_argument('--socket', type=str, help='unix socket to listen on', nargs='?', default=SOCKET)
+    parser.add_argument('--levels', type=str, help='directory of the level files, named like dunes_3.plist', nargs='?', default='.')
+    parser.add_argument('--db', type=str, help='results store', nargs='?', default=store.DATABASE)
+    parser.add_argument('--budget', type=float, help='seconds until a sweep answers with what it found so far', nargs='?', default=0.5)
+    parser.add_argument('--keep', type=int, help='number of levels to keep in memory', nargs='?', default=4)
+    parser.add_argument('-b', '--batch', type=int, help='number of balls to simulate together in one space, faster but approximate', nargs='?', default=1)
+    parser.add_argument('-d', '--delay', type=float, help='wait d seconds until taking your shot', nargs='?', default=3.05)
+    parser.add_argument('--fast', help='skip through free flight analytically', action='store_true')
+    parser.add_argument('--ask', type=str, help='send this JSON request to a running daemon and print the answer', nargs='?', default=None)
+    args = parser.parse_args()
+
+    if args.keep < 1:
+        print("--keep needs to be at least 1, the level of the current request stays in memory")
+        sys.exit(1)
+
+    if args.ask:
+        try:
+            print(json.dumps(ask(json.loads(args.ask), args.socket)))
+        except (OSError, ValueError) as ex:
+            print(ex)
+            sys.exit(1)
+        sys.exit(0)
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    server = Daemon(args.socket, args)
+    print("Listening on", args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for w in server.warm.values():
+            w.close()
+        os.unlink(args.socket)
@@ -0,0 +1,44 @@
+import numpy
+
+def compile_fields(rows):
+    """the force fields of a level as arrays, one row per field, so a sensor shape only needs to
+    know its row. A row is either an antigrav field {'push': (ax, ay)}, a constant change of the
+    velocity of a ball inside it every step, or a magnet {'center': (x, y), 'radius': r,
+    'strength': s}, which pushes a ball closer than r to its center away from it by
+    s / d^2 * 10000 per unit of time (pulls it for a negative strength)."""
+    n = len(rows)
+    table = {
+        'push': numpy.zeros((n, 2)),
+        'magnet': numpy.zeros(n, dtype=bool),
+        'center': numpy.zeros((n, 2)),
+        'radius': numpy.zeros(n),
+        'strength': numpy.zeros(n)
+        }
+    for i, row in enumerate(rows):
+        if 'push' in row:
+            table['push'][i] = row['push']
+        else:
+            table['magnet'][i] = True
+            table['center'][i] = row['center']
+            table['radius'][i] = row['radius']
+            table['strength'][i] = row['strength']
+    return table
+
+def active(table, inside):
+    """what the fields of the rows a ball is inside do to it: (the constant push of the antigrav
+    fields as a tuple, the rows of the magnets). Only changes when the ball enters or leaves a field."""
+    rows = numpy.array(sorted(inside), dtype=int)
+    push = table['push'][rows].sum(axis=0)
+    return (float(push[0]), float(push[1])), rows[table['magnet'][rows]]
+
+def pull(table, magnets, x, y, step):
+    """the change of velocity (dx, dy) of a ball at (x, y) from the magnet rows it is inside,
+    for one step of length step"""
+    offsets = numpy.array((x, y)) - table['center'][magnets]
+    d = numpy.hypot(offsets[:, 0], offsets[:, 1])
+    near = (d < table['radius'][magnets]) & (d > 0)
+    d = d[near]
+    # strength / d^2 along the unit vector from the center to the ball
+    p = table['strength'][magnets][near] / d / d * step * 10000 / d
+    dx, dy = (p[:, None] * offsets[near]).sum(axis=0)
+    return float(dx), float(dy)
@@ -0,0 +1,70 @@
+import numpy
+
+# side of a cell of the segment grid, in level units
+CELL = 64.0
+
+def index(capsules, clearance, cell=CELL):
+    """a uniform grid over capsules (x0, y0, x1, y1, radius). Each capsule is listed in every
+    cell that its bounding box, grown by clearance, touches."""
+    caps = numpy.asarray(capsules, dtype=float).reshape(-1, 5)
+    grow = caps[:, 4:5] + clearance
+    lo = numpy.minimum(caps[:, 0:2], caps[:, 2:4]) - grow
+    hi = numpy.maximum(caps[:, 0:2], caps[:, 2:4]) + grow
+    origin = lo.min(axis=0) if len(caps) else numpy.zeros(2)
+
+    c0 = numpy.floor((lo - origin) / cell).astype(int)
+    c1 = numpy.floor((hi - origin) / cell).astype(int)
+    shape = c1.max(axis=0) + 1 if len(caps) else numpy.ones(2, dtype=int)
+
+    # one entry per (capsule, cell) pair, sorted by cell
+    nx = c1[:, 0] - c0[:, 0] + 1
+    counts = nx * (c1[:, 1] - c0[:, 1] + 1)
+    owner = numpy.repeat(numpy.arange(len(caps)), counts)
+    local = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    cx = c0[owner, 0] + local % nx[owner]
+    cy = c0[owner, 1] + local // nx[owner]
+    cells = cx * shape[1] + cy
+    order = numpy.argsort(cells, kind='stable')
+    return {
+        'caps': caps,
+        'clearance': clearance,
+        'cell': cell,
+        'origin': origin,
+        'shape': shape,
+        'members': owner[order],
+        'starts': numpy.searchsorted(cells[order], numpy.arange(shape[0] * shape[1] + 1))
+        }
+
+def first_hit(grid, points):
+    """index of the first point that comes within clearance of a capsule, or len(points)"""
+    cells = numpy.floor((points - grid['origin']) / grid['cell']).astype(int)
+    inside = numpy.all((cells >= 0) & (cells < grid['shape']), axis=1)
+    ids = numpy.where(inside, cells[:, 0] * grid['shape'][1] + cells[:, 1], 0)
+    begin = grid['starts'][ids]
+    counts = numpy.where(inside, grid['starts'][ids + 1] - begin, 0)
+
+    # every point against every capsule listed in its cell
+    point = numpy.repeat(numpy.arange(len(points)), counts)
+    local = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    caps = grid['caps'][grid['members'][begin[point] + local]]
+
+    p = points[point]
+    a = caps[:, 0:2]
+    ab = caps[:, 2:4] - a
+    length = numpy.einsum('ij,ij->i', ab, ab)
+    t = numpy.clip(numpy.einsum('ij,ij->i', p - a, ab) / numpy.where(length > 0, length, 1), 0, 1)
+    gap = numpy.hypot(*(p - a - ab * t[:, None]).T) - caps[:, 4]
+    hits = point[gap < grid['clearance']]
+    return int(hits.min()) if len(hits) else len(points)
+
+def coast(position, velocity, gravity, dt, steps):
+    """positions and velocities of a ball in free flight after 1..steps physics steps, shape
+    (steps, 2) each. Chipmunk moves the ball with its old velocity before applying gravity. The
+    sums are accumulated one step after the other like chipmunk does, so they come out bit for bit
+    the same as stepping."""
+    position = numpy.asarray(position, dtype=float)
+    velocity = numpy.asarray(velocity, dtype=float)
+    gravity = numpy.asarray(gravity, dtype=float)
+    v = numpy.add.accumulate(numpy.vstack((velocity, numpy.tile(gravity * dt, (steps, 1)))), axis=0)
+    p = numpy.add.accumulate(numpy.vstack((position, v[:-1] * dt)), axis=0)
+    return p[1:], v[1:]
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+import skills
+import store
+
+# the best angles of the results store and results.json, sorted by course, level, powerup and power
+INDEX = 'results.idx'
+
+MAGIC = b'SWIX0001'
+HEADER = struct.Struct('<8sI')
+# course, level, powerup (zero padded), power, angle
+RECORD = struct.Struct('<24s16s16sff')
+KEY = 24 + 16 + 16
+
+# the best angles of two neighbouring sampled powers further apart than this (degrees) belong
+# to different shots, an angle between them hits neither
+JUMP = 5.0
+
+def key(course, level_id, powerup):
+    """the padded bytes a level and powerup is sorted by, None if a field is too long"""
+    fields = [str(f).encode() for f in (course, level_id, powerup)]
+    if any(len(f) > n for f, n in zip(fields, (24, 16, 16))):
+        return None
+    return b''.join(f.ljust(n, b'\0') for f, n in zip(fields, (24, 16, 16)))
+
+def entries(db=None, besties=None, target='distance'):
+    """{(course, level id, powerup, power): angle} of a results.json dict and of the store, the
+    store wins where both have a power"""
+    found = {}
+    for course, levels in (besties or {}).items():
+        for level_id, keys in levels.items():
+            for k, angle in keys.items():
+                powerup, power = store.parse_key(k)
+                found[(course, str(level_id), powerup, power)] = angle
+    if db is not None:
+        for s in store.lookup(db, target=target):
+            if s['best35'] is not None:
+                found[(s['course'], s['level'], s['powerup'], s['power'])] = s['best35']
+    return found
+
+def build(found, path=INDEX):
+    """write the index of entries(), returns the number of records"""
+    records = []
+    for (course, level_id, powerup, power), angle in found.items():
+        k = key(course, level_id, powerup)
+        if k is None:
+            print("Skipping", course, level_id, powerup, "name too long")
+            continue
+        records.append((k, power, angle))
+    records.sort()
+    # write and rename, so a reader never maps half a file
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as fd:
+        fd.write(HEADER.pack(MAGIC, len(records)))
+        for k, power, angle in records:
+            fd.write(RECORD.pack(k[:24], k[24:40], k[40:], power, angle))
+    os.replace(tmp, path)
+    return len(records)
+
+def interpolate(sampled, power):
+    """(angle, confidence) at a power from [(power, angle)] sampled at other powers, sorted by power.
+    The confidence is 'exact' at a sampled power and 'interpolated' between two sampled powers with
+    close angles. Between powers where the best angle jumps, and outside the sampled powers, it is
+    'low' and the angle is the one of the nearest sampled power."""
+    if not sampled:
+        return None, None
+    below = [s for s in sampled if s[0] <= power + 1e-3]
+    above = [s for s in sampled if s[0] >= power - 1e-3]
+    if below and above and abs(below[-1][0] - above[0][0]) < 2e-3:
+        return round(below[-1][1], 1), 'exact'
+    if not below or not above:
+        return round((below or above)[-1 if below else 0][1], 1), 'low'
+    (p0, a0), (p1, a1) = below[-1], above[0]
+    if abs(a1 - a0) > JUMP:
+        return round(a0 if power - p0 < p1 - power else a1, 1), 'low'
+    return round(a0 + (a1 - a0) * (power - p0) / (p1 - p0), 1), 'interpolated'
+
+class Index:
+    """the index file mapped into memory, for many lookups without reading it"""
+
+    def __init__(self, path=INDEX):
+        with open(path, 'rb') as fd:
+            self.map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError("{} is not a results index".format(path))
+
+    def powers(self, course, level_id, powerup='regular'):
+        """[(power, angle)] sampled for a level and powerup, sorted by power"""
+        k = key(course, level_id, powerup)
+        if k is None:
+            return []
+        # binary search for the first record of the level
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            at = HEADER.size + mid * RECORD.size
+            if self.map[at:at+KEY] < k:
+                lo = mid + 1
+            else:
+                hi = mid
+        sampled = []
+        for i in range(lo, self.count):
+            at = HEADER.size + i * RECORD.size
+            if self.map[at:at+KEY] != k:
+                break
+            sampled.append(struct.unpack_from('<ff', self.map, at + KEY))
+        return sampled
+
+    def lookup(self, course, level_id, powerup='regular', power=41.1):
+        """(angle, confidence) of a level at a power, see interpolate(). (None, None) if the level
+        was never simulated with this powerup."""
+        return interpolate(self.powers(course, level_id, powerup), power)
+
+def stale(path=INDEX, db=store.DATABASE, results='results.json'):
+    """whether the index is missing or older than the store or results.json"""
+    if not os.path.exists(path):
+        return True
+    built = os.path.getmtime(path)
+    return any(os.path.exists(f) and os.path.getmtime(f) > built for f in (db, db + '-wal', results))
+
+def rebuild(path=INDEX, db=store.DATABASE, results='results.json', target='distance'):
+    """build the index of the store and results.json, either may be missing. Returns the number of records."""
+    besties = None
+    if os.path.exists(results):
+        with open(results) as fd:
+            besties = json.load(fd)
+    connection = store.connect(db) if os.path.exists(db) else None
+    try:
+        return build(entries(connection, besties, target), path)
+    finally:
+        if connection is not None:
+            connection.close()
+
+def load(path=INDEX, db=store.DATABASE, results='results.json', target='distance'):
+    """the index, built anew first if it is stale"""
+    if stale(path, db, results):
+        rebuild(path, db, results, target)
+    return Index(path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('./index.py')
+    parser.add_argument('command', type=str, help='what to do [build, query]', nargs=1)
+    parser.add_argument('course', type=str, help='course to query', nargs='?', default=None)
+    parser.add_argument('level', type=str, help='level to query', nargs='?', default=None)
+    parser.add_argument('-n', '--newton', type=float, help='ball power (NoodleNewton)', nargs='?', default=None)
+    parser.add_argument('-p', '--power', type=int, help='ball power (P1-13)', nargs='?', default=13)
+    parser.add_argument('-u', '--powerup', type=str, help='powerup selection [regular, heavy, shield, sticky, tunnel, super]', nargs='?', default='regular')
+    parser.add_argument('-t', '--target', type=str, help='optimization target of the results', nargs='?', default='distance')
+    parser.add_argument('--index', type=str, help='index file', nargs='?', default=INDEX)
+    parser.add_argument('--db', type=str, help='results store', nargs='?', default=store.DATABASE)
+    parser.add_argument('--results', type=str, help='results.json to index along with the store', nargs='?', default='results.json')
+    args = parser.parse_args()
+
+    try:
+        command = args.command[0]
+        if command == 'build':
+            print("Indexed", rebuild(args.index, args.db, args.results, args.target), "results")
+        elif command == 'query':
+            power = args.newton or skills.SKILLS[args.powerup][args.power-1]
+            index = load(args.index, args.db, args.results, args.target)
+            started = time.perf_counter()
+            angle, confidence = index.lookup(args.course, args.level, args.powerup, power)
+            took = time.perf_counter() - started
+            if angle is None:
+                print("No results for", args.course, args.level, args.powerup)
+                sys.exit(1)
+            print("{} {} {} {}: {} ({}, {:.0f} us)".format(args.course, args.level, args.powerup, power, angle, confidence, took * 1e6))
+        else:
+            print("Unknown command", command)
+            sys.exit(1)
+    except (OSError, ValueError, KeyError) as ex:
+        print(ex)
+        sys.exit(1)
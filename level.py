@@ -0,0 +1,350 @@
+import base64
+import hashlib
+import json
+import math
+import numpy
+import os
+import shutil
+import tempfile
+
+import masks as masking
+
+# bump when the compiled layout changes, older compiled levels are then rebuilt
+FORMAT = 1
+
+# compiled levels, one directory per hash of the source file
+CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tmp', 'levels')
+
+def loads_coord(s):
+    """load strange serialized coord lists {1,2,3...}"""
+    return json.loads(s.replace('{','[').replace('}',']'))
+
+def coords(strings):
+    """load a list of serialized coords in one go, as an array of shape (n, 2)"""
+    return numpy.array(loads_coord('[' + ','.join(strings) + ']'), dtype=float)
+
+def ring(points):
+    """segments (x0, y0, x1, y1) around a closed polygon of shape (n, 2)"""
+    return numpy.hstack((points, numpy.roll(points, -1, axis=0)))
+
+def square(c):
+    """corners of the rectangle between two points, in the order of make_square in simulator.py"""
+    (x1, y1), (x2, y2) = c
+    return numpy.array([(x1,y1),(x1,y2),(x2,y2),(x2,y1)], dtype=float)
+
+def actions(id_, node, rotations, translations):
+    """collect the rotation and position actions of a node into step sequences"""
+    for r in node.get('rotation-actions') or []:
+        sequence = rotations.get(id_,{"steps":[]})
+        rtype = r['type'] # Cool game
+        period = float(r['period'])
+        step = {"type": rtype,
+                "period": period}
+        sequence['duration'] = sequence.get('duration',0.0) + period
+        if rtype=='delay-rotation':
+            # just append the duration to step, do nothing
+            pass
+        elif rtype=='rotate':
+            step['rotation-rate'] = float(r['rotation-rate'])
+            #interpolate-mode?
+        else:
+            raise ValueError("UNKNOWN ROTATION ACTION {}".format(rtype))
+        sequence['steps'].append(step)
+        rotations[id_]=sequence
+
+    old = (0,0)
+    for t in node.get('position-actions') or []:
+        sequence = translations.get(id_,{"steps":[]})
+        ttype = t['type']
+        period = float(t['period'])
+        sequence['duration'] = sequence.get('duration',0.0) + period
+        step = {"type": ttype,
+                "period": period}
+        if ttype == 'position':
+            rel = loads_coord(t['move-position'])
+            step['move-position'] = (rel[0]-old[0], rel[1]-old[1])
+            old = rel
+            #interpolate-mode?
+        elif ttype == 'delay-position':
+            pass
+        else:
+            raise ValueError("UNKNOWN POSITION ACTION {}".format(ttype))
+        sequence['steps'].append(step)
+        translations[id_]=sequence
+
+def compile_level(data):
+    """turn a parsed level plist into (meta, segments, images).
+
+    meta holds typed records in node order, segments all terrain and hazard lines as one
+    array of shape (n, 4) and images the mask PNGs by name. All positions are in level
+    coordinates, simulator.py shifts them by the screen_center of its Level when it builds the space."""
+    nodes = data['nodes']
+    rotations = {}
+    translations = {}
+    records = []
+    segments = []
+    images = {}
+    count = 0
+    start = flag = None
+
+    def add_segments(s):
+        nonlocal count
+        segments.append(s)
+        count += len(s)
+        return [count - len(s), count]
+
+    for node in nodes:
+        id_ = node['id']
+        pos = loads_coord(node['position'])
+        type_ = node['type']
+        width = float(node.get('width',0))
+        height = float(node.get('height',0))
+        moving = bool(node.get('rotation-actions') or node.get('position-actions'))
+
+        if type_ == 'TerrainNode' and node['collisionsEnabled'] != "0":
+            center = numpy.array((width/2.0, height/2.0))
+            lines = [ring(coords(shape) - center) for shape in node['vertices-processed'] if shape]
+            records.append({
+                'kind': 'terrain',
+                'id': id_,
+                'pos': pos,
+                'rotation': loads_coord(node['node-rotation']),
+                'moving': moving,
+                'segments': add_segments(numpy.vstack(lines) if lines else numpy.zeros((0, 4)))
+                })
+
+        if type_ == 'GravityFieldNode':
+            node_anchor = loads_coord(node['node-anchor'])
+            size = loads_coord(node['size'])
+
+            #TODO FIXME: relative anchor is correct, position is not when anchor>0
+            center = (size[0]/2.0, size[1]/2.0)
+            anchored = (-size[0]*node_anchor[0], -size[1]*node_anchor[1])
+            records.append({
+                'kind': 'field',
+                'id': id_,
+                'pos': pos,
+                'rotation': loads_coord(node['node-rotation']),
+                'center-of-gravity': [-(center[0]+anchored[0]), -(center[1]+anchored[1])],
+                'vertices': square(((-center[0], -center[1]), center)).tolist(),
+                'dir': loads_coord(node['dir']),
+                'strength': loads_coord(node['strength'])
+                })
+
+        actions(id_, node, rotations, translations)
+
+        for type_mask in ('acid', 'sticky'):
+            png = node.get('texture-{}-mask'.format(type_mask))
+            if png:
+                png = base64.b64decode(png)
+                k = masking.key(png, type_mask, int(width), int(height))
+                images[k + '.png'] = png
+                records.append({
+                    'kind': 'mask',
+                    'id': id_,
+                    'type': type_mask,
+                    'width': int(width),
+                    'height': int(height),
+                    'pos': pos,
+                    'key': k
+                    })
+
+        if type_ == 'SandTrapNode':
+            if not node.get('hazard-lines'):
+                continue
+            records.append({
+                'kind': 'sand',
+                'pos': pos,
+                'segments': add_segments(ring(square(loads_coord(node['hazard-lines'][0]))))
+                })
+
+        if type_ == 'WaterHazardNode':
+            records.append({
+                'kind': 'water',
+                'pos': pos,
+                'segments': add_segments(ring(square(loads_coord(node['hazard-lines'][0]))))
+                })
+
+        if type_ == 'MagnetNode':
+            records.append({
+                'kind': 'magnet',
+                'pos': pos,
+                'radius': loads_coord(node['radius']),
+                'strength': loads_coord(node['strength']),
+                'snapped': False
+                })
+
+        if type_ == 'KillSawNode':
+            records.append({
+                'kind': 'saw',
+                'id': id_,
+                'pos': pos,
+                'radius': loads_coord(node['radius'])
+                })
+
+        if type_ == "StartPositionNode":
+            start = {'pos': pos}
+        if type_ == "FlagPositionNode":
+            flag = {'pos': pos}
+
+        for snap in node.get('snapped-nodes',[]):
+            stype = snap['type']
+            if stype in ('StartPositionNode', 'FlagPositionNode'):
+                offset = loads_coord(node['terrain-offset'])
+                placed = {
+                        'pos': pos,
+                        'shift': [width*-offset[0], height*-offset[1]],
+                        'snap': loads_coord(snap['position'])
+                        }
+                if stype == 'StartPositionNode':
+                    start = placed
+                else:
+                    flag = placed
+
+            elif stype=='PortalNode':
+                x, y = loads_coord(snap['relative-position'])
+                a = loads_coord(snap['angle'])
+                radius = loads_coord(snap['radius'])
+
+                dx = -radius * math.sin(a) * 10
+                dy = radius * math.cos(a) * 10
+                records.append({
+                    'kind': 'portal',
+                    'body': id_,
+                    'id': snap['id'],
+                    'link': snap['linked-portal-id'],
+                    'angle': a,
+                    'a': (x+dx, y+dy),
+                    'b': (x-dx, y-dy)
+                    })
+
+            elif stype=='LaserNode':
+                x, y = loads_coord(snap['relative-position'])
+                a = loads_coord(snap['angle'])
+
+                radius = 200 # FIXME until it hits a wall?
+                # TODO: we will check collisions for the sensor and adjust the length of the laser accordingly
+                rsens  = 80
+                records.append({
+                    'kind': 'laser',
+                    'body': id_,
+                    'on': float(loads_coord(snap['phaseOnDuration'])),
+                    'off': float(loads_coord(snap['phaseOffDuration'])),
+                    'a': (x, y),
+                    'sensor': (x + rsens * math.cos(a), y + rsens * math.sin(a)),
+                    'beam': (x + radius * math.cos(a), y + radius * math.sin(a))
+                    })
+
+            elif stype == 'MagnetNode':
+                # no shift?
+                records.append({
+                    'kind': 'magnet',
+                    'pos': pos,
+                    'radius': loads_coord(snap['radius']),
+                    'strength': loads_coord(snap['strength']),
+                    'snapped': True
+                    })
+
+    if start is None or flag is None:
+        raise ValueError("Level has no start or flag position")
+
+    meta = {
+        'format': FORMAT,
+        'top': loads_coord(nodes[0]['position'])[1],
+        'right': loads_coord(nodes[1]['position'])[0],
+        'gravity': float(data['gravity']),
+        'start': start,
+        'flag': flag,
+        'records': records,
+        'rotations': rotations,
+        'translations': translations
+        }
+    return meta, numpy.vstack(segments) if segments else numpy.zeros((0, 4)), images
+
+def save(path, meta, segments, images):
+    """write a compiled level directory, renamed into place so readers never see half of it"""
+    os.makedirs(CACHE, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=CACHE, suffix='.tmp')
+    try:
+        for name, png in images.items():
+            with open(os.path.join(tmp, name), 'wb') as f:
+                f.write(png)
+        numpy.save(os.path.join(tmp, 'segments.npy'), segments)
+        # meta last, a directory without it is not a compiled level
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        os.rename(tmp, path)
+    except OSError:
+        # another process compiled the same level first, or the cache is not writable
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            raise
+
+def retire(path):
+    """move a compiled level of an older format out of the way, renamed aside before it is
+    removed, so no process ever sees it half deleted"""
+    aside = tempfile.mkdtemp(dir=CACHE, suffix='.old')
+    moved = os.path.join(aside, 'level')
+    try:
+        os.rename(path, moved)
+    except FileNotFoundError:
+        # another process retired it first
+        os.rmdir(aside)
+        return
+    try:
+        with open(os.path.join(moved, 'meta.json')) as f:
+            current = json.load(f).get('format') == FORMAT
+    except (OSError, ValueError):
+        current = False
+    if current:
+        # another process retired the old one and compiled the level anew meanwhile, put it back
+        # (unless a third one was quicker still)
+        try:
+            os.rename(moved, path)
+        except OSError:
+            pass
+    shutil.rmtree(aside, ignore_errors=True)
+
+def load(filename):
+    """the compiled form of a level plist as a dict, compiling it on first use.
+
+    Besides the meta records, the dict holds 'segments' (memory mapped from the cache),
+    'hash' (sha256 of the source file) and 'dir' (where mask PNGs are, see image())."""
+    with open(filename, 'rb') as f:
+        source = f.read()
+    digest = hashlib.sha256(source).hexdigest()
+    path = os.path.join(CACHE, digest)
+
+    outdated = False
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            level = json.load(f)
+        if level.get('format') != FORMAT:
+            outdated = True
+            raise ValueError("outdated compiled level")
+        segments = os.path.join(path, 'segments.npy')
+        # empty arrays cannot be memory mapped
+        level['segments'] = numpy.load(segments, mmap_mode='r' if os.path.getsize(segments) > 128 else None)
+    except (OSError, ValueError):
+        level, segments, images = compile_level(json.loads(source))
+        try:
+            if outdated:
+                retire(path)
+            save(path, level, segments, images)
+        except OSError as x:
+            print("Cannot cache level:", x)
+            path = None
+            level['images'] = images
+        level['segments'] = segments
+
+    level['hash'] = digest
+    level['dir'] = path
+    return level
+
+def image(level, record):
+    """the PNG bytes of a mask record"""
+    name = record['key'] + '.png'
+    if level.get('images'):
+        return level['images'][name]
+    with open(os.path.join(level['dir'], name), 'rb') as f:
+        return f.read()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import re
+import stat
+import sys
+import time
+
+import level as compiler
+import skills
+import store
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SIM = os.path.join(HERE, 'sim.py')
+
+# what listen.sh greps for in the captured packets, and the course sent along with a bare level number
+LEVEL = re.compile(rb'level["_]([^,}]*),')
+COURSE = re.compile(rb'course["_]([^,}]*),')
+# how much of a chunk to keep for a match that goes on in the next chunk
+TAIL = 256
+
+def parse(text, course=None):
+    """(course, level id) of a matched level field like _dunes_3 or ":"dunes_3", or with a bare
+    level number, of the course seen last. None if it cannot be told."""
+    m = re.search(r'([A-Za-z]+)_(\d+)', text)
+    if m:
+        return m.group(1), m.group(2)
+    m = re.search(r'(\d+)', text)
+    if m and course:
+        return course, m.group(1)
+    return None
+
+def word(text):
+    """a course name out of a matched course field"""
+    m = re.search(r'[A-Za-z]+', text)
+    return m.group(0) if m else None
+
+def emit(course, level_id, answer):
+    """print the angle to shoot with for a level as soon as it is known"""
+    if answer.get('angle') is None:
+        print("{} {}: {}".format(course, level_id, answer.get('error', 'no shot found')), flush=True)
+        return
+    print("{} {}: {} ({}{}) ./angle.py {}".format(course, level_id, answer['angle'], answer['source'],
+        '' if answer.get('complete', True) else ', incomplete', answer['angle']), flush=True)
+
+def stored(args, course, level_id):
+    """the stored result of a level if it was simulated with the current level file, else None.
+    This reads the store and may compile the level, run it off the event loop with lookup()."""
+    db = store.connect(args.db)
+    try:
+        found = store.lookup(db, course, level_id, args.powerup, args.power, args.target)
+    finally:
+        db.close()
+    levelfile = os.path.join(args.levels, '{}_{}.plist'.format(course, level_id))
+    if not found or not os.path.exists(levelfile) or found[0]['hash'] != compiler.load(levelfile)['hash']:
+        return None
+    return {'angle': found[0]['best35'], 'source': 'store'}
+
+async def lookup(args, course, level_id):
+    """stored() in a thread, so the listener and the other levels go on meanwhile"""
+    return await asyncio.get_running_loop().run_in_executor(None, stored, args, course, level_id)
+
+async def simulate(args, course, level_id):
+    """sweep a level without blocking the listener: through the daemon if there is one, or in
+    a sim.py process of its own. Returns the answer."""
+    if args.daemon:
+        reader, writer = await asyncio.open_unix_connection(args.daemon)
+        writer.write((json.dumps({'cmd': 'sweep', 'course': course, 'level': level_id, 'powerup': args.powerup,
+            'power': args.power, 'target': args.target}) + '\n').encode())
+        await writer.drain()
+        answer = json.loads(await reader.readline())
+        writer.close()
+        return answer
+
+    levelfile = os.path.join(args.levels, '{}_{}.plist'.format(course, level_id))
+    if not os.path.exists(levelfile):
+        return {'error': 'no level file {}'.format(levelfile)}
+    options = ['-b', str(args.batch), '--search', args.search] + (['--fast'] if args.fast else [])
+    process = await asyncio.create_subprocess_exec(sys.executable, SIM, levelfile, '-m', 'headless', '--no-show',
+            '-n', str(args.power), '-u', args.powerup, '-t', args.target, '--db', args.db, *options,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL, stdin=asyncio.subprocess.DEVNULL)
+    if await process.wait():
+        return {'error': 'sim.py failed for {}'.format(levelfile)}
+    answer = await lookup(args, course, level_id)
+    if answer is None:
+        return {'error': 'no result stored for {}'.format(levelfile)}
+    answer['source'] = 'sim'
+    return answer
+
+async def worker(args, queue, pending):
+    """simulate the queued levels, the most recently seen first"""
+    while True:
+        priority, course, level_id = await queue.get()
+        try:
+            emit(course, level_id, await simulate(args, course, level_id))
+        except Exception as ex:
+            emit(course, level_id, {'error': str(ex)})
+        finally:
+            pending.discard((course, level_id))
+            queue.task_done()
+
+async def listen(args, stream, queue, pending):
+    """read the capture stream, answer every new level id from the store or queue it"""
+    seen = {}
+    order = itertools.count()
+    course = None
+    buffer = b''
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            break
+        buffer += chunk
+        end = 0
+        events = sorted([(m.start(), m.end(), 'course', m) for m in COURSE.finditer(buffer)]
+                + [(m.start(), m.end(), 'level', m) for m in LEVEL.finditer(buffer)], key=lambda e: e[0])
+        for start, end, kind, m in events:
+            text = m.group(1).decode('ascii', 'replace')
+            if kind == 'course':
+                course = word(text) or course
+                continue
+            name = parse(text, course)
+            if name is None:
+                continue
+            # the game repeats the level id in many packets, answer it once
+            now = time.time()
+            if name in pending or now - seen.get(name, -args.quiet) < args.quiet:
+                continue
+            seen[name] = now
+            answer = await lookup(args, *name)
+            if answer:
+                emit(*name, answer)
+            else:
+                pending.add(name)
+                # newer levels first, the one being played is the last one seen
+                await queue.put((-next(order), *name))
+        buffer = buffer[end:][-TAIL:]
+
+async def replay(path, pace):
+    """a stream reader over a recorded capture or text file, one line at a time every pace seconds"""
+    stream = asyncio.StreamReader()
+    async def feed():
+        loop = asyncio.get_running_loop()
+        with open(path, 'rb') as f:
+            while True:
+                # reading may block (stdin from a terminal, a slow disk), the listener goes on meanwhile
+                line = await loop.run_in_executor(None, f.readline)
+                if not line:
+                    break
+                stream.feed_data(line)
+                await asyncio.sleep(pace)
+        stream.feed_eof()
+    asyncio.ensure_future(feed())
+    return stream
+
+async def main(args):
+    if args.replay == '-' and stat.S_ISFIFO(os.fstat(sys.stdin.fileno()).st_mode):
+        # a live capture piped in, like tshark ... | ./listen.py --replay -
+        stream = asyncio.StreamReader()
+        await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(stream), sys.stdin)
+    elif args.replay:
+        stream = await replay('/dev/stdin' if args.replay == '-' else args.replay, args.pace)
+    else:
+        # what listen.sh does, without the grep
+        tshark = await asyncio.create_subprocess_exec('tshark', '-i', args.interface, '-l', '-w', '-', 'udp',
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+        stream = tshark.stdout
+
+    queue = asyncio.PriorityQueue()
+    pending = set()
+    workers = [asyncio.ensure_future(worker(args, queue, pending)) for i in range(args.jobs or os.cpu_count())]
+    await listen(args, stream, queue, pending)
+    # a replay is over, finish what is queued
+    await queue.join()
+    for w in workers:
+        w.cancel()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('./listen.py')
+    parser.add_argument('-i', '--interface', type=str, help='network interface to capture the game traffic on', nargs='?', default='wlp0s20f3')
+    parser.add_argument('--replay', type=str, help='read a recorded capture or text file instead (-: stdin)', nargs='?', default=None)
+    parser.add_argument('--pace', type=float, help='seconds between the lines of a replay', nargs='?', default=0.0)
+    parser.add_argument('--levels', type=str, help='directory of the level files, named like dunes_3.plist', nargs='?', default='.')
+    parser.add_argument('-n', '--newton', type=float, help='ball power (NoodleNewton)', nargs='?', default=None)
+    parser.add_argument('-p', '--power', type=int, help='ball power (P1-13)', nargs='?', default=13)
+    parser.add_argument('-u', '--powerup', type=str, help='powerup selection [regular, heavy, shield, sticky, tunnel, super]', nargs='?', default='regular')
+    parser.add_argument('-t', '--target', type=str, help='optimization target (distance, high, low, left, right)', nargs='?', default='distance')
+    parser.add_argument('--quiet', type=float, help='seconds to ignore a level id after it was seen', nargs='?', default=60.0)
+    parser.add_argument('-j', '--jobs', type=int, help='number of levels to simulate at the same time (0: one per core)', nargs='?', default=0)
+    parser.add_argument('-b', '--batch', type=int, help='number of balls to simulate together in one space, faster but approximate', nargs='?', default=1)
+    parser.add_argument('--search', type=str, help='headless search strategy [grid, adaptive]', nargs='?', default='adaptive')
+    parser.add_argument('--fast', help='skip through free flight analytically', action='store_true')
+    parser.add_argument('--daemon', type=str, help='simulate through a running daemon.py on this socket', nargs='?', default=None)
+    parser.add_argument('--db', type=str, help='results store', nargs='?', default=store.DATABASE)
+    args = parser.parse_args()
+
+    args.power = args.newton or skills.SKILLS[args.powerup][args.power-1]
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,96 @@
+import contextlib
+import hashlib
+import io
+import numpy
+import os
+import tempfile
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# a mask pixel is set if its green channel reaches this value
+THRESHOLDS = {
+        'acid': 80,
+        'sticky': 40
+        }
+
+# decoded masks, as packed bits named by the hash of the PNG and the target size
+CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tmp', 'masks')
+
+# decoded masks of this process, by key
+loaded = {}
+
+# colours to draw the masks with in the pygame window
+COLORS = {
+        'acid': (0, 80, 0),
+        'sticky': (80, 40, 40)
+        }
+
+def green(data):
+    """green channel of a PNG as an array of shape (height, width)"""
+    if Image is not None:
+        img = Image.open(io.BytesIO(data)).convert('RGBA')
+        return numpy.asarray(img)[:, :, 1]
+    # without Pillow, fall back to pygame's image module (this initialises no display)
+    with contextlib.redirect_stdout(None):
+        import pygame.image
+        import pygame.surfarray
+    img = pygame.image.load(io.BytesIO(data))
+    return pygame.surfarray.array_green(img).T
+
+def decode(data, type_, width, height):
+    """turn an acid or sticky mask PNG into a boolean array of shape (height, width)"""
+    pixels = green(data) >= THRESHOLDS[type_]
+    # nearest neighbour scaling, like pygame.transform.scale
+    rows = numpy.arange(height) * pixels.shape[0] // max(height, 1)
+    cols = numpy.arange(width) * pixels.shape[1] // max(width, 1)
+    return pixels[rows[:, None], cols[None, :]]
+
+def key(data, type_, width, height):
+    """content address of a decoded mask"""
+    h = hashlib.sha256(data)
+    h.update("{}:{}x{}".format(type_, width, height).encode())
+    return h.hexdigest()
+
+def cached(k, width):
+    """the decoded mask of a key from the in-memory or on-disk cache, or None"""
+    mask = loaded.get(k)
+    if mask is None:
+        try:
+            mask = numpy.unpackbits(numpy.load(os.path.join(CACHE, k + '.npy')), axis=1, count=width).astype(bool)
+        except (OSError, ValueError):
+            return None
+        loaded[k] = mask
+    return mask
+
+def load(data, type_, width, height):
+    """decode a mask PNG like decode(), through the in-memory and on-disk caches"""
+    k = key(data, type_, width, height)
+    mask = cached(k, width)
+    if mask is None:
+        mask = decode(data, type_, width, height)
+        path = os.path.join(CACHE, k + '.npy')
+        try:
+            # write and rename, so parallel runs never see half a file
+            os.makedirs(CACHE, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=CACHE, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                numpy.save(f, numpy.packbits(mask, axis=1))
+            os.replace(tmp, path)
+        except OSError as x:
+            print("Cannot cache mask:", x)
+        loaded[k] = mask
+    return mask
+
+def grown(mask, radius):
+    """the mask with every set pixel grown to a disc of radius pixels, padded by radius on every
+    side, so pixel (x, y) of the mask is (x+radius, y+radius) of the result"""
+    height, width = mask.shape
+    result = numpy.zeros((height + 2*radius, width + 2*radius), dtype=bool)
+    for dy in range(-radius, radius+1):
+        for dx in range(-radius, radius+1):
+            if dx*dx + dy*dy <= radius*radius:
+                result[radius+dy:radius+dy+height, radius+dx:radius+dx+width] |= mask
+    return result
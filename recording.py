@@ -0,0 +1,64 @@
+import json
+import numpy
+import os
+import struct
+
+MAGIC = b'SWREC001'
+# magic, length of the JSON header
+HEADER = struct.Struct('<8sI')
+
+def save(path, shots, every):
+    """write recorded shots to a file: a JSON header with the angle, power, end reason and events
+    of every shot, then the poses (x, y, angle) of all shots as float32. The first pose of a shot
+    is stored as is, every other one as the change from the pose before. shots is a list of dicts
+    with 'angle', 'power', 'reason', 'poses' [(x, y, angle)] and 'events' [(pose index, kind, x, y)]."""
+    blocks = []
+    index = []
+    offset = 0
+    for shot in shots:
+        poses = numpy.asarray(shot['poses'], dtype=float).reshape(-1, 3)
+        deltas = numpy.diff(poses, axis=0, prepend=numpy.zeros((1, 3))).astype(numpy.float32)
+        blocks.append(deltas)
+        index.append({'angle': shot['angle'], 'power': shot['power'], 'reason': shot['reason'],
+            'offset': offset, 'count': len(poses), 'events': shot['events']})
+        offset += len(poses)
+    header = json.dumps({'every': every, 'shots': index}).encode()
+    # the poses start on a multiple of 4 bytes, so they can be mapped as float32
+    header += b' ' * (-(HEADER.size + len(header)) % 4)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as fd:
+        fd.write(HEADER.pack(MAGIC, len(header)))
+        fd.write(header)
+        for deltas in blocks:
+            fd.write(deltas.tobytes())
+    os.replace(tmp, path)
+
+class Recording:
+    """a recording file, the poses are mapped into memory and only decoded for the shots asked for"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as fd:
+            magic, size = HEADER.unpack(fd.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError("{} is not a recording".format(path))
+            header = json.loads(fd.read(size))
+        self.every = header['every']
+        self.shots = header['shots']
+        count = sum(shot['count'] for shot in self.shots)
+        self.deltas = numpy.memmap(path, dtype=numpy.float32, mode='r', offset=HEADER.size + size,
+                shape=(count, 3)) if count else numpy.zeros((0, 3), dtype=numpy.float32)
+
+    def poses(self, shot):
+        """the poses (x, y, angle) of a shot of self.shots, one every self.every steps"""
+        deltas = self.deltas[shot['offset']:shot['offset'] + shot['count']]
+        return numpy.cumsum(deltas, axis=0, dtype=float)
+
+    def nearest(self, angle, power=None):
+        """the shot closest to an angle, of a power if given"""
+        shots = [s for s in self.shots if power is None or abs(s['power'] - power) < 1e-6]
+        return min(shots, key=lambda s: abs(s['angle'] - angle), default=None)
+
+    def within(self, low, high, power=None):
+        """the shots between two angles, of a power if given, by angle"""
+        return sorted((s for s in self.shots if low - 1e-6 <= s['angle'] <= high + 1e-6
+            and (power is None or abs(s['power'] - power) < 1e-6)), key=lambda s: s['angle'])
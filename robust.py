@@ -0,0 +1,56 @@
+import math
+import numpy
+
+# noise distributions of the robustness estimate, with what their scale means
+DISTRIBUTIONS = {
+        'none': 'no noise',
+        'uniform': 'half width',
+        'normal': 'standard deviation',
+        'triangular': 'half width'
+        }
+
+# 95% confidence
+Z = 1.96
+
+def noise(spec):
+    """(distribution, scale) of a spec like normal:0.5, uniform:1.75 or none"""
+    kind, _, scale = spec.partition(':')
+    if kind not in DISTRIBUTIONS:
+        raise ValueError("unknown noise distribution {}, use one of {}".format(kind, ', '.join(DISTRIBUTIONS)))
+    scale = float(scale or 0)
+    if scale < 0:
+        raise ValueError("negative noise {}".format(spec))
+    return kind, scale
+
+def draw(rng, distribution, n):
+    """n offsets drawn from a (distribution, scale) with a numpy random generator"""
+    kind, scale = distribution
+    if kind == 'none' or scale == 0:
+        return numpy.zeros(n)
+    if kind == 'uniform':
+        return rng.uniform(-scale, scale, n)
+    if kind == 'normal':
+        return rng.normal(0, scale, n)
+    return rng.triangular(-scale, 0, scale, n)
+
+def wilson(successes, n, z=Z):
+    """(low, high) Wilson score interval of a success rate, which stays sensible near 0 and 1"""
+    if n == 0:
+        return 0.0, 1.0
+    p = successes / n
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return max(0.0, center - half), min(1.0, center + half)
+
+def summary(shots):
+    """the distribution of outcomes (dist, tdist, reason, x, y, cycle) of the samples: count by
+    reason, swishes, and percentiles of the distance to the flag where the ball came to rest"""
+    reasons = {}
+    for shot in shots:
+        reasons[shot[2]] = reasons.get(shot[2], 0) + 1
+    rest = numpy.array([shot[1] for shot in shots if shot[2] in ("Stuck", "Stationary")])
+    return {
+        'reasons': dict(sorted(reasons.items(), key=lambda r: -r[1])),
+        'swishes': sum(1 for shot in shots if shot[1] < 8.2),
+        'distance': {str(q): float(numpy.percentile(rest, q)) for q in (10, 50, 90)} if len(rest) else {}
+        }
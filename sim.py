@@ -1,48 +1,22 @@
 #!/usr/bin/env python3
 
 import argparse
-import base64
 import contextlib
 import json
-import math
+import multiprocessing
 import numpy
 import os
-import re
 import sys
 import time
 
-with contextlib.redirect_stdout(None):
-    import pygame
-    import pymunk
-    import pymunk.pygame_util
-    from pymunk.vec2d import Vec2d
-
-# CONSTANTS
-# collision types
-
-collision_types = {
-        "wall": 9, #default
-        "ball": 1,
-        "sand": 2,
-        "water": 3,
-        "antigrav": 4,
-        "magnet": 5,
-        "portal": 6,
-        "laser": 7,
-        "lasersensor": 8
-        }
-
-SKILLS = {
-        'regular':[25,25.7,26.5,27.4,28.4,29.5,30.7,32.1,33.6,35.3,37.1,39,41.1],
-        'maxp12':[25,25.7,26.5,27.4,28.4,29.5,30.7,32.1,33.6,35.3,37.1,39,39],
-        'super':[54.1,55.8,57.7,60,62.4,65.2,68.3,71.7,75.5,79.6,84.1,89,89],
-        'heavy':[17.4,17.8,18.3,18.9,19.5,20.2,21,21.8,22.8,23.8,24.9,26.1,26.1],
-        'saw':[29.9,30.7,31.5,32.5,33.6,34.8,36.2,37.7,39.3,41.1,43,45.1,45.1]
-        }
-SKILLS['sticky']=SKILLS['maxp12']
-SKILLS['shield']=SKILLS['maxp12']
-SKILLS['tunnel']=SKILLS['maxp12']
-
+import masks as masking
+import recording as recorder
+import robust
+import skills
+import simulator as physics
+import store
+import targets
+from spread import best_spreads
 
 # simulation modes
 
@@ -51,45 +25,15 @@ MODE_SHOW = 1
 MODE_HEADLESS = 2
 MODE_SPREAD = 3
 
-SUBMODE_NORMAL = 0
-SUBMODE_HEAVY = 1
-SUBMODE_SHIELD = 2
-SUBMODE_ANTIGRAV = 3
-SUBMODE_STICKY = 4
-SUBMODE_TUNNEL = 5
-
-#VARIABLES WE NEED TO EYEBALL
-
-TERRAIN_ELASTICITY = 0.6
-SIDEWALL_ELASTICITY = 0.6
-TERRAIN_FRICTION = 0.5
-SEGMENT_THICKNESS = 2
-
-BALL_MASS = 1.0
-BALL_MOMENT = 13.5
-BALL_RADIUS = 5.0
-BALL_ELASTICITY = 0.6
-BALL_FRICTION = 0.7
-
-# distance the ball has to travel before switching status (tunnel, sticky, ghost)
-GHOST_DISTANCE = 15
-
-POWER_FACTOR = 1.35109
-POWER_BASELINE = 39
-TIME_FACTOR = 0.3333
-
-
-window = (3200,4800)
+window = physics.window
 WIDTH,HEIGHT = window
 
 # defaults(some are overridden in argparse below) 
 power = 41.1
 init_angle = 0
 mode = MODE_HEADLESS
-submode = SUBMODE_NORMAL
 
 # reading command line arguments
-
 parser = argparse.ArgumentParser('./sim.py')
 parser.add_argument('level', type=str, help='plist file to read and run the simulation in', nargs=1)
 parser.add_argument('-a', '--angle', type=float, help='angle of the shot/starting angle of the simulation', nargs='?', default=0.0)
@@ -103,11 +47,37 @@ parser.add_argument('-d', '--delay', type=float, help='wait d seconds until taki
 parser.add_argument('-t', '--target', type=str, help='optimization target (distance, high, low, left, right)', nargs='?', default='distance')
 parser.add_argument('-v', '--vertical', type=int, help='shift the viewport by this many pixels, vertically', nargs='?', default='0')
 parser.add_argument('--ignore-sticky', dest="ignore_sticky", help='ignore sticky masks', action='store_true')
+parser.add_argument('-w', '--workers', type=int, help='number of worker processes in headless mode (0: one per core)', nargs='?', default=1)
+parser.add_argument('-b', '--batch', type=int, help='number of balls to simulate together in one space in headless mode, faster but approximate', nargs='?', default=1)
+parser.add_argument('--search', type=str, help='headless search strategy [grid, adaptive]', nargs='?', default='grid')
+parser.add_argument('--coarse', type=int, help='initial step of the adaptive search, in tenths of a degree', nargs='?', default=10)
+parser.add_argument('--tolerance', type=float, help='distance at which two resting positions count as different in the adaptive search', nargs='?', default=10.0)
+parser.add_argument('--fast', help='skip through free flight analytically instead of stepping it (headless mode)', action='store_true')
+parser.add_argument('--substeps', type=int, help='split a step into up to this many substeps while a ball is about to touch something (1: fixed steps)', nargs='?', default=1)
+parser.add_argument('--powers', type=str, help='sweep several power skill levels of the powerup in one headless run, e.g. all, 1-13 or 5,9,13', nargs='?', default=None)
+parser.add_argument('--shots', type=int, help='number of angles to scan in headless mode (default: 1800, 3600 for tunnel)', nargs='?', default=None)
+parser.add_argument('--stats', type=str, help='save the timings and shot and step counts of a headless run to this JSON file', nargs='?', default=None)
+parser.add_argument('--profile', type=str, help='save where the time of a headless run goes (phases, functions, collision handlers, shots) to this JSON file', nargs='?', default=None)
+parser.add_argument('--serve', help='answer shot requests from daemon.py on stdin instead of scanning (headless mode)', action='store_true')
+parser.add_argument('--montecarlo', type=int, help='estimate the success rate of the shot at --angle from up to this many noisy shots instead of scanning (headless mode)', nargs='?', default=None, const=5000)
+parser.add_argument('--angle-noise', dest='angle_noise', type=str, help='angle noise of --montecarlo in degrees [none, uniform:W, normal:SD, triangular:W]', nargs='?', default='uniform:1.75')
+parser.add_argument('--power-noise', dest='power_noise', type=str, help='power noise of --montecarlo in NoodleNewton [none, uniform:W, normal:SD, triangular:W]', nargs='?', default='none')
+parser.add_argument('--seed', type=int, help='random seed of --montecarlo', nargs='?', default=0)
+parser.add_argument('--interval', type=float, help='stop --montecarlo once the 95%% confidence interval of the success rate is this narrow on each side', nargs='?', default=0.02)
+parser.add_argument('--record', type=str, help='save the ball path and events of every shot of a headless run to this file', nargs='?', default=None)
+parser.add_argument('--every', type=int, help='record the ball pose every this many steps', nargs='?', default=5)
+parser.add_argument('--replay', type=str, help='draw shots from a file saved with --record instead of simulating them (show and spread mode)', nargs='?', default=None)
+parser.add_argument('--image', type=str, help='save the drawing of a replay to this image file and exit', nargs='?', default=None)
+parser.add_argument('--no-show', dest='no_show', help='do not simulate the best shot in show mode after a headless run', action='store_true')
+parser.add_argument('--db', type=str, help='results store of headless runs', nargs='?', default=store.DATABASE)
+parser.add_argument('--table', type=str, help='save the per-angle results table of a headless run to this file', nargs='?', default=None)
 args = parser.parse_args()
 
 print(args)
 
-screen_center = (0,2500+args.vertical)
+started = time.time()
+# wall time of the phases of a headless run, for --stats
+timings = {}
 
 if args.mode:
     if args.mode=="headless":
@@ -119,34 +89,49 @@ if args.mode:
     elif args.mode=="show":
         mode = MODE_SHOW
 
+# headless runs never touch pygame, so they start quickly and work without a display
+if not mode == MODE_HEADLESS:
+    with contextlib.redirect_stdout(None):
+        import pygame
+        import pymunk.pygame_util
+
 if args.newton:
     power = args.newton
 
 target = args.target
-
-if args.powerup:
-    if args.powerup == "heavy":
-        BALL_ELASTICITY = 0
-        TERRAIN_ELASTICITY = 0
-        submode = SUBMODE_HEAVY
-    elif args.powerup == "shield":
-        submode = SUBMODE_SHIELD
-    elif args.powerup == "antigrav":
-        submode = SUBMODE_ANTIGRAV
-    elif args.powerup == "sticky":
-        submode = SUBMODE_STICKY
-    elif args.powerup == "tunnel":
-        submode = SUBMODE_TUNNEL
+if target not in targets.TARGETS:
+    print("Unknown target", target, "use one of", ', '.join(sorted(targets.TARGETS)))
+    sys.exit(1)
 
 if args.spread:
     spread = args.spread
 
 if args.power and not args.newton:
-    power = SKILLS[args.powerup][args.power-1] 
+    power = skills.SKILLS[args.powerup][args.power-1] 
 
 if args.angle:
     init_angle = args.angle #archangel? 
 
+# the powers of a headless run, in NoodleNewton. Skill levels with the same power are simulated once.
+powers = [power]
+if args.powers and mode == MODE_HEADLESS:
+    try:
+        powers = skills.powers(args.powers, args.powerup)
+    except (ValueError, KeyError) as ex:
+        print("Bad power levels", args.powers, ex)
+        sys.exit(1)
+
+workers = args.workers or os.cpu_count()
+
+SEARCH_TOLERANCE = args.tolerance
+
+# record the path of every shot, in the worker that simulates it
+recording = bool(args.record) and mode == MODE_HEADLESS
+recorded = {} # poses, events and reason by (angle, power), until they are saved or sent back
+
+# calls and seconds by function or collision handler are counted by the simulator with --profile
+profiling = bool(args.profile) and mode == MODE_HEADLESS
+
 angle = init_angle
 
 WAIT = args.delay # wait until starting.
@@ -154,689 +139,42 @@ WAIT = args.delay # wait until starting.
 # LOAD TERRAIN FILE
 
 try:
-    data=json.load(open(args.level[0],"r"))
+    level = physics.Level(args.level[0], args.vertical)
 except Exception as ex:
     print(ex)
     sys.exit(1)
+timings['parse'] = time.time() - started
 
-# UTILITY METHODS
-
-def loads_coord(s):
-    """load strange serialized coord lists {1,2,3...}"""
-    return json.loads(s.replace('{','[').replace('}',']'))
-
-# stupid 2d vector calculation, you could probably use numpy methods and Vec2d instead.
-
-def plus(a,b):
-    return [sum(x) for x in zip(a,b)]
-
-def scale(p,s):
-    sx,sy = s
-    px,py = p
-    return (px*sx, py*sy)
-
-def neg(a):
-    return [-x for x in a]
-
-def make_square(c):
-    x1,y1 = c[0]
-    x2,y2 = c[1]
-    return [(x1,y1),(x1,y2),(x2,y2),(x2,y1),(x1,y1)]
-
-def distance(x1,x2,y1,y2):
-    dx = x2-x1
-    dy = y2-y1
-    return math.sqrt(dx*dx+dy*dy)
-
-
-# PARAMETERS FROM DATA FILE
-
-nodes = data['nodes']
-top = loads_coord(nodes[0]['position'])[1]
-right = loads_coord(nodes[1]['position'])[0]
-right,top = plus((right,top), screen_center)
-
-gravity = float(data['gravity']) 
-
-# PHYSICS
-
-space = pymunk.Space()
-if submode == SUBMODE_ANTIGRAV:
-    space.gravity = (0,gravity)
-else:
-    space.gravity = (0,-gravity)
-static = space.static_body
-
-bodies = {}
-portals = {}
-rotations = {}
-translations = {}
-masks = []
-stickies = {}
-acids = {}
-lasers = {}
-fields = []
-magnets = []
-
-# LAYERS
-
-solid_filter = pymunk.ShapeFilter(categories=0x01)
-pass_filter = pymunk.ShapeFilter(categories=0x02)
-
-bbox = make_square(((0,2500),(right,top)))
-
-body = pymunk.Body(body_type = pymunk.Body.STATIC)
-body.id_ = "bbox"
-body.reset_position = body.position
-bodies['bbox']=body
-#left wall
-segment = pymunk.Segment(body, bbox[0], bbox[1], SEGMENT_THICKNESS)
-segment.elasticity = SIDEWALL_ELASTICITY
-segment.friction = TERRAIN_FRICTION
-segment.color=(150,40,40)
-space.add(segment)
-#right wall
-segment = pymunk.Segment(body, bbox[2], bbox[3], SEGMENT_THICKNESS)
-segment.elasticity = SIDEWALL_ELASTICITY
-segment.friction = TERRAIN_FRICTION
-segment.color=(150,40,40)
-space.add(segment)
-
-for node in nodes:
-    id_ = node['id']
-    pos = loads_coord(node['position'])
-    pos = plus (pos, screen_center)
-    type_ = node['type']
-    width = float(node.get('width',0))
-    height = float(node.get('height',0))
-
-    rotate = node.get('rotation-actions')
-    translate = node.get('position-actions')
-
-    shapes = None
-    if type_ == 'TerrainNode' and node['collisionsEnabled'] != "0":
-        shapes = node['vertices-processed']
-        rotation = loads_coord(node['node-rotation'])
-
-        offset = loads_coord(node['terrain-offset'])
-        center = (width/2.0, height/2.0)
-
-        body = pymunk.Body(body_type = pymunk.Body.KINEMATIC)
-        body.position = pos
-        body.reset_position = pos
-
-        for shape in shapes:
-            loaded = [plus(loads_coord(v), neg(center)) for v in shape]
-            loaded.append(loaded[0])
-            for i in range(len(loaded)-1):
-                segment = pymunk.Segment(body, loaded[i], loaded[i+1], SEGMENT_THICKNESS)
-                segment.elasticity = TERRAIN_ELASTICITY
-                segment.friction = TERRAIN_FRICTION
-                segment.filter = solid_filter
-                segment.collision_type = collision_types['wall']
-                segment.color=(80,200,80)
-                if rotate or translate:
-                    segment.color=(20,60,20)
-                space.add(segment)
-
-        body.angle = numpy.deg2rad(-rotation)
-        body.reset_angle = body.angle
-        body.id_ = id_
-        bodies[id_] = body
-
-    if type_ == 'GravityFieldNode':
-        pos = loads_coord(node['position'])
-        node_anchor = loads_coord(node['node-anchor'])
-        size = loads_coord(node['size'])
-        strength = loads_coord(node['strength'])
-        dir_ = loads_coord(node['dir'])
-        rotation = loads_coord(node['node-rotation'])
-
-        #TODO FIXME: relative anchor is correct, position is not when anchor>0
-        center = (size[0]/2.0, size[1]/2.0)
-        anchored = (-size[0]*node_anchor[0], -size[1]*node_anchor[1])
-        pos = plus(pos, screen_center)
-        loaded = make_square((neg(center),center))
-
-        body = pymunk.Body(body_type = pymunk.Body.KINEMATIC)
-        body.center_of_gravity = neg(plus(center,anchored))
-        body.position = pos
-        body.reset_position = body.position
-        segment = pymunk.Poly(body, loaded[:4], radius=SEGMENT_THICKNESS)
-        segment.color=(80,80,200)
-        segment.filter = pass_filter
-        segment.collision_type = collision_types['antigrav']
-        segment.sensor = True
-        segment.antigrav_dir = dir_
-        segment.antigrav_strength = strength
-        segment.antigrav_rotation = numpy.deg2rad(rotation)
-        space.add(segment)
-
-        body.angle = numpy.deg2rad(-rotation)
-        body.reset_angle = body.angle
-        bodies[id_] = body
-
-    for r in rotate:
-        sequence = rotations.get(id_,{"steps":[]})
-        rtype = r['type'] # Cool game
-        period = float(r['period'])
-        step = {"type": rtype,
-                "period": period}
-        sequence['duration'] = sequence.get('duration',0.0) + period 
-        if rtype=='delay-rotation':
-            # just append the duration to step, do nothing
-            pass 
-        elif rtype=='rotate':
-            step['rotation-rate'] = float(r['rotation-rate'])
-            #interpolate-mode?
-        else:
-            print ("UNKNOWN ROTATION ACTION",rtype)
-            sys.exit(1)
-        sequence['steps'].append(step)
-        rotations[id_]=sequence
-
-    old = (0,0)
-    for t in translate:
-        sequence = translations.get(id_,{"steps":[]})
-        ttype = t['type']
-        period = float(t['period'])
-        sequence['duration'] = sequence.get('duration',0.0) + period 
-        step = {"type": ttype,
-                "period": period}
-        if ttype == 'position':
-            rel = loads_coord(t['move-position'])
-            step['move-position'] = (rel[0]-old[0], rel[1]-old[1])
-            old = rel
-            #interpolate-mode?
-        elif ttype == 'delay-position':
-            pass
-        else:
-            print ("UNKNOWN POSITION ACTION",ttype)
-            sys.exit(1)
-        sequence['steps'].append(step)
-        translations[id_]=sequence
-
-
-    acid = node.get('texture-acid-mask')
-    if acid:
-        do_acid = {
-                'id': id_+'_acid',
-                'type': 'acid',
-                'width':  int(width),
-                'height': int(height),
-                #VERTICAL axis is inverted, we have to go back from window size
-                'pos': (int(pos[0]-width/2), int(window[1]-pos[1]-height/2))
-                }
-        fd = open('tmp/'+id_+'_acid.png','wb')
-        fd.write(base64.b64decode(acid))
-        fd.close()
-        acids[id_]=do_acid
-        masks.append(do_acid)
-
-    sticky = node.get('texture-sticky-mask')
-    if sticky and not args.ignore_sticky:
-        do_sticky = {
-                'id': id_+'_sticky',
-                'type': 'sticky',
-                'width':  int(width),
-                'height': int(height),
-                #VERTICAL axis is inverted, we have to go back from window size
-                'pos': (int(pos[0]-width/2), int(window[1]-pos[1]-height/2))
-                }
-        fd = open('tmp/'+id_+'_sticky.png','wb')
-        fd.write(base64.b64decode(sticky))
-        fd.close()
-        masks.append(do_sticky)
-        stickies[id_]=do_sticky
-
-    if type_ == 'SandTrapNode':
-        if not node.get('hazard-lines'):
-            continue
-        loaded = loads_coord(node['hazard-lines'][0])
-        loaded = make_square(loaded)
-
-        for i in range(len(loaded)-1):
-            p0 = plus(pos,loaded[i])
-            p1 = plus(pos,loaded[i+1])
-            segment = pymunk.Segment(static, p0, p1, SEGMENT_THICKNESS)
-            segment.elasticity = 999
-            segment.friction = 999
-            segment.color=(200,200,40)
-            segment.filter = solid_filter
-            segment.collision_type = collision_types['sand']
-            space.add(segment)
-
-    if type_ == 'WaterHazardNode':
-        loaded = loads_coord(node['hazard-lines'][0])
-        loaded = make_square(loaded)
-
-        for i in range(len(loaded)-1):
-            p0 = plus(pos,loaded[i])
-            p1 = plus(pos,loaded[i+1])
-            segment = pymunk.Segment(static, p0, p1, SEGMENT_THICKNESS)
-            segment.elasticity = 1.5 #TODO: how bouncy? 
-            segment.friction = TERRAIN_FRICTION
-            segment.color=(40,40,150)
-            segment.collision_type = collision_types['water']
-            space.add(segment)
-
-    if type_ == 'MagnetNode':
-        body = pymunk.Body(body_type = pymunk.Body.KINEMATIC)
-        radius = loads_coord(node['radius'])
-        strength = loads_coord(node['strength'])
-        magnet = pymunk.Circle(body, radius, pos)
-        magnet.filter = pass_filter
-        magnet.sensor = True
-        magnet.color = (200, 200, 200, 50)
-        magnet.collision_type = collision_types['magnet']
-        magnets.append((pos, radius, strength))
-        space.add(magnet)
-
-    if type_ == 'KillSawNode':
-        body = pymunk.Body(body_type = pymunk.Body.KINEMATIC)
-        radius = loads_coord(node['radius'])
-        saw = pymunk.Circle(body, radius, pos)
-        saw.filter = solid_filter
-        saw.elasticity = TERRAIN_ELASTICITY 
-        saw.friction = TERRAIN_FRICTION
-        saw.color = (150,150,150)
-        if not submode == SUBMODE_SHIELD:
-            saw.collision_type = collision_types['water']
-            sensor = True
-        space.add(saw)
-        body.reset_position = body.position
-        bodies[id_]=body
-
-    if type_ == "StartPositionNode":
-        init = loads_coord(node['position'])
-        startx, starty = plus(init, screen_center)
-    if type_ == "FlagPositionNode":
-        init = loads_coord(node['position'])
-        stopx, stopy = plus(init, screen_center)
-
-    for snap in node.get('snapped-nodes',[]):
-        stype = snap['type']
-        if stype=='StartPositionNode':
-            pos = loads_coord(snap['position'])
-            init = loads_coord(node['position'])
-            offset = loads_coord(node['terrain-offset'])
-            startx, starty = plus(plus(plus(init, screen_center), scale((width,height), neg(offset))), pos)
-        elif stype=='FlagPositionNode':
-            pos = loads_coord(snap['position'])
-            init = loads_coord(node['position'])
-            offset = loads_coord(node['terrain-offset'])
-            stopx, stopy = plus(plus(plus(init, screen_center), scale((width,height), neg(offset))), pos)
-
-        elif stype=='PortalNode':
-            rpos = loads_coord(snap['relative-position'])
-            a = loads_coord(snap['angle'])
-            radius = loads_coord(snap['radius'])
-
-            portal_id = snap['id']
-            link = snap['linked-portal-id']
-
-            dx = -radius * math.sin(a) * 10
-            dy = radius * math.cos(a) * 10
-            #x, y = plus(plus(plus(init, screen_center), scale((width,height), neg(offset))), pos)
-            x, y = rpos
-
-            segment = pymunk.Segment(bodies[id_], (x+dx, y+dy), (x-dx, y-dy), SEGMENT_THICKNESS)
-            segment.elasticity = 999
-            segment.friction = 999
-            segment.color=(200,100,40)
-            segment.collision_type = collision_types['portal']
-            segment.pos = pos
-            segment.portal_id = portal_id
-            segment.portal_angle = a
-            segment.linked_portal = link
-            space.add(segment)
-
-            portals[portal_id] = segment
-
-        elif stype=='LaserNode':
-            rpos = loads_coord(snap['relative-position'])
-            a = loads_coord(snap['angle'])
-            on = float(loads_coord(snap['phaseOnDuration']))
-            off = float(loads_coord(snap['phaseOffDuration']))
-
-            radius = 200 # FIXME until it hits a wall?
-            # TODO: we will check collisions for the sensor and adjust the length of the laser accordingly
-            rsens  = 80 
-
-            x, y = rpos
-            dx = radius * math.cos(a) 
-            dy = radius * math.sin(a) 
-            dxs = rsens * math.cos(a) 
-            dys = rsens * math.sin(a) 
-
-            #SENSOR
-            segment = pymunk.Segment(bodies[id_], (x, y), (x+dxs, y+dys), SEGMENT_THICKNESS)
-            segment.elasticity = 999
-            segment.friction = 999
-            segment.color=(80,40,0)
-            segment.collision_type = collision_types['lasersensor']
-            segment.period = (on+off)
-            segment.onperiod = on
-            segment.sensor=True
-            space.add(segment)
-
-            #LASER
-            segment2 = pymunk.Segment(bodies[id_], (x, y), (x+dx, y+dy), SEGMENT_THICKNESS)
-            segment2.elasticity = 999
-            segment2.friction = 999
-            segment2.color=(200,40,40)
-            segment2.collision_type = collision_types['laser']
-            segment2.period = (on+off)
-            segment2.onperiod = on
-            space.add(segment2)
-
-            lasers[id_]=(segment, segment2)
-
-        elif stype == 'MagnetNode':
-            p2 = pos # no shift?
-            body = pymunk.Body(body_type = pymunk.Body.KINEMATIC)
-            radius = loads_coord(snap['radius'])
-            strength = loads_coord(snap['strength'])
-            magnet = pymunk.Circle(body, radius, p2)
-            magnet.filter = pass_filter
-            magnet.sensor = True
-            magnet.color = (200, 200, 200)
-            magnet.collision_type = collision_types['magnet']
-            magnets.append((p2, radius, strength))
-            space.add(magnet)
-
-ball = pymunk.Body(mass=BALL_MASS, moment=BALL_MOMENT)
-
-circle = pymunk.Circle(ball, radius=BALL_RADIUS)
-circle.filter = solid_filter
-circle.elasticity = BALL_ELASTICITY
-circle.friction = BALL_FRICTION
-circle.collision_type = collision_types['ball']
-
-space.add(ball) 
-space.add(circle) 
-
-# SENSOR collision actions
-
-dead = False
-stuck = False
-magnet_active = False
-teleporting = None
-accx = 0
-accy = 0
-splashed = False
-tunneled = 0
-tunnelxy = Vec2d(0,0)
-
-#ANTIGRAV_FACTOR = 0.02
-ANTIGRAV_FACTOR = 0.033
-
-def hover(arbiter, space, data):
-    global accx, accy
-    poly = arbiter.shapes[0]
-    v = poly.antigrav_strength * ANTIGRAV_FACTOR 
-    a = poly.antigrav_rotation
-    vx = v * math.sin(a)
-    vy = v * math.cos(a)
-    accx, accy = vx, vy
-    return True
-def unhover(arbiter, space, data):
-    global accx, accy
-    accx, accy = 0,0
-    return True
-
-def check_water(arbiter, space, data):
-    global splashed, submode
-    if splashed or not submode == SUBMODE_SHIELD:
-        splashed = False
-        return die(arbiter, space, data)
-    splashed = True
-    return True
-
-def die(arbiter, space, data):
-    global dead
-    ball.velocity = (0,0)
-    dead = True
-    return False
-
-def stick(arbiter, space, data):
-    global stuck
-    ball.velocity = (0,0)
-    stuck = True
-    return True
-
-def magon(arbiter, space, data):
-    global magnet_active
-    magnet_active = True
-    return True
-def magoff(arbiter, space, data):
-    global magnet_active
-    magnet_active = False
-    return True
-
-def teleport(arbiter, space, data):
-    #disable until this is fixed
-    #return die(arbiter, space, data)
-
-    global teleporting
-    if teleporting:
-        return False
-
-    segment = arbiter.shapes[0]
-    id_ = segment.portal_id
-    link = segment.linked_portal
-    targ = portals[link]
-    if mode != MODE_HEADLESS:
-        print("TELEPORT TO ",(targ.a+targ.b)/2)
-
-    n1 = segment.normal
-    n2 = targ.normal
-    #th = n1.get_angle_between(n2)
-    #th = (segment.b-segment.a).get_angle_between(targ.b-targ.a)
-    # FIXME what about moving portals?
-    # FIXME balls can end up in the wall and crash the engine
-    th = segment.portal_angle - targ.portal_angle + math.pi
-    if mode != MODE_HEADLESS:
-        print("ROTATE BY" , numpy.rad2deg(th))
-        print("VELOCITY BEFORE" , ball.velocity)
-    ball.velocity = ball.velocity.rotated(-th)
-    if mode != MODE_HEADLESS:
-        print("VELOCITY AFTER" , ball.velocity)
-
-    # rotation - normalize origin portal orientation and identify relative position
-    if mode != MODE_HEADLESS:
-        print("POSITION" , ball.position)
-        print("POSITION A" , segment.a + segment.body.position)
-        print("POSITION B" , segment.b + segment.body.position)
-    center1 = (segment.a + segment.b) / 2.0 + segment.body.position
-    relative = ball.position - center1
-    if mode != MODE_HEADLESS:
-        print("OFFSET BEFORE ROTATION" , relative)
-    relative = relative.rotated(-th)
-    if mode != MODE_HEADLESS:
-        print("OFFSET AFTER ROTATION" , relative)
-    center2 = (targ.a + targ.b) / 2.0 + targ.body.position
-    if mode != MODE_HEADLESS:
-        print("POSITION BEFORE ROTATION" , ball.position)
-    ball.position = center2 + relative
-    if mode != MODE_HEADLESS:
-        print("POSITION AFTER ROTATION" , ball.position)
-
-    # normalize target portal orientation and move 3 ball width away from the portal
-    teleporting = True
-    if mode != MODE_HEADLESS:
-        print("POSITION BEFORE TRANSLATION" , ball.position)
-    ball.position = ball.position - n2 * BALL_RADIUS * 3 
-    if mode != MODE_HEADLESS:
-        print("POSITION AFTER TRANSLATION" , ball.position)
-    space.step(0.0001)
-    return True
-
-def unteleport(arbiter, space, data):
-    global teleporting
-    teleporting = False
-    return False
-
-def check_wall_type(arbiter, space, data):
-    global tunneled, tunnelxy
-    global teleporting
-
-    teleporting = False
-
-    point = arbiter.contact_point_set.points[0].point_a
-    body = arbiter.shapes[0].body
-    id_ = body.id_
-    acid = acids.get(id_)
-    
-    # account for moving stickys and acid
-    bodyxy = body.position - body.reset_position
-    # TODO: account for rotating sticky and acid
-
-    if acid and not submode == SUBMODE_SHIELD:
-        imgxy = (int(round(point[0]-acid['pos'][0]-bodyxy[0])), 
-                 int(round(window[1]-point[1]-acid['pos'][1]+bodyxy[1])))
-        try:
-            #TODO: pixel index out of range - we'll have to properly reverse calculate for rotations
-            c = acid['img'].get_at(imgxy)
-            if c[1] == 80:
-                return die(arbiter, space, data)
-        except:
-            pass #ignore moving sticky/acid
-    sticky = stickies.get(id_)
-    if sticky and (not args.ignore_sticky) and (abs(ball.position.x - startx)>GHOST_DISTANCE or abs(ball.position.y - starty)>GHOST_DISTANCE):
-        imgxy = (int(round(point[0]-sticky['pos'][0]-bodyxy[0])), 
-                 int(round(window[1]-point[1]-sticky['pos'][1]+bodyxy[1])))
-        try:
-            #TODO: pixel index out of range - we'll have to properly reverse calculate for rotations
-            c = sticky['img'].get_at(imgxy)
-            if c[1] == 40:
-                return stick(arbiter, space, data)
-        except:
-            pass #ignore moving sticky/acid
-    if submode == SUBMODE_STICKY and (abs(ball.position.x - startx)>GHOST_DISTANCE or abs(ball.position.y - starty)>GHOST_DISTANCE):
-       return stick(arbiter, space, data)
-    if submode == SUBMODE_TUNNEL and (ball.velocity.y<0 or abs(ball.position.x - startx)>GHOST_DISTANCE or abs(ball.position.y - starty)>GHOST_DISTANCE) and ball.position.x>GHOST_DISTANCE and ball.position.x < right-GHOST_DISTANCE:
-        if not tunneled:
-            #print ("Tunnel start")
-            #input()
-            tunneled = 1
-            tunnelxy = Vec2d(ball.position)
-            return False
-        elif tunneled == 1:
-            if abs(ball.position.x - tunnelxy.x)>GHOST_DISTANCE or abs(ball.position.y - tunnelxy.y)>GHOST_DISTANCE:
-                #print ("Tunnel stop", abs(ball.position.x - tunnelxy.x), abs(ball.position.y - tunnelxy.y))
-                #input()
-                tunneled = 2
-            else:
-                #print ("Not fully entered", abs(ball.position.x - tunnelxy.x), abs(ball.position.y - tunnelxy.y))
-                #input()
-                pass
-            tunnelxy = Vec2d(ball.position)
-            return False
-        elif tunneled == 2:
-            if abs(ball.position.x - tunnelxy.x)<GHOST_DISTANCE or abs(ball.position.y - tunnelxy.y)<GHOST_DISTANCE:
-                #print ("Not fully exited", abs(ball.position.x - tunnelxy.x), abs(ball.position.y - tunnelxy.y))
-                #input()
-                tunnelxy = Vec2d(ball.position)
-                return False
-            else: 
-                tunneled = 3
-        # else see below
-    return True
-
-def check_laser(arbiter, space, data):
-    if submode == SUBMODE_SHIELD:
-        return False
-
-    laser = arbiter.shapes[0]
-    period = laser.period
-    on = laser.onperiod
-    if period == 0 or (now % period) <= on:
-        return die(arbiter, space, data)
-    else:
-        return False
-
-splash = space.add_collision_handler(
-            collision_types['water'],
-            collision_types['ball']
-            )
-splash.begin = check_water
-
-thunk = space.add_collision_handler(
-            collision_types['sand'],
-            collision_types['ball']
-            )
-thunk.post_solve = stick
-
-whoosh = space.add_collision_handler(
-            collision_types['antigrav'],
-            collision_types['ball']
-            )
-whoosh.begin = hover
-whoosh.separate = unhover
-
-buzz = space.add_collision_handler(
-            collision_types['magnet'],
-            collision_types['ball']
-            )
-buzz.begin = magon
-buzz.separate = magoff
-
-beam = space.add_collision_handler(
-            collision_types['portal'],
-            collision_types['ball']
-            )
-beam.pre_solve = teleport
-#beam.separate = unteleport
-
-bounce = space.add_collision_handler(
-            collision_types['wall'],
-            collision_types['ball']
-            )
-bounce.pre_solve = check_wall_type
-
-fry = space.add_collision_handler(
-            collision_types['laser'],
-            collision_types['ball']
-            )
-fry.pre_solve = check_laser
-
+# the space is built once, every shot runs against it from a snapshot of the countdown
+simulator = physics.Simulator(level, powerup=args.powerup, power=power, target=target, delay=WAIT,
+        ignore_sticky=args.ignore_sticky, batch=args.batch, fast=args.fast and mode == MODE_HEADLESS,
+        substeps=args.substeps, every=args.every if recording else None, profile=profiling,
+        verbose=mode != MODE_HEADLESS)
+timings.update(simulator.timings)
+timings['load'] = time.time() - started
 
 # visual
 SCALE = args.zoom
 
-pygame.init()
-screen = pygame.Surface((int(WIDTH), int(HEIGHT)))
-output = pygame.display.set_mode((int(WIDTH*SCALE), int(HEIGHT*SCALE)))
-
 if not mode == MODE_HEADLESS:
+    pygame.init()
+    screen = pygame.Surface((int(WIDTH), int(HEIGHT)))
+    output = pygame.display.set_mode((int(WIDTH*SCALE), int(HEIGHT*SCALE)))
     draw_options = pymunk.pygame_util.DrawOptions(screen)
 
-# masks - we need these in headless mode
-for m in masks:
-    id_ = m['id']
-    img = pygame.image.load('tmp/'+id_+'.png').convert_alpha()
-    if m['type']=='acid':
-        img.fill((0,80,0,50), special_flags=pygame.BLEND_MIN) 
-    if m['type']=='sticky':
-        img.fill((80,40,40,50), special_flags=pygame.BLEND_MIN) 
-    img = pygame.transform.scale(img, (m['width'], m['height']))
-    m['img'] = img
-
-STEP = 0.05
-if power > 50:
-    STEP = 0.025
-#if mode==MODE_HEADLESS:
-#    STEP = 0.0125
-TIME_STEP = STEP * TIME_FACTOR
+    for m in simulator.masks:
+        pixels = numpy.zeros((m['width'], m['height'], 3), dtype=numpy.uint8)
+        pixels[m['mask'].T] = masking.COLORS[m['type']]
+        m['img'] = pygame.surfarray.make_surface(pixels)
 
 # run sim
 if mode == MODE_HEADLESS:
     print("Calculating distances")
 
-results = {}
-best = None
-bestdistance = None
+results = {} # per power, dist by angle in tenths
+outcomes = {} # per power, the whole outcome by angle in tenths
+best = {} # per power, (angle, power) of the best shot
+bestdistance = {}
 simulating = True
 
 tests = 0
@@ -847,23 +185,327 @@ if mode==MODE_SPREAD:
   SPREAD_STEPS = int(spread/0.1)
   print("Spread displayed in {} steps of {}.".format(SPREAD_STEPS, (spread/SPREAD_STEPS)))
 
-font = pygame.font.Font('freesansbold.ttf', 64)
-text1 = font.render("{}".format(args.level[0]), True, (255, 255, 255), (0,0,0))
-t2 = "{}".format(args.angle)
-if mode==MODE_SPREAD:
-    t2 += "±{}".format(spread/2.0)
-t2 += " degrees"
-text2 = font.render(t2, True, (255, 255, 255), (0,0,0))
-text3 = font.render("{:.1f}NN {}".format(power, args.powerup), True, (255, 255, 255), (0,0,0))
-
-while simulating:
-    now = 0
-    dist = None
-    POWER = power * POWER_FACTOR + POWER_BASELINE
+if not mode == MODE_HEADLESS:
+    font = pygame.font.Font('freesansbold.ttf', 64)
+    text1 = font.render("{}".format(args.level[0]), True, (255, 255, 255), (0,0,0))
+    t2 = "{}".format(args.angle)
+    if mode==MODE_SPREAD:
+        t2 += "±{}".format(spread/2.0)
+    t2 += " degrees"
+    text2 = font.render(t2, True, (255, 255, 255), (0,0,0))
+    text3 = font.render("{:.1f}NN {}".format(power, args.powerup), True, (255, 255, 255), (0,0,0))
+
+def draw(cycle):
+    """draw the world before every step of a shot in the display modes, False once the window
+    is closed"""
+    for event in pygame.event.get():
+        if event.type == pygame.QUIT:
+            return False
+    screen.blit(text1, (50, 300))
+    screen.blit(text2, (50, 360))
+    screen.blit(text3, (50, 420))
+    if mode == MODE_SPREAD:
+        ball = simulator.ball
+        xy = (int(ball.position.x), int(window[1]-ball.position.y))
+        red = (255,80,80)
+        green = (80,255,80)
+        if repeat==SPREAD_STEPS:
+            red = green
+        pygame.draw.circle(bg, red, xy, int(physics.BALL_RADIUS/2))
+        #bg.set_at(xy, red)
+
+    if cycle % 5 == 0:
+        if mode == MODE_SIM or mode == MODE_SPREAD:
+            screen.blit(bg,(0,0))
+        simulator.space.debug_draw(draw_options)
+        pygame.transform.scale(screen, (int(WIDTH*SCALE), int(HEIGHT*SCALE)), output)
+        pygame.display.update()
+
+def record(ANGLE, POWER, shot):
+    """book-keeping after each shot: swishes, best shot and the results table of its power"""
+    dist, tdist, reason, x, y, cycle = shot[:6]
+    if tdist < 8.2:
+        if len(powers) > 1:
+            print ("SWISH: ", int(ANGLE*10)/10.0, " - Power ", POWER, " - Distance ", dist)
+        else:
+            print ("SWISH: ", int(ANGLE*10)/10.0, " - Distance ", dist)
+
+    if reason != "Dead" and dist < 1e10 and ((bestdistance.get(POWER) is None) or (dist < bestdistance[POWER])):
+        print("Better", ANGLE, dist, bestdistance.get(POWER), reason)
+        bestdistance[POWER] = dist
+        best[POWER] = (ANGLE, POWER)
+
+    results.setdefault(POWER, {})[round(ANGLE*10)] = dist
+    outcomes.setdefault(POWER, {})[round(ANGLE*10)] = shot
+
+def sweep(cells):
+    """simulate a list of (angle, power) cells, returns (cell, outcome) pairs. Runs in the worker
+    processes, with --record the paths of the shots are kept in recorded."""
+    swept = simulator.sweep(cells)
+    if recording:
+        for cell, shot in swept:
+            # shots killed on the tee never fly
+            if shot.poses:
+                recorded[cell] = {'poses': shot.poses, 'events': shot.events, 'reason': shot.reason}
+    return [(cell, shot.outcome) for cell, shot in swept]
+
+def counted_sweep(cells):
+    """sweep() in a worker, returns the shots and what the worker counted and recorded since
+    the last call"""
+    shots = sweep(cells)
+    counted = dict(simulator.counters)
+    simulator.counters.clear()
+    taken = dict(recorded)
+    recorded.clear()
+    return shots, counted, taken
+
+def simulate(cells):
+    """simulate a list of (angle, power) cells in the worker pool if there is one, yields
+    (cell, outcome) pairs in order"""
+    batch = simulator.batch
+    if pool is None:
+        for i in range(0, len(cells), batch):
+            yield from sweep(cells[i:i+batch])
+        return
+    # contiguous chunks, several per worker to even out the load
+    size = max(batch, len(cells) // (workers * 8))
+    chunks = [cells[i:i+size] for i in range(0, len(cells), size)]
+    if not profiling and not recording:
+        for chunk in pool.imap(sweep, chunks):
+            yield from chunk
+        return
+    counters = simulator.counters
+    for chunk, counted, taken in pool.imap(counted_sweep, chunks):
+        for name, (calls, seconds) in counted.items():
+            c = counters.setdefault(name, [0, 0.0])
+            c[0] += calls
+            c[1] += seconds
+        recorded.update(taken)
+        yield from chunk
+
+def alike(a, b):
+    """whether two shots end the same way: same reason, no swish, and if the ball came to
+    rest, at nearly the same spot"""
+    if a[2] != b[2] or a[1] < 8.2 or b[1] < 8.2:
+        # swishes are what we are after, they are always resolved to the last tenth of a degree
+        return False
+    if a[2] in ("Stuck", "Stationary"):
+        return physics.distance(a[3], b[3], a[4], b[4]) <= SEARCH_TOLERANCE
+    return True
+
+def search(angles, coarse):
+    """coarse-to-fine search over a list of (angle, power) cells of one power: simulate every
+    coarse-th angle, then bisect between neighbours that end differently and finally fill in
+    around the best shot. Returns {index: outcome}."""
+    grid = list(range(0, len(angles), coarse))
+    if grid[-1] != len(angles) - 1:
+        grid.append(len(angles) - 1)
+    shots = {}
+    for i, (a, shot) in zip(grid, simulate([angles[i] for i in grid])):
+        shots[i] = shot
+
+    pending = list(zip(grid, grid[1:]))
+    while pending:
+        split = [(i, j) for i, j in pending if j - i > 1 and not alike(shots[i], shots[j])]
+        middle = [(i + j) // 2 for i, j in split]
+        for m, (a, shot) in zip(middle, simulate([angles[m] for m in middle])):
+            shots[m] = shot
+        pending = [p for (i, j), m in zip(split, middle) for p in ((i, m), (m, j))]
+
+    # the best shot might hide between two alike neighbours, simulate the gaps around it
+    while True:
+        scored = [i for i in shots if shots[i][2] != "Dead" and shots[i][0] < 1e10]
+        if not scored:
+            break
+        b = min(scored, key=lambda i: (shots[i][0], i))
+        lo = max([i for i in shots if i < b], default=b)
+        hi = min([i for i in shots if i > b], default=b)
+        gap = [i for i in range(lo + 1, hi) if i != b]
+        if not gap:
+            break
+        for i, (a, shot) in zip(gap, simulate([angles[i] for i in gap])):
+            shots[i] = shot
+
+    return shots
+
+def serve():
+    """answer shot requests of daemon.py, one JSON line {"power": NN, "angles": [...]} on stdin
+    each, with one line {"shots": [[angle, dist, tdist, reason, x, y, cycle, ...], ...]} on stdout
+    (see Simulator.outcome()). The level, its masks, the mover tracks and the countdown snapshots stay in memory."""
+    print(json.dumps({'ready': True, 'hash': level.hash, 'flag': [simulator.stopx, simulator.stopy]}), flush=True)
+    for line in sys.stdin:
+        request = json.loads(line)
+        shots = sweep([(a, request['power']) for a in request['angles']])
+        print(json.dumps({'shots': [[a] + list(o) for (a, p), o in shots]}), flush=True)
+
+if mode == MODE_HEADLESS and args.serve:
+    serve()
+    sys.exit(0)
+
+# samples of --montecarlo are drawn and scored in blocks of this many, so the draws and the
+# point where the estimate stops do not depend on the number of workers
+MONTECARLO_BLOCK = 200
+# sampled powers are rounded to this, so balls of the same power can fly in one volley
+MONTECARLO_POWER = 0.1
+
+def montecarlo():
+    """estimate how likely the shot at init_angle and power ends at rest, from shots with
+    random angle and power noise. Blocks of samples run on the workers until the confidence
+    interval is narrow enough or args.montecarlo shots are done."""
+    global pool
+    try:
+        angle_noise = robust.noise(args.angle_noise)
+        power_noise = robust.noise(args.power_noise)
+    except ValueError as ex:
+        print(ex)
+        sys.exit(1)
+    rng = numpy.random.default_rng(args.seed)
+    simulator.prelaunch()
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.get_context('fork').Pool(workers)
+
+    samples = []
+    successes = 0
+    while len(samples) < args.montecarlo:
+        n = min(MONTECARLO_BLOCK, args.montecarlo - len(samples))
+        angles = init_angle + robust.draw(rng, angle_noise, n)
+        shot_powers = numpy.round((power + robust.draw(rng, power_noise, n)) / MONTECARLO_POWER) * MONTECARLO_POWER
+        cells = sorted(zip(angles.tolist(), shot_powers.tolist()), key=lambda cell: cell[1])
+        for cell, shot in simulate(cells):
+            samples.append((cell, shot))
+            if shot[2] in ("Stuck", "Stationary"):
+                successes += 1
+        low, high = robust.wilson(successes, len(samples))
+        print("{} shots, success rate {:.1f}% ({:.1f}-{:.1f}%)".format(len(samples), 100.0 * successes / len(samples), 100 * low, 100 * high))
+        if (high - low) / 2 <= args.interval:
+            break
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    low, high = robust.wilson(successes, len(samples))
+    report = {'level': args.level[0], 'angle': init_angle, 'power': power, 'powerup': args.powerup,
+            'angle_noise': args.angle_noise, 'power_noise': args.power_noise, 'seed': args.seed,
+            'shots': len(samples), 'successes': successes, 'rate': successes / len(samples),
+            'interval': [low, high], **robust.summary([shot for cell, shot in samples])}
+    print("Success rate: {:.2f}% - {}/{}, 95% confidence {:.2f}-{:.2f}%".format(report['rate'] * 100, successes, len(samples), low * 100, high * 100))
+    for reason, count in report['reasons'].items():
+        print("  {:12} {:6} {:6.2f}%".format(reason, count, 100.0 * count / len(samples)))
+    print("  swishes      {:6}".format(report['swishes']))
+    if report['distance']:
+        print("  distance to the flag at rest: 10% {:.1f}, median {:.1f}, 90% {:.1f}".format(*report['distance'].values()))
+    if args.stats:
+        fd = open(args.stats,"w")
+        json.dump(report, fd)
+        fd.close()
+
+if mode == MODE_HEADLESS and args.montecarlo:
+    montecarlo()
+    sys.exit(0)
+
+if mode == MODE_HEADLESS:
+    shots = physics.sweep_count(args.powerup)
+    if args.shots:
+        shots = args.shots
+    init = round(init_angle * 10)
+    angles = [init_angle] + [(init + i) / 10.0 for i in range(1, shots)]
+
+    # forked workers inherit the snapshots along with the space, one per step size
+    launch = {} # cycle count at launch by power
+    t = time.time()
+    for POWER in powers:
+        simulator.use_power(POWER)
+        launch[POWER] = simulator.prelaunch()['cycle']
+    timings['countdown'] = time.time() - t
+    t = time.time()
+
+    pool = None
+    if workers > 1:
+        # the workers count for themselves, from zero
+        pool = multiprocessing.get_context('fork').Pool(workers, initializer=simulator.counters.clear)
+
+    if args.search == 'adaptive':
+        swept = []
+        for POWER in powers:
+            cells = [(a, POWER) for a in angles]
+            found = search(cells, max(1, args.coarse))
+            print ("Adaptive search: {} shots instead of {}".format(len(found), shots))
+            swept += [(cells[i], found[i]) for i in sorted(found)]
+    else:
+        # one sweep over all (angle, power) cells, so the workers never wait for a power to finish
+        swept = simulate([(a, POWER) for POWER in powers for a in angles])
+
+    for (ANGLE, POWER), shot in swept:
+        if (ANGLE*10 % 50) == 0:
+            print ("Simulating", (ANGLE, POWER * physics.POWER_FACTOR + physics.POWER_BASELINE))
+        record(ANGLE, POWER, shot)
+    for POWER in powers:
+        print ("BEST ANGLE: ", best.get(POWER))
+    timings['sweep'] = time.time() - t
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+# what the events of a recording are drawn with
+EVENT_COLORS = {
+        'bounce': (255, 255, 80),
+        'teleport': (80, 160, 255),
+        'stick': (255, 160, 40),
+        'death': (255, 40, 40)
+        }
+
+def replay():
+    """draw recorded shots instead of simulating them: in show mode the one closest to the angle,
+    in spread mode all of them within the spread"""
+    try:
+        tape = recorder.Recording(args.replay)
+    except (OSError, ValueError) as ex:
+        print(ex)
+        sys.exit(1)
+    if mode == MODE_SPREAD:
+        chosen = tape.within(init_angle - spread/2.0, init_angle + spread/2.0, power)
+    else:
+        chosen = [s for s in [tape.nearest(init_angle, power)] if s is not None]
+    if not chosen:
+        print("No recorded shot at", init_angle, "with power", power)
+        sys.exit(1)
+
+    for m in simulator.masks:
+        screen.blit(m['img'], m['pos'], special_flags=pygame.BLEND_MAX)
+    simulator.space.debug_draw(draw_options)
+    for shot in chosen:
+        poses = tape.poses(shot)
+        color = (80,255,80) if shot['reason'] in ("Stuck", "Stationary") else (255,80,80)
+        points = [(int(x), int(window[1]-y)) for x, y, a in poses.tolist()]
+        if len(points) > 1:
+            pygame.draw.lines(screen, color, False, points, 3)
+        for i, kind, x, y in shot['events']:
+            pygame.draw.circle(screen, EVENT_COLORS.get(kind, color), (int(x), int(window[1]-y)), 8 if kind == 'bounce' else 16)
+        print("Replay {} - {} after {} poses, {} events".format(shot['angle'], shot['reason'], len(poses), len(shot['events'])))
+    if mode == MODE_SPREAD:
+        success = sum(1 for shot in chosen if shot['reason'] in ("Stuck", "Stationary"))
+        print ("Success rate: {:.2f}% - {}/{}".format(100.0*success/len(chosen), success, len(chosen)))
+
+    screen.blit(text1, (50, 300))
+    screen.blit(text2, (50, 360))
+    screen.blit(text3, (50, 420))
+    pygame.transform.scale(screen, (int(WIDTH*SCALE), int(HEIGHT*SCALE)), output)
+    pygame.display.update()
+    if args.image:
+        pygame.image.save(screen, args.image)
+
+if args.replay and mode != MODE_HEADLESS:
+    replay()
+    simulating = False
+    if args.image:
+        pygame.quit()
+        sys.exit(0)
+
+while simulating and mode != MODE_HEADLESS:
     ANGLE = angle
-    splashed = False
-    tunneled = False
-    tunnelxy = Vec2d(0,0)
 
     if mode == MODE_SPREAD:
         if repeat==SPREAD_STEPS:
@@ -872,270 +514,109 @@ while simulating:
             ANGLE = angle - (spread/2.0)
         print ("Spread step {}, angle {}.".format(repeat, ANGLE))
 
-    if mode == MODE_HEADLESS:
-        if (ANGLE*10 % 50) == 0:
-            print ("Simulating", (ANGLE, POWER))
-
-    ball.position = (startx, starty+5)
-    ball.velocity = (0,0)
-    ball.angular_velocity = 0
-    vy = POWER * math.sin(numpy.deg2rad(ANGLE))
-    vx = POWER * math.cos(numpy.deg2rad(ANGLE))
-
-    running = True
-    cycle = 0
-    stationary = 0
-    dead = False
-    stuck = False
-
-    if (not mode == MODE_HEADLESS) and (repeat==0):
-        for m in masks:
+    if repeat==0:
+        for m in simulator.masks:
             screen.blit(m['img'], m['pos'], special_flags=pygame.BLEND_MAX)
 
         bg = screen.copy()
 
-    for id_ in bodies.keys():
-        body = bodies.get(id_)
-        try:
-            body.angle = getattr(body,'reset_angle')
-        except:
-            body.angle = 0
-        try:
-            body.position = getattr(body,'reset_position')
-        except:
-            pass #TODO?
-
-    space.step(0.00001)
-
-    timeout = WAIT
-    while running:
-        if timeout is not False and now>timeout:
-            vy = POWER * math.sin(numpy.deg2rad(ANGLE))
-            vx = POWER * math.cos(numpy.deg2rad(ANGLE))
-            ball.position = (startx, starty+5)
-            ball.velocity = (vx, vy)
-            timeout = False
-        elif timeout is not False:
-            ball.position = (startx, starty+5)
-
-        if not mode == MODE_HEADLESS:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
-            screen.blit(text1, (50, 300))
-            screen.blit(text2, (50, 360))
-            screen.blit(text3, (50, 420))
-        if mode == MODE_SPREAD:
-            xy = (int(ball.position.x), int(window[1]-ball.position.y))
-            red = (255,80,80)
-            green = (80,255,80)
-            if repeat==SPREAD_STEPS:
-                red = green
-            pygame.draw.circle(bg, red, xy, int(BALL_RADIUS/2))
-            #bg.set_at(xy, red)
-
-        if cycle % 5 == 0:
-            if mode == MODE_SIM or mode == MODE_SPREAD:
-                screen.blit(bg,(0,0))
-            if not mode == MODE_HEADLESS:
-                space.debug_draw(draw_options)
-                pygame.transform.scale(screen, (int(WIDTH*SCALE), int(HEIGHT*SCALE)), output)
-                pygame.display.update()
-
-        #KINEMATICS
-        for id_ in rotations.keys():
-            body = bodies.get(id_)
-            if body:
-                r = rotations[id_]
-                duration = r['duration']
-                then = now % duration
-                t = 0 
-                for s in r['steps']:
-                    t = t + s['period']
-                    if t>=then:
-                        if s['type']=='rotate':
-                            step = numpy.deg2rad(s['rotation-rate']) / s['period'] * TIME_STEP  # FIXME all movement depends on ball speed, so it is a bit moot. 
-                            body.angle = body.angle - step
-                            # TODO FIXME: I was told kinematic bodies can be moved by setting their velocity
-                            # Needs fixing for bumper land
-                            body.angular_velocity = -step
-                        break
-        for id_ in translations.keys():
-            body = bodies.get(id_)
-            if body:
-                r = translations[id_]
-                duration = r['duration']
-                then = now % duration
-                t = 0 
-                #body.velocity = (0,0)
-                for s in r['steps']:
-                    t = t + s['period']
-                    if t>=then:
-                        if s['type']=='position':
-                            step = TIME_STEP / s['period']
-                            move = s['move-position']
-                            body.position = (body.position.x + move[0] * step, body.position.y + move[1] * step)
-                            #TODO FIXME: I was told kinematic bodies can be moved by setting their velocity
-                            #body.velocity = Vec2d(move[0] * step, move[1] * step)
-                            #def velo(body, gravity, damping, dt):
-                            #    body.update_velocity(body, Vec2d(move[0] * step, move[1] * step), damping, dt)
-                            #body.velocity_func = velo
-                        break
-
-        space.step(STEP)
-        now += TIME_STEP
-        cycle += 1
-
-        if not timeout and abs(ball.velocity.x) < 0.001 and abs(ball.velocity.y) < 0.001:
-            stationary += 1
-        else:
-            stationary = 0
-
-        if dead or stuck or stationary > 100 or ball.position.y < 0 or ball.position.y > top or cycle > 2000:
-            dist = tdist = 1e8 #sys.float_info.max-1 fails for sliding window calculation
-            if stationary > 100 or stuck:
-                # TODO: improve "proximity" function for the hole, sometimes the shot that is closest to the hole is not the smartest choice.
-                dist = 0
-                tdist = distance(ball.position.x, stopx, ball.position.y, stopy) # distance
-                if target == 'distance':
-                  dist = tdist
-                elif target == 'right':
-                  dist = (stopx-ball.position.x)*3 - ball.position.y # as right as possible, then low
-                elif target == 'left':
-                  dist = -(stopx-ball.position.x)*3 + ball.position.y # as left as possible, then low
-                elif target == 'high' or target =='topright' or target =='upperleft' or target=='top':
-                  dist = -ball.position.x-ball.position.y # as high as possible, then right
-                elif target == 'topleft' or target =='upperleft':
-                  dist = ball.position.x-ball.position.y # as high as possible, then left
-                elif target == 'low' or target == 'lowerright' or target=='bottomright':
-                  dist = -ball.position.x+ball.position.y*4 # as low as possible, then right
-                elif target == 'lowerleft' or target=='bottomleft':
-                  dist = ball.position.x+ball.position.y*4 # as low as possible, then right
-                elif target == 'speed':
-                  dist = 0
-                if not target == "swish":
-                  dist = dist + cycle  # include speed in the result
-            elif mode==MODE_SPREAD:
-                repeat_dead += 1
-                print ("DEAD COUNTER ", repeat_dead)
-
-            dist = dist * dist
-
-            if tdist < 8.2:
-                print ("SWISH: ", int(ANGLE*10)/10.0, " - Distance ", dist)
-
-            running = False
-            if mode == MODE_SHOW:
-                simulating = False
-            if mode == MODE_SPREAD:
-                bg = screen.copy()
-                repeat += 1
-                if repeat == SPREAD_STEPS+1:
-                    simulating = False
-
-            if not dead and ((bestdistance is None) or (dist < bestdistance)):
-                reason = "No reason"
-                if dead:
-                    reason = "Dead"
-                    dist = 1e16
-                elif stuck:
-                    reason = "Stuck"
-                elif stationary > 100:
-                    reason = "Stationary"
-                elif ball.position.y < 0:
-                    reason = "Exit bottom"
-                    dist = 1e16
-                elif ball.position.y > top:
-                    reason = "Exit top"
-                    dist = 1e16
-                elif cycle > 10000:
-                    reason = "Timeout"
-                if dist<1e10:
-                  print("Better", angle, dist, bestdistance, reason)
-                  bestdistance = dist
-                  best = (ANGLE, power)
-
-            results[round(ANGLE*10)] = dist
-
-            stationary = 0
-
-        # adjust ball speed for next cycle
-        #ball.angular_velocity = 0 
-        ball.angular_velocity = ball.angular_velocity / 1.1
-        ball.velocity += (accx, accy)
-
-        # calculate magnet activity
-        if magnet_active:
-            for pos, radius, strength in magnets:
-                d = distance(pos[0], ball.position.x, pos[1], ball.position.y)
-                if d < radius:
-                    a = math.atan2(ball.position.y-pos[1], ball.position.x-pos[0])
-                    p = strength / d / d * STEP * 10000
-                    px = p * math.cos(a)
-                    py = p * math.sin(a)
-                    ball.velocity += (px, py)
+    shot = simulator.shoot(ANGLE, draw)
+    if shot is None:
+        break
+    shot = shot.outcome
+    if mode == MODE_SPREAD and shot[2] not in ("Stuck", "Stationary"):
+        repeat_dead += 1
+        print ("DEAD COUNTER ", repeat_dead)
+    record(ANGLE, power, shot)
+
+    if mode == MODE_SHOW:
+        simulating = False
+    if mode == MODE_SPREAD:
+        bg = screen.copy()
+        repeat += 1
+        if repeat == SPREAD_STEPS+1:
+            simulating = False
 
     # try another angle
     angle = (round(angle * 10) + 1) / 10.0 
 
     tests += 1
-    if (submode != SUBMODE_TUNNEL and tests == 1800) or (tests == 3600):
+    if tests == physics.sweep_count(args.powerup):
         simulating=False
-        print ("BEST ANGLE: ", best)
+        print ("BEST ANGLE: ", best.get(power))
 
+def table_name(POWER):
+    """the --table file of a power, one file per power if several are swept"""
+    if len(powers) == 1:
+        return args.table
+    root, ext = os.path.splitext(args.table)
+    return "{}-{}{}".format(root, POWER, ext)
 
 if mode == MODE_HEADLESS:
-    best35 = None
-    for spread in range(35, 360):
-       sum_ = 0
-
-       init = int(init_angle * 10)
-       for a in range(init, init + spread):
-           sum_ += results[a]
-
-       bestsum = sum_
-       besta   = init
-
-       for r in range(spread, 1700):
-           sum_ = sum_ + results.get(int(init + r), 99999)
-           sum_ = sum_ - results.get(int(init + r - spread), 99999)
-
-           if sum_ < bestsum:
-               bestsum = sum_
-               besta = float(init + r - spread/2.0)/10.0
-       
-       if best35 is None:
-         best35 = besta
-           
-         fd = None
-         try:
-           # writing results to JSON dump, only for levels in the correct format
-           fd = open("results.json","r")
-           besties = json.load(fd)
-           fd.close()
-  
-           levelfile = args.level[0]
-           path, course, level_id, ext = re.split('[/._]', levelfile)
-           besties[course] = besties.get(course, {})
-           besties[course][str(level_id)] = besties.get(course).get(str(level_id),{})
-
-           key = str(power)
-           if args.powerup != 'regular':
-               key = args.powerup+","+str(power)
-
-           besties[course][str(level_id)][key] = best35
-
-           fd = open("results.json","w")
-           json.dump(besties, fd, indent=2)
-           fd.close()
-         except Exception as x:
-           print(x)
-           fd.close()
-           sys.exit(1)
-
-       print ("Spread ", spread/10.0, " - BEST ANGLE ", besta)
-
-if mode == MODE_SPREAD:
+    # the adaptive search skips angles that end like their neighbours
+    missing = 'interpolate' if args.search == 'adaptive' else 'exclude'
+    spreads = {}
+    for POWER in powers:
+        if args.table:
+            fd = open(table_name(POWER),"w")
+            json.dump({'level': args.level[0], 'power': POWER, 'powerup': args.powerup, 'search': args.search, 'init': init, 'count': shots, 'results': results.get(POWER, {})}, fd)
+            fd.close()
+        spreads[POWER] = best_spreads(results.get(POWER, {}), init, shots, missing=missing)
+
+    try:
+        # every power of the sweep with all its shots, the store takes writes from many runs at once
+        db = store.connect(args.db)
+        course, level_id = store.name(args.level[0])
+        for POWER in powers:
+            store.save(db, course, level_id, args.powerup, POWER, target, outcomes.get(POWER, {}),
+                    hash=level.hash, search=args.search, init=init, count=shots,
+                    best=best[POWER][0] if POWER in best else None, best35=spreads[POWER][35], flagx=simulator.stopx, flagy=simulator.stopy)
+        db.close()
+    except Exception as x:
+        print(x)
+        sys.exit(1)
+
+    if recording:
+        recorder.save(args.record, [dict(angle=a, power=POWER, **r) for (a, POWER), r in sorted(recorded.items())], simulator.every)
+
+    if args.stats:
+        fd = open(args.stats,"w")
+        json.dump({'level': args.level[0], 'hash': level.hash, 'powers': powers, 'powerup': args.powerup,
+            'search': args.search, 'workers': workers, 'batch': simulator.batch, 'fast': simulator.fast, 'timings': timings,
+            'shots': sum(len(o) for o in outcomes.values()),
+            # every ball counts its steps, skipped ones in fast mode included
+            'steps': sum(o[5] - launch[POWER] for POWER in outcomes for o in outcomes[POWER].values())}, fd)
+        fd.close()
+
+    if profiling:
+        # workers add up their own time, with several workers functions can take longer than the sweep
+        functions = {name: {'calls': c[0], 'seconds': c[1]} for name, c in simulator.counters.items()}
+        handlers = [name for kind, callback, name in physics.HANDLERS]
+        steps = [o[5] - launch[POWER] for POWER in outcomes for o in outcomes[POWER].values()]
+        reasons = {}
+        for POWER in outcomes:
+            for o in outcomes[POWER].values():
+                reasons[o[2]] = reasons.get(o[2], 0) + 1
+        fd = open(args.profile,"w")
+        json.dump({'level': args.level[0], 'powers': powers, 'powerup': args.powerup, 'search': args.search,
+            'workers': workers, 'batch': simulator.batch, 'fast': simulator.fast, 'phases': timings,
+            'functions': {name: c for name, c in functions.items() if name not in handlers},
+            # the mover updates are what advance() does besides stepping the space
+            'movers': functions.get('advance', {}).get('seconds', 0) - functions.get('step', {}).get('seconds', 0),
+            'handlers': {name: functions.get(name, {'calls': 0, 'seconds': 0.0}) for name in handlers},
+            'steps': {'total': sum(steps), 'mean': sum(steps) / max(len(steps), 1), 'max': max(steps, default=0)},
+            'reasons': reasons,
+            'shots': [{'angle': a / 10.0, 'power': POWER, 'steps': o[5] - launch[POWER], 'reason': o[2]}
+                for POWER in outcomes for a, o in sorted(outcomes[POWER].items())]}, fd, indent=1)
+        fd.close()
+
+    for POWER in powers:
+        if len(powers) > 1:
+            print ("Power ", POWER)
+        for spread, besta in spreads[POWER].items():
+            print ("Spread ", spread/10.0, " - BEST ANGLE ", besta)
+
+if mode == MODE_SPREAD and not args.replay:
     success = SPREAD_STEPS - repeat_dead
     rate = float(success)/SPREAD_STEPS
     print ("Success rate: {:.2f}% - {}/{}".format(rate*100,success,SPREAD_STEPS))
@@ -1143,12 +624,21 @@ if mode == MODE_SHOW or mode == MODE_SPREAD:
     while True:
         time.sleep(1.0)
 
-pygame.quit()
+if not mode == MODE_HEADLESS:
+    pygame.quit()
 
 # In HEADLESS mode, we finish by simulating the best shot in SHOW mode
 if mode == MODE_HEADLESS and best:
-    rerun = "{} -m spread -a {} -s 3.5 -n {} -u {} -z {} -v {} -d {} {}".format(sys.argv[0], best35, power, args.powerup, SCALE, args.vertical, WAIT, args.level[0])
-    rerun = "{} -m show -a {} -s 3.5 -n {} -u {} -z {} -v {} -d {} {}".format(sys.argv[0], best[0], power, args.powerup, SCALE, args.vertical, WAIT, args.level[0])
-    print(rerun)
-    os.system(rerun)
+    for POWER in powers:
+        if POWER not in best:
+            continue
+        rerun = "{} -m spread -a {} -s 3.5 -n {} -u {} -z {} -v {} -d {} {}".format(sys.argv[0], spreads[POWER][35], POWER, args.powerup, SCALE, args.vertical, WAIT, args.level[0])
+        rerun = "{} -m show -a {} -s 3.5 -n {} -u {} -z {} -v {} -d {} {}".format(sys.argv[0], best[POWER][0], POWER, args.powerup, SCALE, args.vertical, WAIT, args.level[0])
+        if recording:
+            # draw the recorded shot instead of simulating it again
+            rerun += " --replay {}".format(args.record)
+        print(rerun)
+    # one window at a time, a sweep over several powers only prints the commands
+    if len(powers) == 1 and not args.no_show:
+        os.system(rerun)
 
@@ -0,0 +1,1216 @@
+import contextlib
+import itertools
+import math
+import numpy
+import time
+
+with contextlib.redirect_stdout(None):
+    import pymunk
+    from pymunk.vec2d import Vec2d
+
+import level as compiler
+import fields as forcefields
+import flight
+import masks as masking
+import targets
+import timeline
+
+# CONSTANTS
+# collision types
+
+collision_types = {
+        "wall": 9, #default
+        "ball": 1,
+        "sand": 2,
+        "water": 3,
+        "antigrav": 4,
+        "magnet": 5,
+        "portal": 6,
+        "laser": 7,
+        "lasersensor": 8
+        }
+
+SUBMODE_NORMAL = 0
+SUBMODE_HEAVY = 1
+SUBMODE_SHIELD = 2
+SUBMODE_ANTIGRAV = 3
+SUBMODE_STICKY = 4
+SUBMODE_TUNNEL = 5
+
+# powerups by name, the others fly like a regular ball
+POWERUPS = {
+        'regular': SUBMODE_NORMAL,
+        'heavy': SUBMODE_HEAVY,
+        'shield': SUBMODE_SHIELD,
+        'antigrav': SUBMODE_ANTIGRAV,
+        'sticky': SUBMODE_STICKY,
+        'tunnel': SUBMODE_TUNNEL
+        }
+
+def sweep_count(powerup):
+    """the number of angles (in tenths) of a full sweep with a powerup: a tunneling ball can also
+    be shot backwards through the ground"""
+    return 3600 if POWERUPS.get(powerup) == SUBMODE_TUNNEL else 1800
+
+#VARIABLES WE NEED TO EYEBALL
+
+TERRAIN_ELASTICITY = 0.6
+SIDEWALL_ELASTICITY = 0.6
+TERRAIN_FRICTION = 0.5
+SEGMENT_THICKNESS = 2
+
+BALL_MASS = 1.0
+BALL_MOMENT = 13.5
+BALL_RADIUS = 5.0
+BALL_ELASTICITY = 0.6
+BALL_FRICTION = 0.7
+
+# distance the ball has to travel before switching status (tunnel, sticky, ghost)
+GHOST_DISTANCE = 15
+
+POWER_FACTOR = 1.35109
+POWER_BASELINE = 39
+TIME_FACTOR = 0.3333
+
+#ANTIGRAV_FACTOR = 0.02
+ANTIGRAV_FACTOR = 0.033
+
+window = (3200,4800)
+WIDTH,HEIGHT = window
+
+# LAYERS
+
+solid_filter = pymunk.ShapeFilter(categories=0x01)
+pass_filter = pymunk.ShapeFilter(categories=0x02)
+
+# balls share a group, so the balls of a batch fly through each other
+ball_filter = pymunk.ShapeFilter(group=1, categories=0x01)
+
+# the collision handlers of the ball: the collision type of the other shape, the callback and
+# the method of Simulator it calls. The ball is always the second shape of the arbiter.
+HANDLERS = (
+        ('water', 'begin', 'check_water'),
+        ('sand', 'post_solve', 'stick'),
+        ('antigrav', 'begin', 'enter_field'),
+        ('antigrav', 'separate', 'leave_field'),
+        ('magnet', 'begin', 'enter_field'),
+        ('magnet', 'separate', 'leave_field'),
+        ('portal', 'pre_solve', 'teleport'),
+        ('wall', 'pre_solve', 'check_wall_type'),
+        ('laser', 'pre_solve', 'check_laser')
+        )
+
+# free flight: a ball closer than this to any shape is handed back to pymunk
+FAST_CLEARANCE = BALL_RADIUS + 2
+# skip at least this many steps, and look at most this far ahead
+FAST_MIN = 8
+FAST_HORIZON = 256
+# a contact the ball left stays cached in the space for collision_persistence more steps, and is
+# picked up again with its old impulses if the ball comes back. Only a ball that touched nothing
+# for longer than that jumps, so it leaves nothing behind.
+FAST_QUIET = 4
+# chipmunk files a ball in its broadphase under its box grown by a tenth of its size and of its
+# velocity (a float 0.1), and files it anew when it leaves that box. The order of the contacts
+# of a ball depends on where it was filed last, a jump files it like the steps it skips would.
+LEAF_GROWTH = float(numpy.float32(0.1))
+
+# adaptive steps: a ball that could reach a shape within a step moves at most this far per substep
+SUBSTEP_TRAVEL = 1.0
+# look this many steps ahead for shapes, a ball with nothing in reach is not looked at again
+# until it or a mover could have covered that distance
+SUBSTEP_LOOKAHEAD = 8
+# the query for shapes near a ball, the balls of a batch are left out. Sensors (fields, magnets)
+# are never found, they push the ball once per step anyway.
+near_filter = pymunk.ShapeFilter(group=1)
+
+# mover poses and velocities of every step are filled into the tracks in blocks by track()
+TRACK_BLOCK = 256
+
+# UTILITY METHODS
+
+# stupid 2d vector calculation, you could probably use numpy methods and Vec2d instead.
+
+def plus(a,b):
+    return [sum(x) for x in zip(a,b)]
+
+def make_square(c):
+    x1,y1 = c[0]
+    x2,y2 = c[1]
+    return [(x1,y1),(x1,y2),(x2,y2),(x2,y1),(x1,y1)]
+
+def distance(x1,x2,y1,y2):
+    dx = x2-x1
+    dy = y2-y1
+    return math.sqrt(dx*dx+dy*dy)
+
+def leaf(position, velocity):
+    """the box chipmunk files a ball at position with velocity under, see LEAF_GROWTH"""
+    x, y = position
+    l, b, r, t = x - BALL_RADIUS, y - BALL_RADIUS, x + BALL_RADIUS, y + BALL_RADIUS
+    gx, gy = (r - l) * LEAF_GROWTH, (t - b) * LEAF_GROWTH
+    vx, vy = velocity[0] * LEAF_GROWTH, velocity[1] * LEAF_GROWTH
+    return (l + min(-gx, vx), b + min(-gy, vy), r + max(gx, vx), t + max(gy, vy))
+
+def filed(box, position, velocity):
+    """the box a ball filed under box is filed under after a step that ends at position, with
+    velocity at the start of the step: the same box while the ball stays inside"""
+    x, y = position
+    if box[0] <= x - BALL_RADIUS and box[1] <= y - BALL_RADIUS and box[2] >= x + BALL_RADIUS and box[3] >= y + BALL_RADIUS:
+        return box
+    return leaf(position, velocity)
+
+def extent(shape):
+    """how far a shape reaches from the position of its body, in any rotation"""
+    if isinstance(shape, pymunk.Segment):
+        return max(shape.a.length, shape.b.length) + shape.radius
+    if isinstance(shape, pymunk.Circle):
+        return shape.offset.length + shape.radius
+    return max(v.length for v in shape.get_vertices()) + shape.radius
+
+def profiled(counters, name, f):
+    """f, counting its calls and the time spent in it into counters"""
+    def timed(*a, **kw):
+        t = time.perf_counter()
+        try:
+            return f(*a, **kw)
+        finally:
+            c = counters.setdefault(name, [0, 0.0])
+            c[0] += 1
+            c[1] += time.perf_counter() - t
+    return timed
+
+class Level:
+    """a compiled level placed on the screen: its records, bounds, start and flag. The masks are
+    only decoded when a simulator asks for them, see load_masks()."""
+
+    def __init__(self, path, vertical=0):
+        self.path = path
+        self.compiled = compiler.load(path)
+        self.hash = self.compiled['hash']
+        self.screen_center = (0,2500+vertical)
+        self.right, self.top = plus((self.compiled['right'], self.compiled['top']), self.screen_center)
+        self.gravity = self.compiled['gravity']
+        self.start = self.place(self.compiled['start'])
+        self.flag = self.place(self.compiled['flag'])
+
+        self.masks = []
+        for record in self.compiled['records']:
+            if record['kind'] == 'mask':
+                pos = plus(record['pos'], self.screen_center)
+                width, height = record['width'], record['height']
+                self.masks.append({
+                        'id': record['id']+'_'+record['type'],
+                        'node': record['id'],
+                        'type': record['type'],
+                        'key': record['key'],
+                        'width':  width,
+                        'height': height,
+                        #VERTICAL axis is inverted, we have to go back from window size
+                        'pos': (int(pos[0]-width/2), int(window[1]-pos[1]-height/2)),
+                        })
+        self.decoded = False
+
+    def place(self, p):
+        """screen position of a start or flag record, which may be snapped to a terrain node"""
+        xy = plus(p['pos'], self.screen_center)
+        if 'snap' in p:
+            xy = plus(plus(xy, p['shift']), p['snap'])
+        return xy
+
+    def lines(self, record):
+        """the segments of a compiled record as pairs of points"""
+        a, b = record['segments']
+        return [((x0, y0), (x1, y1)) for x0, y0, x1, y1 in self.compiled['segments'][a:b].tolist()]
+
+    def load_masks(self):
+        """decode the acid and sticky masks, once"""
+        if self.decoded:
+            return
+        for m in self.masks:
+            m['mask'] = masking.cached(m['key'], m['width'])
+            if m['mask'] is None:
+                m['mask'] = masking.load(compiler.image(self.compiled, m), m['type'], m['width'], m['height'])
+        self.decoded = True
+
+# what a shot ends with, see Simulator.outcome()
+OUTCOME = ('dist',) + targets.FIELDS
+
+class Shot:
+    """one ball from the tee until its shot is over: what the collision handlers keep track of,
+    the path with recording on, and in the end how it went. Once finished, the fields of OUTCOME
+    (dist, tdist, reason, x, y, cycle, ...) are set and outcome holds them as a tuple."""
+
+    # the state a shot starts with at launch, taken over from the ball of the countdown
+    # fields: the rows of the force fields (antigrav fields, magnets) the ball is inside
+    STATE = ('dead', 'stuck', 'fields', 'teleporting', 'splashed', 'tunneled', 'tunnelxy')
+    FRESH = (False, False, frozenset(), None, False, False, Vec2d(0,0))
+
+    def __init__(self, angle=None, power=None, state=FRESH):
+        self.angle, self.power = angle, power
+        self.set_state(state)
+        # the path and events of the shot, when recording
+        self.poses, self.events = [], []
+        # the closest the ball got to the flag, and how often it went through a portal
+        self.mindist, self.teleports = 1e8, 0
+        # where the ball was when no shape was in reach, and how far that was, see Simulator.substeps()
+        self.clear_at, self.clear = Vec2d(0, 0), 0
+        # the box the broadphase files the ball under, in fast mode (None: not known), see leaf()
+        self.leaf = None
+        self.outcome = None
+
+    def get_state(self):
+        """the state of the shot as a tuple in the order of STATE"""
+        return tuple(Vec2d(getattr(self, k)) if k == 'tunnelxy' else getattr(self, k) for k in self.STATE)
+
+    def set_state(self, state):
+        """set the state of the shot from a tuple in the order of STATE"""
+        for k, v in zip(self.STATE, state):
+            setattr(self, k, Vec2d(v) if k == 'tunnelxy' else v)
+        # what the fields do to the ball, see Simulator.forces()
+        self.active = None
+
+    def enter(self, field):
+        """the ball is inside the force field of a row"""
+        self.fields = self.fields | {field}
+        self.active = None
+
+    def leave(self, field):
+        """the ball left the force field of a row"""
+        self.fields = self.fields - {field}
+        self.active = None
+
+    def finish(self, outcome):
+        """the shot is over, with an outcome tuple in the order of OUTCOME"""
+        self.outcome = outcome
+        for k, v in zip(OUTCOME, outcome):
+            setattr(self, k, v)
+        return self
+
+class Simulator:
+    """the space of a level with a powerup, built once, and the shots that run in it. Shots of
+    any angle and power can be run again and again: every one starts from a snapshot of the world
+    after the countdown, and keeps its state in a Shot of its own.
+
+    every: record the pose of the ball every this many steps (None: no recording).
+    profile: count the calls and time of the steps, forces and collision handlers into counters.
+    verbose: talk about teleports."""
+
+    def __init__(self, level, powerup='regular', power=41.1, target='distance', delay=3.05,
+            ignore_sticky=False, batch=1, fast=False, substeps=1, every=None, profile=False, verbose=False):
+        if target not in targets.TARGETS:
+            raise ValueError("unknown target {}, use one of {}".format(target, ', '.join(sorted(targets.TARGETS))))
+        self.level = level
+        self.powerup = powerup
+        self.submode = POWERUPS.get(powerup, SUBMODE_NORMAL)
+        self.target = target
+        self.delay = delay
+        self.ignore_sticky = ignore_sticky
+        self.batch = max(1, batch)
+        self.fast = fast
+        self.max_substeps = max(1, substeps)
+        self.recording = every is not None
+        self.every = max(1, every or 1)
+        self.profiling = profile
+        self.verbose = verbose
+
+        self.ball_elasticity = BALL_ELASTICITY
+        self.terrain_elasticity = TERRAIN_ELASTICITY
+        if self.submode == SUBMODE_HEAVY:
+            self.ball_elasticity = 0
+            self.terrain_elasticity = 0
+
+        self.startx, self.starty = level.start
+        self.stopx, self.stopy = level.flag
+        self.right, self.top = level.right, level.top
+
+        # calls and seconds by function or collision handler, only counted when profiling
+        self.counters = {}
+        # wall time of building the space and of the masks
+        self.timings = {}
+        self.snapshots = {} # pre-launch world by delay and step
+        self.trackcache = {} # mover tracks by step size, see track()
+        self.now = 0
+
+        t = time.time()
+        self.build()
+        self.timings['build'] = time.time() - t
+        t = time.time()
+        self.load_masks()
+        self.timings['masks'] = time.time() - t
+        self.movers()
+        if self.fast and self.max_substeps > 1:
+            # the substeps depend on every shape a ball flies close by, which a jump can not repeat
+            print("Substeps change free flight near shapes, no fast forward with substeps")
+            self.fast = False
+
+        if self.profiling:
+            # the whole of every step, the space step and the mover updates around it, the ball
+            # forces and the jumps through free flight
+            self.space.step = profiled(self.counters, 'step', self.space.step)
+            for name in ('advance', 'track', 'forces', 'fast_forward'):
+                setattr(self, name, profiled(self.counters, name, getattr(self, name)))
+
+        self.use_power(power)
+
+    # PHYSICS
+
+    def build(self):
+        """the space with all shapes of the level, the first ball and the collision handlers"""
+        level = self.level
+        self.space = space = pymunk.Space()
+        if self.submode == SUBMODE_ANTIGRAV:
+            space.gravity = (0,level.gravity)
+        else:
+            space.gravity = (0,-level.gravity)
+        static = space.static_body
+
+        self.bodies = bodies = {}
+        self.portals = portals = {}
+        self.lasers = {}
+        # the force fields in the order of their rows, see fields.compile_fields()
+        rows = []
+
+        bbox = make_square(((0,2500),(self.right,self.top)))
+
+        body = pymunk.Body(body_type = pymunk.Body.STATIC)
+        body.id_ = "bbox"
+        body.reset_position = body.position
+        bodies['bbox']=body
+        #left wall
+        segment = pymunk.Segment(body, bbox[0], bbox[1], SEGMENT_THICKNESS)
+        segment.elasticity = SIDEWALL_ELASTICITY
+        segment.friction = TERRAIN_FRICTION
+        segment.color=(150,40,40)
+        space.add(segment)
+        #right wall
+        segment = pymunk.Segment(body, bbox[2], bbox[3], SEGMENT_THICKNESS)
+        segment.elasticity = SIDEWALL_ELASTICITY
+        segment.friction = TERRAIN_FRICTION
+        segment.color=(150,40,40)
+        space.add(segment)
+
+        # the compiled records come in node order, so shapes are added in the order of the plist
+        for record in level.compiled['records']:
+            kind = record['kind']
+            pos = plus(record.get('pos', (0,0)), level.screen_center)
+
+            if kind == 'terrain':
+                body = pymunk.Body(body_type = pymunk.Body.KINEMATIC)
+                body.position = pos
+                body.reset_position = pos
+
+                for p0, p1 in level.lines(record):
+                    segment = pymunk.Segment(body, p0, p1, SEGMENT_THICKNESS)
+                    segment.elasticity = self.terrain_elasticity
+                    segment.friction = TERRAIN_FRICTION
+                    segment.filter = solid_filter
+                    segment.collision_type = collision_types['wall']
+                    segment.surface = 'plain'
+                    segment.color=(80,200,80)
+                    if record['moving']:
+                        segment.color=(20,60,20)
+                    space.add(segment)
+
+                body.angle = numpy.deg2rad(-record['rotation'])
+                body.reset_angle = body.angle
+                body.id_ = record['id']
+                bodies[record['id']] = body
+
+            elif kind == 'field':
+                body = pymunk.Body(body_type = pymunk.Body.KINEMATIC)
+                body.center_of_gravity = record['center-of-gravity']
+                body.position = pos
+                body.reset_position = body.position
+                segment = pymunk.Poly(body, [tuple(v) for v in record['vertices']], radius=SEGMENT_THICKNESS)
+                segment.color=(80,80,200)
+                segment.filter = pass_filter
+                segment.collision_type = collision_types['antigrav']
+                segment.sensor = True
+                segment.field = len(rows)
+                v = record['strength'] * ANTIGRAV_FACTOR
+                a = numpy.deg2rad(record['rotation'])
+                rows.append({'push': (v * math.sin(a), v * math.cos(a))})
+                space.add(segment)
+
+                body.angle = numpy.deg2rad(-record['rotation'])
+                body.reset_angle = body.angle
+                bodies[record['id']] = body
+
+            elif kind == 'sand':
+                for p0, p1 in level.lines(record):
+                    segment = pymunk.Segment(static, plus(pos,p0), plus(pos,p1), SEGMENT_THICKNESS)
+                    segment.elasticity = 999
+                    segment.friction = 999
+                    segment.color=(200,200,40)
+                    segment.filter = solid_filter
+                    segment.collision_type = collision_types['sand']
+                    space.add(segment)
+
+            elif kind == 'water':
+                for p0, p1 in level.lines(record):
+                    segment = pymunk.Segment(static, plus(pos,p0), plus(pos,p1), SEGMENT_THICKNESS)
+                    segment.elasticity = 1.5 #TODO: how bouncy?
+                    segment.friction = TERRAIN_FRICTION
+                    segment.color=(40,40,150)
+                    segment.collision_type = collision_types['water']
+                    space.add(segment)
+
+            elif kind == 'magnet':
+                body = pymunk.Body(body_type = pymunk.Body.KINEMATIC)
+                radius = record['radius']
+                strength = record['strength']
+                magnet = pymunk.Circle(body, radius, pos)
+                magnet.filter = pass_filter
+                magnet.sensor = True
+                magnet.color = (200, 200, 200) if record['snapped'] else (200, 200, 200, 50)
+                magnet.collision_type = collision_types['magnet']
+                magnet.field = len(rows)
+                rows.append({'center': pos, 'radius': radius, 'strength': strength})
+                space.add(magnet)
+
+            elif kind == 'saw':
+                body = pymunk.Body(body_type = pymunk.Body.KINEMATIC)
+                saw = pymunk.Circle(body, record['radius'], pos)
+                saw.filter = solid_filter
+                saw.elasticity = self.terrain_elasticity
+                saw.friction = TERRAIN_FRICTION
+                saw.color = (150,150,150)
+                if not self.submode == SUBMODE_SHIELD:
+                    saw.collision_type = collision_types['water']
+                space.add(saw)
+                body.reset_position = body.position
+                bodies[record['id']]=body
+
+            elif kind == 'portal':
+                segment = pymunk.Segment(bodies[record['body']], record['a'], record['b'], SEGMENT_THICKNESS)
+                segment.elasticity = 999
+                segment.friction = 999
+                segment.color=(200,100,40)
+                segment.collision_type = collision_types['portal']
+                segment.portal_id = record['id']
+                segment.portal_angle = record['angle']
+                segment.linked_portal = record['link']
+                space.add(segment)
+
+                portals[record['id']] = segment
+
+            elif kind == 'laser':
+                on, off = record['on'], record['off']
+
+                #SENSOR
+                segment = pymunk.Segment(bodies[record['body']], record['a'], record['sensor'], SEGMENT_THICKNESS)
+                segment.elasticity = 999
+                segment.friction = 999
+                segment.color=(80,40,0)
+                segment.collision_type = collision_types['lasersensor']
+                segment.period = (on+off)
+                segment.onperiod = on
+                segment.sensor=True
+                space.add(segment)
+
+                #LASER
+                segment2 = pymunk.Segment(bodies[record['body']], record['a'], record['beam'], SEGMENT_THICKNESS)
+                segment2.elasticity = 999
+                segment2.friction = 999
+                segment2.color=(200,40,40)
+                segment2.collision_type = collision_types['laser']
+                segment2.period = (on+off)
+                segment2.onperiod = on
+                space.add(segment2)
+
+                self.lasers[record['body']]=(segment, segment2)
+
+        self.fields = forcefields.compile_fields(rows)
+
+        # teleport() steps the space to move the ball out of the portal, that would move a whole batch
+        if portals:
+            self.batch = 1
+
+        # the first ball flies the countdown and the shots in the display modes, the others join in batches
+        self.ball = self.make_ball()
+        self.balls = [self.ball]
+        space.add(self.ball)
+        space.add(self.ball.circle)
+
+        for kind, callback, name in HANDLERS:
+            f = getattr(self, name)
+            if self.profiling:
+                # every handler counts as itself, also when it calls die() or stick()
+                f = profiled(self.counters, name, f)
+            setattr(space.add_collision_handler(collision_types[kind], collision_types['ball']), callback, f)
+
+    def load_masks(self):
+        """decode the masks of the level and tag the terrain segments under them, see classify()"""
+        self.level.load_masks()
+        self.masks = [m for m in self.level.masks if not (m['type'] == 'sticky' and self.ignore_sticky)]
+        self.acids = {m['node']: m for m in self.masks if m['type'] == 'acid'}
+        self.stickies = {m['node']: m for m in self.masks if m['type'] != 'acid'}
+        for id_ in set(self.acids) | set(self.stickies):
+            if id_ in self.bodies:
+                self.classify(self.bodies[id_])
+
+    def surface_at(self, body, near, point):
+        """what a point in body coordinates of a terrain body is covered with: acid, sticky or plain.
+        near are the (tag, mask dict, grown mask) of the body, see classify(). The masks are textures
+        of the node, width x height and unrotated like its vertices, with the VERTICAL axis inverted:
+        body coordinates map to mask pixels without turning them by the rotation of the node."""
+        for tag, m, mask in near:
+            imgxy = (int(round(point[0]+body.reset_position[0]-m['pos'][0])) + SEGMENT_THICKNESS,
+                     int(round(window[1]-point[1]-body.reset_position[1]-m['pos'][1])) + SEGMENT_THICKNESS)
+            if 0 <= imgxy[1] < mask.shape[0] and 0 <= imgxy[0] < mask.shape[1] and mask[imgxy[1], imgxy[0]]:
+                return tag
+        return 'plain'
+
+    def classify(self, body):
+        """split the segments of a terrain body with acid or sticky masks into runs of the same
+        surface, so the wall callback only has to look at the shape it hit. A segment is acid or
+        sticky where the mask is set within the segment thickness, which is where the ball touches
+        it. The tags are in body coordinates, so they move and rotate with the body."""
+        near = [(tag, m, masking.grown(m['mask'], SEGMENT_THICKNESS)) for tag, m in
+                (('acid', self.acids.get(body.id_)), ('sticky', self.stickies.get(body.id_)))
+                if m and not (tag == 'acid' and self.submode == SUBMODE_SHIELD)]
+        for segment in [s for s in body.shapes if isinstance(s, pymunk.Segment)]:
+            a, b = segment.a, segment.b
+            # one sample per pixel along the segment
+            count = max(1, int(math.ceil((b - a).length)))
+            tags = [self.surface_at(body, near, a + (b - a) * (i / count)) for i in range(count + 1)]
+            runs = []
+            begin = 0
+            for i in range(1, count + 1):
+                if tags[i] != tags[i-1]:
+                    # the run ends halfway between the last sample of one surface and the next
+                    runs.append((begin, (i - 0.5) / count, tags[i-1]))
+                    begin = (i - 0.5) / count
+            runs.append((begin, 1, tags[count]))
+            if len(runs) == 1:
+                segment.surface = runs[0][2]
+                continue
+            self.space.remove(segment)
+            segment.body = None
+            parts = []
+            for t0, t1, tag in runs:
+                part = pymunk.Segment(body, a + (b - a) * t0, a + (b - a) * t1, SEGMENT_THICKNESS)
+                part.elasticity = segment.elasticity
+                part.friction = segment.friction
+                part.filter = segment.filter
+                part.collision_type = segment.collision_type
+                part.color = segment.color
+                part.surface = tag
+                parts.append(part)
+            # the ball rolls over the joints as over one segment
+            for i, part in enumerate(parts):
+                part.set_neighbors(parts[i-1].b if i else part.a, parts[i+1].a if i+1 < len(parts) else part.b)
+            self.space.add(*parts)
+
+    def movers(self):
+        """the timelines of the moving bodies, and what fast forward and substeps need to know
+        about the shapes"""
+        bodies = self.bodies
+        # movers, as timelines of how far each body has turned or moved since the start
+        self.spins = timeline.compile_timeline({id_: r for id_, r in self.level.compiled['rotations'].items() if id_ in bodies},
+                lambda s: -numpy.deg2rad(s['rotation-rate']) if s['type']=='rotate' else 0)
+        self.spinning = [bodies[id_] for id_ in self.spins['ids']]
+        self.spin_origins = numpy.array([getattr(body, 'reset_angle', 0) for body in self.spinning], dtype=float)
+
+        self.slides = timeline.compile_timeline({id_: r for id_, r in self.level.compiled['translations'].items() if id_ in bodies},
+                lambda s: s['move-position'] if s['type']=='position' else 0)
+        self.sliding = [bodies[id_] for id_ in self.slides['ids']]
+        self.slide_origins = numpy.array([tuple(body.reset_position) for body in self.sliding], dtype=float).reshape(-1, 2)
+
+        # how far the shapes of every spinning body reach from its center
+        self.spin_reach = [max([extent(shape) for shape in body.shapes], default=0) for body in self.spinning]
+
+        if self.fast and (self.spinning or self.sliding):
+            # the broadphase files the movers anew as they go, left behind by a jump they would
+            # change the order later contacts are found in
+            print("Movers, no fast forward in this level")
+            self.fast = False
+        elif self.fast:
+            self.shapegrid = flight.index(self.capsules(), FAST_CLEARANCE)
+
+    def capsules(self):
+        """all shapes but the balls as capsules (x0, y0, x1, y1, radius), for a level without movers.
+        Shapes that are not plain segments become circles around their bounding box."""
+        caps = []
+        for shape in self.space.shapes:
+            if shape.collision_type == collision_types['ball']:
+                continue
+            body = shape.body
+            if isinstance(shape, pymunk.Segment):
+                a, b = body.local_to_world(shape.a), body.local_to_world(shape.b)
+                caps.append((a.x, a.y, b.x, b.y, shape.radius))
+                continue
+            bb = shape.cache_bb()
+            x, y = (bb.left + bb.right) / 2, (bb.bottom + bb.top) / 2
+            caps.append((x, y, x, y, numpy.hypot(bb.right - bb.left, bb.top - bb.bottom) / 2))
+        return caps
+
+    def make_ball(self):
+        """a new ball body with its circle, not yet added to the space"""
+        b = pymunk.Body(mass=BALL_MASS, moment=BALL_MOMENT)
+
+        circle = pymunk.Circle(b, radius=BALL_RADIUS)
+        circle.filter = ball_filter
+        circle.elasticity = self.ball_elasticity
+        circle.friction = BALL_FRICTION
+        circle.collision_type = collision_types['ball']
+
+        b.circle = circle
+        b.shot = Shot()
+        return b
+
+    # COLLISION HANDLERS
+
+    def enter_field(self, arbiter, space, data):
+        field, circle = arbiter.shapes
+        circle.body.shot.enter(field.field)
+        return True
+
+    def leave_field(self, arbiter, space, data):
+        field, circle = arbiter.shapes
+        circle.body.shot.leave(field.field)
+        return True
+
+    def check_water(self, arbiter, space, data):
+        shot = arbiter.shapes[1].body.shot
+        if shot.splashed or not self.submode == SUBMODE_SHIELD:
+            shot.splashed = False
+            return self.die(arbiter, space, data)
+        shot.splashed = True
+        return True
+
+    def note(self, ball, kind):
+        """record an event of a shot where the ball is now, when recording"""
+        if self.recording:
+            ball.shot.events.append((len(ball.shot.poses), kind, ball.position.x, ball.position.y))
+
+    def die(self, arbiter, space, data):
+        ball = arbiter.shapes[1].body
+        if not ball.shot.dead:
+            self.note(ball, 'death')
+        ball.velocity = (0,0)
+        ball.shot.dead = True
+        return False
+
+    def stick(self, arbiter, space, data):
+        ball = arbiter.shapes[1].body
+        if not ball.shot.stuck:
+            self.note(ball, 'stick')
+        ball.velocity = (0,0)
+        ball.shot.stuck = True
+        return True
+
+    def teleport(self, arbiter, space, data):
+        #disable until this is fixed
+        #return self.die(arbiter, space, data)
+
+        segment, circle = arbiter.shapes
+        ball = circle.body
+        if ball.shot.teleporting:
+            return False
+
+        id_ = segment.portal_id
+        link = segment.linked_portal
+        targ = self.portals[link]
+        verbose = self.verbose
+        if verbose:
+            print("TELEPORT TO ",(targ.a+targ.b)/2)
+
+        n1 = segment.normal
+        n2 = targ.normal
+        #th = n1.get_angle_between(n2)
+        #th = (segment.b-segment.a).get_angle_between(targ.b-targ.a)
+        # FIXME what about moving portals?
+        # FIXME balls can end up in the wall and crash the engine
+        th = segment.portal_angle - targ.portal_angle + math.pi
+        if verbose:
+            print("ROTATE BY" , numpy.rad2deg(th))
+            print("VELOCITY BEFORE" , ball.velocity)
+        ball.velocity = ball.velocity.rotated(-th)
+        if verbose:
+            print("VELOCITY AFTER" , ball.velocity)
+
+        # rotation - normalize origin portal orientation and identify relative position
+        if verbose:
+            print("POSITION" , ball.position)
+            print("POSITION A" , segment.a + segment.body.position)
+            print("POSITION B" , segment.b + segment.body.position)
+        center1 = (segment.a + segment.b) / 2.0 + segment.body.position
+        relative = ball.position - center1
+        if verbose:
+            print("OFFSET BEFORE ROTATION" , relative)
+        relative = relative.rotated(-th)
+        if verbose:
+            print("OFFSET AFTER ROTATION" , relative)
+        center2 = (targ.a + targ.b) / 2.0 + targ.body.position
+        if verbose:
+            print("POSITION BEFORE ROTATION" , ball.position)
+        ball.position = center2 + relative
+        if verbose:
+            print("POSITION AFTER ROTATION" , ball.position)
+
+        # normalize target portal orientation and move 3 ball width away from the portal
+        ball.shot.teleporting = True
+        if verbose:
+            print("POSITION BEFORE TRANSLATION" , ball.position)
+        ball.position = ball.position - n2 * BALL_RADIUS * 3
+        if verbose:
+            print("POSITION AFTER TRANSLATION" , ball.position)
+        ball.shot.teleports += 1
+        self.note(ball, 'teleport')
+        space.step(0.0001)
+        # the step files the ball somewhere else, that is not followed
+        ball.shot.leaf = None
+        return True
+
+    def unteleport(self, arbiter, space, data):
+        arbiter.shapes[1].body.shot.teleporting = False
+        return False
+
+    def check_wall_type(self, arbiter, space, data):
+        ball = arbiter.shapes[1].body
+        shot = ball.shot
+        shot.teleporting = False
+
+        # terrain segments are tagged with the masks at build time, see classify()
+        surface = arbiter.shapes[0].surface
+        startx, starty = self.startx, self.starty
+
+        if surface == 'acid':
+            return self.die(arbiter, space, data)
+        if surface == 'sticky' and (abs(ball.position.x - startx)>GHOST_DISTANCE or abs(ball.position.y - starty)>GHOST_DISTANCE):
+            return self.stick(arbiter, space, data)
+        if self.submode == SUBMODE_STICKY and (abs(ball.position.x - startx)>GHOST_DISTANCE or abs(ball.position.y - starty)>GHOST_DISTANCE):
+           return self.stick(arbiter, space, data)
+        if self.submode == SUBMODE_TUNNEL and (ball.velocity.y<0 or abs(ball.position.x - startx)>GHOST_DISTANCE or abs(ball.position.y - starty)>GHOST_DISTANCE) and ball.position.x>GHOST_DISTANCE and ball.position.x < self.right-GHOST_DISTANCE:
+            if not shot.tunneled:
+                #print ("Tunnel start")
+                #input()
+                shot.tunneled = 1
+                shot.tunnelxy = Vec2d(ball.position)
+                return False
+            elif shot.tunneled == 1:
+                if abs(ball.position.x - shot.tunnelxy.x)>GHOST_DISTANCE or abs(ball.position.y - shot.tunnelxy.y)>GHOST_DISTANCE:
+                    #print ("Tunnel stop", abs(ball.position.x - shot.tunnelxy.x), abs(ball.position.y - shot.tunnelxy.y))
+                    #input()
+                    shot.tunneled = 2
+                else:
+                    #print ("Not fully entered", abs(ball.position.x - shot.tunnelxy.x), abs(ball.position.y - shot.tunnelxy.y))
+                    #input()
+                    pass
+                shot.tunnelxy = Vec2d(ball.position)
+                return False
+            elif shot.tunneled == 2:
+                if abs(ball.position.x - shot.tunnelxy.x)<GHOST_DISTANCE or abs(ball.position.y - shot.tunnelxy.y)<GHOST_DISTANCE:
+                    #print ("Not fully exited", abs(ball.position.x - shot.tunnelxy.x), abs(ball.position.y - shot.tunnelxy.y))
+                    #input()
+                    shot.tunnelxy = Vec2d(ball.position)
+                    return False
+                else:
+                    shot.tunneled = 3
+            # else see below
+        if arbiter.is_first_contact:
+            self.note(ball, 'bounce')
+        return True
+
+    def check_laser(self, arbiter, space, data):
+        if self.submode == SUBMODE_SHIELD:
+            return False
+
+        laser = arbiter.shapes[0]
+        period = laser.period
+        on = laser.onperiod
+        if period == 0 or (self.now % period) <= on:
+            return self.die(arbiter, space, data)
+        else:
+            return False
+
+    # STEPPING
+
+    def use_power(self, p):
+        """switch the simulation to another ball power. Faster balls need smaller steps, and
+        the mover tracks and countdown snapshots depend on the step."""
+        self.power = p
+        self.step = 0.05
+        if p > 50:
+            self.step = 0.025
+        self.time_step = self.step * TIME_FACTOR
+        self.tracks = self.trackcache.setdefault(self.step, {})
+
+    def substeps(self, flying, spin_velocities, slide_velocities):
+        """the number of substeps of the next step: 1 while all balls fly freely or roll along,
+        more while a ball closes in on a shape (or a mover on the ball) fast enough to reach it
+        within the step"""
+        if self.max_substeps == 1 or not flying:
+            return 1
+        STEP = self.step
+        # the fastest a mover surface can come at a ball from further away
+        movers = max([abs(w) * r for w, r in zip(spin_velocities, self.spin_reach)]
+                + [math.hypot(*v) for v in slide_velocities], default=0)
+        n = 1
+        for b in flying:
+            shot = b.shot
+            position, velocity = b.position, b.velocity
+            travel = velocity.length * STEP
+            reach = travel + movers * STEP
+            shot.clear -= movers * STEP
+            if reach <= SUBSTEP_TRAVEL or position.get_distance(shot.clear_at) + travel < shot.clear:
+                continue
+            nearby = self.space.point_query(position, BALL_RADIUS + reach * SUBSTEP_LOOKAHEAD, near_filter)
+            if not nearby:
+                shot.clear_at, shot.clear = position, reach * SUBSTEP_LOOKAHEAD
+                continue
+            shot.clear = 0
+            for near in nearby:
+                # the gradient points from the shape to the ball
+                closing = -(velocity - near.shape.body.velocity_at_world_point(near.point)).dot(near.gradient) * STEP
+                if closing > SUBSTEP_TRAVEL and closing > near.distance - BALL_RADIUS:
+                    n = max(n, math.ceil(closing / SUBSTEP_TRAVEL))
+        return min(n, self.max_substeps)
+
+    def reset_shot(self):
+        """put the ball back on the tee and all bodies back into their initial state"""
+        ball = self.ball
+        # re-adding the ball drops all cached arbiters, so no contact survives from the last shot
+        self.land([ball])
+        ball.shot = Shot()
+
+        ball.position = (self.startx, self.starty+5)
+        ball.velocity = (0,0)
+        ball.angular_velocity = 0
+        pymunk.Body.update_position(ball, 0)
+
+        for id_ in self.bodies.keys():
+            body = self.bodies.get(id_)
+            try:
+                body.angle = getattr(body,'reset_angle')
+            except:
+                body.angle = 0
+            try:
+                body.position = getattr(body,'reset_position')
+            except:
+                pass #TODO?
+            body.velocity = (0,0)
+            body.angular_velocity = 0
+
+        self.space.step(0.00001)
+
+    def track(self, k):
+        """angles, angular velocities, positions and velocities of the movers at the end of step k"""
+        tracks = self.tracks
+        if k not in tracks:
+            # one batched timeline evaluation for a whole block of steps, plus the step before it
+            first = k - k % TRACK_BLOCK
+            times = numpy.arange(first - 1, first + TRACK_BLOCK) * self.time_step
+            angles = self.spin_origins + timeline.at(self.spins, times)[:, :, 0]
+            spin_velocities = numpy.diff(angles, axis=0) / self.step
+            positions = self.slide_origins + timeline.at(self.slides, times)
+            slide_velocities = numpy.diff(positions, axis=0) / self.step
+            for i in range(TRACK_BLOCK):
+                tracks[first + i] = (angles[i+1].tolist(), spin_velocities[i].tolist(),
+                        positions[i+1].tolist(), slide_velocities[i].tolist())
+        return tracks[k]
+
+    def advance(self, flying=()):
+        """move the kinematic bodies and step the space once, in substeps if one of the flying
+        balls is close to something"""
+        angles, spin_velocities, positions, slide_velocities = self.track(round(self.now / self.time_step) + 1)
+
+        # kinematic bodies are driven by velocity, so the solver sees them move and pushes the ball
+        # along, then they are put exactly where the timeline says to avoid drift
+        for body, w in zip(self.spinning, spin_velocities):
+            body.angular_velocity = w
+        for body, v in zip(self.sliding, slide_velocities):
+            body.velocity = v
+
+        n = self.substeps(flying, spin_velocities, slide_velocities)
+        if self.fast:
+            velocities = [tuple(b.velocity) for b in flying]
+        for i in range(n):
+            self.space.step(self.step / n)
+        self.now += self.time_step
+        if self.fast:
+            # follow where the broadphase files the balls, see fast_forward()
+            for b, v in zip(flying, velocities):
+                if b.shot.leaf is not None:
+                    b.shot.leaf = filed(b.shot.leaf, b.position, v)
+
+        for body, angle in zip(self.spinning, angles):
+            body.angle = angle
+        for body, xy in zip(self.sliding, positions):
+            body.position = xy
+
+    def finished(self, ball, cycle, stationary):
+        """whether the shot of a ball is over"""
+        return ball.shot.dead or ball.shot.stuck or stationary > 100 or ball.position.y < 0 or ball.position.y > self.top or cycle > 2000
+
+    def outcome(self, ball, cycle, stationary):
+        """the final state of a shot, scored for the target: (dist, tdist, reason, x, y, cycle, mindist,
+        tunneled, teleports). Everything after dist is kept to score the shot for other targets later,
+        see targets.py."""
+        shot = ball.shot
+        tdist = 1e8
+        if stationary > 100 or shot.stuck:
+            # TODO: improve "proximity" function for the hole, sometimes the shot that is closest to the hole is not the smartest choice.
+            tdist = distance(ball.position.x, self.stopx, ball.position.y, self.stopy) # distance
+
+        reason = "Timeout"
+        if shot.dead:
+            reason = "Dead"
+        elif shot.stuck:
+            reason = "Stuck"
+        elif stationary > 100:
+            reason = "Stationary"
+        elif ball.position.y < 0:
+            reason = "Exit bottom"
+        elif ball.position.y > self.top:
+            reason = "Exit top"
+
+        state = (tdist, reason, ball.position.x, ball.position.y, cycle, shot.mindist, int(shot.tunneled), shot.teleports)
+        keys, table = targets.columns({0: (None,) + state})
+        return (float(targets.score(self.target, table, (self.stopx, self.stopy))[0]),) + state
+
+    def forces(self, ball):
+        """adjust the ball speed for the next cycle: spin damping, antigrav fields and magnets"""
+        shot = ball.shot
+        #ball.angular_velocity = 0
+        ball.angular_velocity = ball.angular_velocity / 1.1
+        if not shot.fields:
+            return
+        # only the fields the ball is inside count, overlapping fields add up
+        if shot.active is None:
+            shot.active = forcefields.active(self.fields, shot.fields)
+        push, magnets = shot.active
+        ball.velocity += push
+        if len(magnets):
+            ball.velocity += forcefields.pull(self.fields, magnets, ball.position.x, ball.position.y, self.step)
+
+    def countdown(self, delay):
+        """run the countdown with the ball pinned to the tee, returns a snapshot of the world at launch"""
+        ball = self.ball
+        self.reset_shot()
+        self.now = 0
+
+        cycle = 0
+        result = None
+        while self.now <= delay:
+            ball.position = (self.startx, self.starty+5)
+            self.advance()
+            cycle += 1
+            if self.finished(ball, cycle, 0):
+                # killed on the tee, this is the result for every angle
+                result = self.outcome(ball, cycle, 0)
+                break
+            self.forces(ball)
+
+        bodies_ = [ball] + list(self.bodies.values())
+        return {
+                'now': self.now,
+                'cycle': cycle,
+                'outcome': result,
+                'bodies': [(body, tuple(body.position), body.angle, tuple(body.velocity), body.angular_velocity) for body in bodies_],
+                'state': ball.shot.get_state()
+                }
+
+    def land(self, flying):
+        """take all balls out of the space and put the given ones (back) in. Re-adding a ball
+        drops its cached arbiters, this fires the separate callbacks of its old contacts."""
+        for b in self.balls:
+            if b in self.space.bodies:
+                self.space.remove(b, b.circle)
+        for b in flying:
+            self.space.add(b, b.circle)
+            b.shot.leaf = leaf(b.position, b.velocity)
+
+    def restore(self, snapshot, flying):
+        """rewind the world to a snapshot taken by countdown(), with the given balls on the tee
+        in the state of the countdown ball. Returns the cycle count."""
+        self.land(flying)
+
+        for body, position, angle, velocity, angular_velocity in snapshot['bodies']:
+            for b in (flying if body is self.ball else [body]):
+                b.position = position
+                b.angle = angle
+                b.velocity = velocity
+                b.angular_velocity = angular_velocity
+
+        for b in flying:
+            b.shot.set_state(snapshot['state'])
+            # chipmunk keeps the penetration bias of the last solved step for the next position update,
+            # it would carry over from whatever the ball hit before. A zero length update clears it.
+            pymunk.Body.update_position(b, 0)
+        self.now = snapshot['now']
+        return snapshot['cycle']
+
+    def settle(self, flying):
+        """after the first step of a shot, keep only the fields the balls still touch. restore() puts
+        them back in the fields of the countdown ball, but without contacts: a field the launch
+        step carries them out of never fires separate."""
+        for b in flying:
+            if b.shot.fields:
+                touching = {getattr(q.shape, 'field', None) for q in self.space.shape_query(b.circle)}
+                for field in b.shot.fields - touching:
+                    b.shot.leave(field)
+
+    def prelaunch(self, delay=None):
+        """the world at launch after waiting for delay seconds (the delay of the simulator if not
+        given). The countdown is the same for every angle, so it is only simulated once per delay
+        and step."""
+        if delay is None:
+            delay = self.delay
+        if (delay, self.step) not in self.snapshots:
+            self.snapshots[delay, self.step] = self.countdown(delay)
+        return self.snapshots[delay, self.step]
+
+    def shoot(self, angle, draw=None):
+        """simulate a single shot, returns its Shot or None if interrupted"""
+        shots = self.volley([angle], draw)
+        return None if shots is None else shots[0]
+
+    def fast_forward(self, flying, cycle):
+        """jump the flying balls ahead through free flight, together with the clock, as far as none
+        of them can touch anything. The balls must have touched nothing for FAST_QUIET steps. The
+        skipped steps come out exactly as if they had been stepped. Returns the number of steps skipped."""
+        STEP = self.step
+        steps = min(FAST_HORIZON, 2000 - cycle)
+        if steps < FAST_MIN:
+            return 0
+        paths = []
+        for b in flying:
+            if b.shot.fields or b.shot.leaf is None:
+                return 0
+            p, v = flight.coast(b.position, b.velocity, self.space.gravity, STEP, steps)
+            # stop before the ball touches anything, leaves the level or stands still
+            ends = numpy.flatnonzero((p[:, 1] < 0) | (p[:, 1] > self.top) | numpy.all(numpy.abs(v) < 0.001, axis=1))
+            steps = min(steps, flight.first_hit(self.shapegrid, p), ends[0] if len(ends) else steps)
+            if steps < FAST_MIN:
+                return 0
+            paths.append((b, p, v))
+
+        every = self.every
+        for b, p, v in paths:
+            shot = b.shot
+            # forces() damps the spin after every step, the angle moves with the spin before that
+            w = numpy.divide.accumulate(numpy.concatenate(((b.angular_velocity,), numpy.full(steps, 1.1))))
+            angles = numpy.add.accumulate(numpy.concatenate(((b.angle,), w[:-1] * STEP)))[1:]
+            # the same sums as distance()
+            dx, dy = self.stopx - p[:steps, 0], self.stopy - p[:steps, 1]
+            shot.mindist = min(shot.mindist, float(numpy.sqrt(dx*dx + dy*dy).min()))
+            if self.recording:
+                first = every - 1 - cycle % every
+                shot.poses += list(zip(p[first:steps:every, 0].tolist(), p[first:steps:every, 1].tolist(), angles[first:steps:every].tolist()))
+            # file the ball in the broadphase everywhere the skipped steps would have
+            box = shot.leaf
+            before = tuple(b.velocity)
+            for xy, after in zip(p[:steps].tolist(), v[:steps].tolist()):
+                moved = filed(box, xy, before)
+                if moved is not box:
+                    b.position, b.velocity = xy, before
+                    self.space.reindex_shape(b.circle)
+                    box = moved
+                before = after
+            shot.leaf = box
+            b.position = tuple(p[steps-1].tolist())
+            b.velocity = tuple(v[steps-1].tolist())
+            b.angle = float(angles[steps-1])
+            b.angular_velocity = float(w[steps])
+
+        for i in range(steps):
+            self.now += self.time_step
+        return steps
+
+    def volley(self, angles, draw=None):
+        """simulate shots at several angles of the current power together, one ball each in the
+        same space. Movers and the broadphase are stepped once for all of them, which makes the
+        shots of several angles approximate: a ball can solve its contacts in another order than
+        it would alone. Returns the Shot of every angle. draw(cycle) is called before every step,
+        when it returns False the volley is interrupted and None returned."""
+        snapshot = self.prelaunch()
+        if snapshot['outcome']:
+            return [Shot(angle, self.power).finish(snapshot['outcome']) for angle in angles]
+        while len(self.balls) < len(angles):
+            self.balls.append(self.make_ball())
+        flying = self.balls[:len(angles)]
+        for b, angle in zip(flying, angles):
+            b.shot = Shot(angle, self.power)
+        cycle = self.restore(snapshot, flying)
+
+        startx, starty, stopx, stopy = self.startx, self.starty, self.stopx, self.stopy
+        recording, every = self.recording, self.every
+        POWER = self.power * POWER_FACTOR + POWER_BASELINE
+        for b, angle in zip(flying, angles):
+            vy = POWER * math.sin(numpy.deg2rad(angle))
+            vx = POWER * math.cos(numpy.deg2rad(angle))
+            b.position = (startx, starty+5)
+            b.velocity = (vx, vy)
+            b.shot.poses = [(startx, starty+5, b.angle)]
+            b.shot.mindist = distance(startx, stopx, starty+5, stopy)
+
+        shots = [b.shot for b in flying]
+        stationary = [0] * len(flying)
+        # steps since a ball last touched something, only counted in fast mode
+        quiet = [0] * len(flying)
+        left = list(range(len(flying)))
+        retry = cycle
+        launched = False
+        while left:
+            if self.fast and cycle >= retry and all(quiet[i] >= FAST_QUIET for i in left):
+                skipped = self.fast_forward([flying[i] for i in left], cycle)
+                # the balls are close to something now, or were when we tried
+                retry = cycle + skipped + FAST_MIN
+                if skipped:
+                    cycle += skipped
+                    for i in left:
+                        stationary[i] = 0
+                        quiet[i] += skipped
+                    continue
+
+            if draw is not None and draw(cycle) is False:
+                return None
+
+            self.advance([flying[i] for i in left])
+            cycle += 1
+            if not launched:
+                self.settle([flying[i] for i in left])
+                launched = True
+
+            for i in list(left):
+                b = flying[i]
+                shot = shots[i]
+                position = b.position
+                shot.mindist = min(shot.mindist, distance(position.x, stopx, position.y, stopy))
+                if recording and cycle % every == 0:
+                    shot.poses.append((position.x, position.y, b.angle))
+                if abs(b.velocity.x) < 0.001 and abs(b.velocity.y) < 0.001:
+                    stationary[i] += 1
+                else:
+                    stationary[i] = 0
+                if self.fast:
+                    touching = []
+                    b.each_arbiter(touching.append)
+                    quiet[i] = 0 if touching else quiet[i] + 1
+
+                if self.finished(b, cycle, stationary[i]):
+                    shot.finish(self.outcome(b, cycle, stationary[i]))
+                    left.remove(i)
+                    if recording and cycle % every:
+                        shot.poses.append((b.position.x, b.position.y, b.angle))
+                    # the first ball stays until the next shot like it always did, for the display
+                    if b is not self.ball:
+                        self.space.remove(b, b.circle)
+                    continue
+
+                self.forces(b)
+
+        return shots
+
+    def sweep(self, cells):
+        """simulate a list of (angle, power) cells in volleys of up to batch balls of the same
+        power, returns (cell, Shot) pairs"""
+        shots = []
+        for power, group in itertools.groupby(cells, key=lambda cell: cell[1]):
+            group = list(group)
+            self.use_power(power)
+            for i in range(0, len(group), self.batch):
+                shots += zip(group[i:i+self.batch], self.volley([a for a, p in group[i:i+self.batch]]))
+        return shots
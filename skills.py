@@ -0,0 +1,31 @@
+# ball power in NoodleNewton of the power skill levels 1-13, by powerup
+SKILLS = {
+        'regular':[25,25.7,26.5,27.4,28.4,29.5,30.7,32.1,33.6,35.3,37.1,39,41.1],
+        'maxp12':[25,25.7,26.5,27.4,28.4,29.5,30.7,32.1,33.6,35.3,37.1,39,39],
+        'super':[54.1,55.8,57.7,60,62.4,65.2,68.3,71.7,75.5,79.6,84.1,89,89],
+        'heavy':[17.4,17.8,18.3,18.9,19.5,20.2,21,21.8,22.8,23.8,24.9,26.1,26.1],
+        'saw':[29.9,30.7,31.5,32.5,33.6,34.8,36.2,37.7,39.3,41.1,43,45.1,45.1]
+        }
+SKILLS['sticky']=SKILLS['maxp12']
+SKILLS['shield']=SKILLS['maxp12']
+SKILLS['tunnel']=SKILLS['maxp12']
+
+def levels(spec, powerup):
+    """the power skill levels of a spec like 'all', '1-13' or '5,9,13'"""
+    if spec == 'all':
+        return list(range(1, len(SKILLS[powerup])+1))
+    result = []
+    for part in spec.split(','):
+        lo, _, hi = part.partition('-')
+        result += range(int(lo), int(hi or lo)+1)
+    return result
+
+def powers(spec, powerup):
+    """the powers of the skill levels of a spec, sorted. Levels with the same power are listed once."""
+    table = SKILLS[powerup]
+    result = set()
+    for p in levels(spec, powerup):
+        if not 1 <= p <= len(table):
+            raise ValueError("no power skill level {} for {}".format(p, powerup))
+        result.add(table[p-1])
+    return sorted(result)
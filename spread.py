@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import numpy
+import sys
+
+# dist of a shot that died, left the level or timed out (see Simulator.outcome() in simulator.py)
+FAILED = 1e16
+
+SPREADS = range(35, 360)
+
+def dense(results, init, count, missing='exclude'):
+    """turn a {tenths: dist} table into an array of count angles starting at init (in tenths).
+    Missing angles are nan, or with missing='interpolate' linear between their neighbours."""
+    scores = numpy.full(count, numpy.nan)
+    for a, dist in results.items():
+        i = int(a) - init
+        if 0 <= i < count:
+            scores[i] = dist
+
+    known = numpy.flatnonzero(~numpy.isnan(scores))
+    if missing == 'interpolate' and len(known):
+        scores = numpy.interp(numpy.arange(count), known, scores[known])
+    return scores
+
+def best_spreads(results, init=0, count=1800, spreads=SPREADS, missing='exclude'):
+    """the best window of every width in spreads over a {tenths: dist} table.
+
+    A window is as good as the sum of its dists. Failed shots count as FAILED each, so the
+    window with the fewest failures wins and the sum of the other dists breaks the tie.
+    Windows over missing angles are skipped (missing='exclude') or use interpolated
+    dists (missing='interpolate'). Returns {spread: center angle in degrees}, None if there is
+    no window or every window only holds failed shots."""
+    scores = dense(results, init, count, missing)
+    spreads = numpy.asarray(list(spreads))
+
+    failed = scores >= FAILED
+    unknown = numpy.isnan(scores)
+    rest = numpy.where(failed | unknown, 0.0, scores)
+
+    # prefix sums, each window is the difference of two entries
+    zero = numpy.zeros(1)
+    c_failed = numpy.concatenate((zero, numpy.cumsum(failed)))
+    c_unknown = numpy.concatenate((zero, numpy.cumsum(unknown)))
+    c_rest = numpy.concatenate((zero, numpy.cumsum(rest)))
+
+    # one row per spread, one column per window start
+    start = numpy.arange(count)
+    end = start[None, :] + spreads[:, None]
+    valid = end <= count
+    end = numpy.minimum(end, count)
+
+    n_failed = c_failed[end] - c_failed[start]
+    n_unknown = c_unknown[end] - c_unknown[start]
+    sums = c_rest[end] - c_rest[start]
+    valid &= n_unknown == 0
+
+    n_failed = numpy.where(valid, n_failed, numpy.inf)
+    fewest = n_failed.min(axis=1)
+    sums = numpy.where(valid & (n_failed == fewest[:, None]), sums, numpy.inf)
+    besta = sums.argmin(axis=1)
+
+    best = {}
+    for spread, b, f in zip(spreads, besta, fewest):
+        if numpy.isinf(f) or f >= spread:
+            # nothing to aim for: every shot of the best window fails
+            best[int(spread)] = None
+        else:
+            best[int(spread)] = round((init + b + (spread - 1) / 2.0) / 10.0, 2)
+    return best
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('./spread.py')
+    parser.add_argument('table', type=str, help='results table written by sim.py --table', nargs=1)
+    parser.add_argument('--min', type=int, help='smallest spread, in tenths of a degree', nargs='?', default=SPREADS.start)
+    parser.add_argument('--max', type=int, help='largest spread, in tenths of a degree', nargs='?', default=SPREADS.stop-1)
+    parser.add_argument('--interpolate', help='interpolate missing angles instead of skipping windows over them', action='store_true')
+    args = parser.parse_args()
+
+    try:
+        table = json.load(open(args.table[0], "r"))
+    except Exception as ex:
+        print(ex)
+        sys.exit(1)
+
+    missing = 'exclude'
+    if args.interpolate or table.get('search') == 'adaptive':
+        missing = 'interpolate'
+    best = best_spreads(table['results'], table['init'], table['count'], range(args.min, args.max+1), missing)
+    for spread, besta in best.items():
+        print ("Spread ", spread/10.0, " - BEST ANGLE ", besta)
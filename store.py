@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+# the results of all headless sweeps, next to results.json
+DATABASE = 'results.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sweeps (
+    id INTEGER PRIMARY KEY,
+    course TEXT NOT NULL,
+    level TEXT NOT NULL,
+    powerup TEXT NOT NULL,
+    power REAL NOT NULL,
+    target TEXT NOT NULL,
+    powerkey TEXT NOT NULL, -- the key in results.json, like 41.1 or super,89
+    hash TEXT,              -- sha256 of the level file, NULL for imported results
+    search TEXT,
+    init INTEGER,           -- first angle, in tenths of a degree
+    count INTEGER,
+    best REAL,              -- angle of the single best shot
+    best35 REAL,            -- center of the best 3.5 degree spread, what results.json holds
+    flagx REAL,             -- where the flag is, to score the shots for other targets
+    flagy REAL,
+    updated REAL NOT NULL,
+    UNIQUE (course, level, powerup, power, target)
+);
+CREATE INDEX IF NOT EXISTS sweeps_hash ON sweeps (hash);
+CREATE INDEX IF NOT EXISTS sweeps_power ON sweeps (powerup, power, target);
+CREATE TABLE IF NOT EXISTS shots (
+    sweep INTEGER NOT NULL REFERENCES sweeps (id) ON DELETE CASCADE,
+    angle INTEGER NOT NULL, -- tenths of a degree
+    dist REAL,
+    tdist REAL,
+    reason TEXT,
+    x REAL,
+    y REAL,
+    cycle INTEGER,
+    mindist REAL,           -- the closest the ball came to the flag
+    tunneled INTEGER,       -- tunnel state at the end, see check_wall_type() in simulator.py
+    teleports INTEGER,
+    PRIMARY KEY (sweep, angle)
+) WITHOUT ROWID;
+"""
+
+# columns added since the first version of the store, older stores get them on connect
+ADDED = (
+        ('sweeps', 'flagx', 'REAL'),
+        ('sweeps', 'flagy', 'REAL'),
+        ('shots', 'mindist', 'REAL'),
+        ('shots', 'tunneled', 'INTEGER'),
+        ('shots', 'teleports', 'INTEGER')
+        )
+
+# the outcome of a shot, in the order of the outcome tuples of simulator.py
+SHOT = ('dist', 'tdist', 'reason', 'x', 'y', 'cycle', 'mindist', 'tunneled', 'teleports')
+
+def connect(path=DATABASE):
+    """open the store, creating it if needed. Many processes can write to it at once."""
+    db = sqlite3.connect(path, timeout=60, isolation_level=None)
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA foreign_keys=ON")
+    db.executescript(SCHEMA)
+    for table_, column, type_ in ADDED:
+        if column not in [row['name'] for row in db.execute("PRAGMA table_info({})".format(table_))]:
+            try:
+                db.execute("ALTER TABLE {} ADD COLUMN {} {}".format(table_, column, type_))
+            except sqlite3.OperationalError:
+                # added by another process meanwhile
+                pass
+    return db
+
+def name(levelfile):
+    """(course, level id) of a level file like levels/dunes_3.plist. Files that are not named
+    like that keep their name as the level, in the course of their directory."""
+    stem = os.path.splitext(os.path.basename(levelfile))[0]
+    course, _, level_id = stem.rpartition('_')
+    if not course or not level_id:
+        course = os.path.basename(os.path.dirname(os.path.abspath(levelfile)))
+        level_id = stem
+    return course, level_id
+
+def key(powerup, power):
+    """the power key of results.json"""
+    if powerup != 'regular':
+        return powerup+","+str(power)
+    return str(power)
+
+def parse_key(k):
+    """(powerup, power) of a power key of results.json. Some old keys have a decimal comma, like 41,1."""
+    powerup, _, power = k.rpartition(',')
+    if powerup.isdigit():
+        return 'regular', float(k.replace(',', '.'))
+    return powerup or 'regular', float(power)
+
+def save(db, course, level_id, powerup, power, target, shots, **sweep):
+    """insert or replace a sweep and its shots {tenths: (dist, tdist, reason, x, y, cycle, ...)} in
+    one transaction, see SHOT. sweep holds the other columns (hash, search, init, count, best,
+    best35, flagx, flagy), the power key defaults to key(powerup, power)."""
+    sweep.setdefault('powerkey', key(powerup, power))
+    columns = ['course', 'level', 'powerup', 'power', 'target', 'updated'] + sorted(sweep)
+    values = [course, str(level_id), powerup, power, target, time.time()] + [sweep[k] for k in sorted(sweep)]
+    # take the write lock at once, so two writers never deadlock upgrading their read locks
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        db.execute("INSERT INTO sweeps ({}) VALUES ({}) ON CONFLICT (course, level, powerup, power, target) DO UPDATE SET {}".format(
+            ', '.join(columns), ', '.join('?' * len(columns)), ', '.join('{0}=excluded.{0}'.format(c) for c in columns[5:])), values)
+        id_ = db.execute("SELECT id FROM sweeps WHERE course=? AND level=? AND powerup=? AND power=? AND target=?", values[:5]).fetchone()[0]
+        db.execute("DELETE FROM shots WHERE sweep=?", (id_,))
+        # shots of older runs and imports have fewer fields, the others stay NULL
+        db.executemany("INSERT INTO shots (sweep, angle, {}) VALUES (?, ?, {})".format(', '.join(SHOT), ', '.join('?' * len(SHOT))),
+                ((id_, int(a)) + tuple(shot) + (None,) * (len(SHOT) - len(shot)) for a, shot in sorted(shots.items())))
+        db.execute("COMMIT")
+    except:
+        db.execute("ROLLBACK")
+        raise
+    return id_
+
+def lookup(db, course=None, level_id=None, powerup=None, power=None, target='distance'):
+    """the sweeps matching all given fields, as dicts"""
+    where = [(c, v) for c, v in (('course', course), ('level', level_id), ('powerup', powerup), ('power', power), ('target', target)) if v is not None]
+    rows = db.execute("SELECT * FROM sweeps{} ORDER BY course, level, powerup, power".format(
+        ' WHERE ' + ' AND '.join(c + '=?' for c, v in where) if where else ''), [v if c != 'level' else str(v) for c, v in where])
+    return [dict(row) for row in rows]
+
+def table(db, sweep_id):
+    """the shots of a sweep as {tenths: (dist, tdist, reason, x, y, cycle, mindist, tunneled, teleports)}"""
+    rows = db.execute("SELECT angle, {} FROM shots WHERE sweep=? ORDER BY angle".format(', '.join(SHOT)), (sweep_id,))
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+def export(db, target='distance'):
+    """all sweeps of a target in the shape of results.json: {course: {level: {power key: best35}}},
+    sweeps without a resting shot are left out"""
+    besties = {}
+    for s in lookup(db, target=target):
+        if s['best35'] is None:
+            continue
+        besties.setdefault(s['course'], {}).setdefault(s['level'], {})[s['powerkey']] = s['best35']
+    return besties
+
+def import_json(db, besties, target='distance'):
+    """add the sweeps of a results.json dict that are not in the store yet, returns how many"""
+    added = 0
+    for course, levels in besties.items():
+        for level_id, keys in levels.items():
+            for k, best35 in keys.items():
+                powerup, power = parse_key(k)
+                if lookup(db, course, level_id, powerup, power, target):
+                    continue
+                save(db, course, level_id, powerup, power, target, {}, powerkey=k, best35=best35)
+                added += 1
+    return added
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('./store.py')
+    parser.add_argument('command', type=str, help='what to do [export, import, show]', nargs=1)
+    parser.add_argument('file', type=str, help='results.json to export to or import from (default: results.json)', nargs='?', default='results.json')
+    parser.add_argument('--db', type=str, help='results store', nargs='?', default=DATABASE)
+    parser.add_argument('-t', '--target', type=str, help='optimization target of the results', nargs='?', default='distance')
+    parser.add_argument('-c', '--course', type=str, help='only show this course', nargs='?', default=None)
+    parser.add_argument('-l', '--level', type=str, help='only show this level', nargs='?', default=None)
+    args = parser.parse_args()
+
+    try:
+        db = connect(args.db)
+        command = args.command[0]
+        if command == 'export':
+            # write and rename, so swipe.py never reads half a file
+            tmp = args.file + '.tmp'
+            with open(tmp, 'w') as fd:
+                json.dump(export(db, args.target), fd, indent=2)
+            os.replace(tmp, args.file)
+        elif command == 'import':
+            with open(args.file) as fd:
+                print("Imported", import_json(db, json.load(fd), args.target), "results")
+        elif command == 'show':
+            for s in lookup(db, args.course, args.level, target=args.target):
+                print(s['course'], s['level'], s['powerkey'], s['best35'], s['best'], s['count'], time.ctime(s['updated']))
+        else:
+            print("Unknown command", command)
+            sys.exit(1)
+    except (OSError, ValueError, sqlite3.Error) as ex:
+        print(ex)
+        sys.exit(1)
@@ -1,11 +1,11 @@
 #!/usr/bin/env python3
 
-import json 
 import math
 import numpy
 import os
 import sys
-import time
+
+import index
 
 # how to determine: `adb shell wm size` - centerx is half of the override size
 CENTERX = 360
@@ -18,26 +18,31 @@ SPEED = 100
 try:
   course = sys.argv[1]
   level  = sys.argv[2]
+  # power in NoodleNewton and powerup, like in sim.py
+  power = float(sys.argv[3]) if len(sys.argv) > 3 else 41.1
+  powerup = sys.argv[4] if len(sys.argv) > 4 else 'regular'
 except Exception as x:
   print(x)
   sys.exit(1)
 
-with open('results.json', 'r') as json_file:
-  data = json.load(json_file)
-
-  power = 41.1
-  angle = data.get(course).get(level).get("41.1")
-  if angle is None:
-     # TODO: try and get a different power level
-     print("No swipe possible")
-     sys.exit(1)
-  
-  r = RADIUS * 41.1 / power
-
-  rx = r * math.cos(numpy.deg2rad(angle)) 
-  ry = r * math.sin(numpy.deg2rad(angle))
-
-  print("BEST ANGLE {}".format(angle))
-  print("adb shell input touchscreen swipe {} {} {} {} {}".format(CENTERX, CENTERY, CENTERX-rx, CENTERY+ry, SPEED))
-  input()
-  os.system("adb shell input touchscreen swipe {} {} {} {} {}".format(CENTERX, CENTERY, CENTERX-rx, CENTERY+ry, SPEED))
+try:
+  angle, confidence = index.load().lookup(course, level, powerup, power)
+except (OSError, ValueError) as x:
+  print(x)
+  sys.exit(1)
+
+if angle is None:
+  print("No swipe possible")
+  sys.exit(1)
+
+r = RADIUS * 41.1 / power
+
+rx = r * math.cos(numpy.deg2rad(angle)) 
+ry = r * math.sin(numpy.deg2rad(angle))
+
+print("BEST ANGLE {} ({})".format(angle, confidence))
+if confidence == 'low':
+  print("The best angle changes between the simulated powers, simulate this power to be sure")
+print("adb shell input touchscreen swipe {} {} {} {} {}".format(CENTERX, CENTERY, CENTERX-rx, CENTERY+ry, SPEED))
+input()
+os.system("adb shell input touchscreen swipe {} {} {} {} {}".format(CENTERX, CENTERY, CENTERX-rx, CENTERY+ry, SPEED))
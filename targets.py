@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import argparse
+import numpy
+import sys
+import time
+
+import store
+from spread import best_spreads
+
+# what a shot leaves behind, in the order of the outcome tuples of simulator.py after dist
+FIELDS = ('tdist', 'reason', 'x', 'y', 'cycle', 'mindist', 'tunneled', 'teleports')
+
+# dist of a shot that did not come to rest, before it is squared
+MISSED = 1e8
+
+RESTING = ("Stuck", "Stationary")
+
+# the optimization targets: how good the resting place of every shot of a table is, lower is
+# better. t holds a numpy array per field, flag is the (x, y) of the flag.
+TARGETS = {
+        'distance': lambda t, flag: t['tdist'],
+        'right': lambda t, flag: (flag[0] - t['x']) * 3 - t['y'], # as right as possible, then low
+        'left': lambda t, flag: -(flag[0] - t['x']) * 3 + t['y'], # as left as possible, then low
+        'high': lambda t, flag: -t['x'] - t['y'], # as high as possible, then right
+        'topleft': lambda t, flag: t['x'] - t['y'], # as high as possible, then left
+        'low': lambda t, flag: -t['x'] + t['y'] * 4, # as low as possible, then right
+        'lowerleft': lambda t, flag: t['x'] + t['y'] * 4, # as low as possible, then left
+        'speed': lambda t, flag: numpy.zeros(len(t['x'])),
+        'swish': lambda t, flag: numpy.zeros(len(t['x'])),
+        # new: the closest the ball came to the flag on the way, then where it rests
+        'closest': lambda t, flag: t['mindist'] * 10 + t['tdist'] / 10
+        }
+for alias, target in (('topright', 'high'), ('upperleft', 'high'), ('top', 'high'),
+        ('lowerright', 'low'), ('bottomright', 'low'), ('bottomleft', 'lowerleft')):
+    TARGETS[alias] = TARGETS[target]
+
+# targets that do not add the time the shot takes
+TIMELESS = ('swish',)
+
+def columns(outcomes):
+    """the outcomes {key: (dist, tdist, reason, x, y, cycle, ...)} as (keys, {field: numpy array}).
+    Fields that older outcomes do not have are nan."""
+    keys = list(outcomes)
+    t = {}
+    for i, field in enumerate(FIELDS, 1):
+        values = [o[i] if len(o) > i and o[i] is not None else numpy.nan for o in outcomes.values()]
+        t[field] = numpy.array(values, dtype=object if field == 'reason' else float)
+    return keys, t
+
+def score(target, t, flag):
+    """the dist of every shot of a table for a target: squared, MISSED squared for shots that did
+    not come to rest"""
+    if target not in TARGETS:
+        raise ValueError("unknown target {}, use one of {}".format(target, ', '.join(sorted(TARGETS))))
+    dist = TARGETS[target](t, flag)
+    if target not in TIMELESS:
+        # include speed in the result
+        dist = dist + t['cycle']
+    resting = numpy.isin(t['reason'], RESTING)
+    return numpy.where(resting, dist, MISSED) ** 2
+
+def rescore(outcomes, target, flag):
+    """{key: dist} of outcomes for another target"""
+    keys, t = columns(outcomes)
+    return dict(zip(keys, score(target, t, flag).tolist()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('./targets.py')
+    parser.add_argument('course', type=str, help='course of the stored sweep', nargs=1)
+    parser.add_argument('level', type=str, help='level of the stored sweep', nargs=1)
+    parser.add_argument('-t', '--target', type=str, help='target to score the shots for [{}]'.format(', '.join(sorted(TARGETS))), nargs='?', default='distance')
+    parser.add_argument('-n', '--newton', type=float, help='power of the sweep (NoodleNewton), default: all stored powers', nargs='?', default=None)
+    parser.add_argument('-u', '--powerup', type=str, help='powerup of the sweep', nargs='?', default='regular')
+    parser.add_argument('--db', type=str, help='results store', nargs='?', default=store.DATABASE)
+    parser.add_argument('--save', help='store the rescored sweep under the new target', action='store_true')
+    args = parser.parse_args()
+
+    try:
+        db = store.connect(args.db)
+        sweeps = [s for s in store.lookup(db, args.course[0], args.level[0], args.powerup, args.newton, target=None) if s['count']]
+        # the shots do not depend on the target, any stored sweep of a power will do
+        by_power = {}
+        for s in sweeps:
+            if s['flagx'] is not None and (s['power'] not in by_power or s['target'] == args.target):
+                by_power[s['power']] = s
+        if not by_power:
+            print("No stored sweep with the raw outcomes for", args.course[0], args.level[0], args.powerup)
+            sys.exit(1)
+        for power, s in sorted(by_power.items()):
+            outcomes = store.table(db, s['id'])
+            started = time.perf_counter()
+            results = rescore(outcomes, args.target, (s['flagx'], s['flagy']))
+            scored = [a for a in results if outcomes[a][2] != "Dead" and results[a] < 1e10]
+            best = min(scored, key=lambda a: (results[a], a)) / 10.0 if scored else None
+            best35 = best_spreads(results, s['init'], s['count'], [35], missing='interpolate' if s['search'] != 'grid' else 'exclude')[35]
+            took = time.perf_counter() - started
+            print("{} {} {} {}: best {} best35 {} ({} shots, {:.1f} ms)".format(args.course[0], args.level[0], power, args.target, best, best35, len(outcomes), took * 1000))
+            if args.save:
+                shots = {a: (results[a],) + tuple(o[1:]) for a, o in outcomes.items()}
+                store.save(db, s['course'], s['level'], s['powerup'], power, args.target, shots, hash=s['hash'], search=s['search'],
+                        init=s['init'], count=s['count'], best=best, best35=best35, flagx=s['flagx'], flagy=s['flagy'])
+    except (OSError, ValueError) as ex:
+        print(ex)
+        sys.exit(1)
@@ -0,0 +1,54 @@
+import numpy
+
+def compile_timeline(sequences, delta):
+    """turn mover programs {id: {'steps': [...], 'duration': d}} into one padded piecewise linear timeline.
+
+    delta(step) is how far a step moves its body (a number or a vector), spread evenly over
+    its period. Programs repeat, so each repetition adds the sum of all deltas again."""
+    ids = [id_ for id_, r in sequences.items() if r['duration'] > 0]
+    rows = max([len(sequences[id_]['steps']) for id_ in ids], default=1)
+    dims = max([numpy.size(delta(s)) for id_ in ids for s in sequences[id_]['steps']], default=1)
+
+    ends = numpy.zeros((len(ids), rows))
+    rates = numpy.zeros((len(ids), rows, dims))
+    values = numpy.zeros((len(ids), rows, dims))
+    totals = numpy.zeros((len(ids), dims))
+    for i, id_ in enumerate(ids):
+        steps = sequences[id_]['steps']
+        periods = numpy.array([s['period'] for s in steps])
+        deltas = numpy.array([numpy.broadcast_to(delta(s), dims) for s in steps], dtype=float)
+        n = len(steps)
+        ends[i, :n] = numpy.cumsum(periods)
+        ends[i, n:] = ends[i, n-1]
+        # zero length steps jump, the value of the next step already contains them
+        rates[i, :n] = numpy.divide(deltas, periods[:, None], out=numpy.zeros_like(deltas), where=periods[:, None] > 0)
+        values[i, 1:n] = numpy.cumsum(deltas, axis=0)[:-1]
+        totals[i] = deltas.sum(axis=0)
+
+    durations = ends[:, -1] if len(ids) else numpy.zeros(0)
+    # rows shifted apart, so one searchsorted over the flat array finds the step of every row
+    span = durations.max(initial=0) + 1
+    shifts = numpy.arange(len(ids)) * span
+    return {
+        'ids': ids,
+        'durations': durations,
+        'begins': numpy.hstack((numpy.zeros((len(ids), 1)), ends[:, :-1])),
+        'rates': rates,
+        'values': values,
+        'totals': totals,
+        'flat': (ends + shifts[:, None]).ravel(),
+        'shifts': shifts,
+        'firsts': numpy.arange(len(ids)) * rows
+        }
+
+def at(timeline, now):
+    """how far every mover of a timeline has moved at time now, shape (movers, dims).
+    now may also be an array of times, the result then has shape now.shape + (movers, dims)"""
+    rounds, phase = numpy.divmod(numpy.asarray(now, dtype=float)[..., None], timeline['durations'])
+    # the first step that ends at or after the phase, like the linear walk in the old sim.py
+    step = numpy.searchsorted(timeline['flat'], phase + timeline['shifts']) - timeline['firsts']
+    step = numpy.minimum(step, timeline['rates'].shape[1] - 1)
+    row = numpy.arange(len(timeline['ids']))
+    return (rounds[..., None] * timeline['totals']
+            + timeline['values'][row, step]
+            + timeline['rates'][row, step] * (phase - timeline['begins'][row, step])[..., None])